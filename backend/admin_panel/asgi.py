@@ -2,6 +2,7 @@
 ASGI config for admin_panel project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The backend-events service runs it under uvicorn to serve the /api/events/ stream.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -1,16 +1,23 @@
+from console import replica
+
+
 class SupabaseRouter:
     """
     A router to control all database operations on models in the console app (users, channels).
+    Reads without an explicit alias go to the read replica when one is configured and healthy
+    (console.replica.read_alias); writes always go to the primary and pin the request to it.
     """
     route_app_labels = {'console'}  # نام اپلیکیشن مربوط به users و channels
 
     def db_for_read(self, model, **hints):
         if model._meta.app_label in self.route_app_labels:
-            return 'supabase'
+            return replica.read_alias()
         return 'default'
 
     def db_for_write(self, model, **hints):
         if model._meta.app_label in self.route_app_labels:
+            # خواندن‌های بعدی همین درخواست باید نوشته خودش را ببینند
+            replica.pin()
             return 'supabase'
         return 'default'
 
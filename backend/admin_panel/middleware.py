@@ -1,10 +1,25 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_sequence, compress_string
 from django.views.decorators.csrf import csrf_exempt
 import logging
 import re
 
+from console import deadline, replica, resilience
+
+try:
+    import brotli
+except ImportError:  # brotli اختیاری است؛ بدون آن فقط gzip استفاده می‌شود
+    brotli = None
+
 logger = logging.getLogger(__name__)
 
+re_accepts_gzip = re.compile(r'\bgzip\b')
+re_accepts_br = re.compile(r'\bbr\b')
+
 class CustomCsrfMiddleware(MiddlewareMixin):
     """
     میدل‌ور سفارشی برای مدیریت CSRF در مسیرهای خاص
@@ -99,4 +114,212 @@ class SessionDebugMiddleware(MiddlewareMixin):
             if 'Set-Cookie' in response:
                 logger.debug(f"کوکی‌های تنظیم شده: {response['Set-Cookie']}")
         
-        return response 
\ No newline at end of file
+        return response 
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    فشرده‌سازی پاسخ‌های API با brotli یا gzip بر اساس هدر Accept-Encoding
+    brotli فقط در صورت نصب بودن بسته brotli استفاده می‌شود؛ پاسخ‌های جریانی با gzip فشرده می‌شوند.
+    """
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        min_size = getattr(settings, 'RESPONSE_COMPRESSION_MIN_SIZE', 1024)
+        if not response.streaming and len(response.content) < min_size:
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+        if response.streaming:
+            if response.is_async or not re_accepts_gzip.search(accept_encoding):
+                return response
+            response.streaming_content = compress_sequence(response.streaming_content)
+            del response.headers['Content-Length']
+            encoding = 'gzip'
+        else:
+            if brotli is not None and re_accepts_br.search(accept_encoding):
+                encoding = 'br'
+                # سطح ۵ نسبت فشرده‌سازی نزدیک به سطح ۱۱ دارد با هزینه پردازشی بسیار کمتر
+                compressed = brotli.compress(response.content, quality=5)
+            elif re_accepts_gzip.search(accept_encoding):
+                encoding = 'gzip'
+                compressed = compress_string(response.content)
+            else:
+                return response
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class RequestDeadlineMiddleware:
+    """
+    بودجه زمانی هر درخواست برای فراخوانی‌های Supabase (console.deadline)
+    The budget comes from REQUEST_DEADLINES / REQUEST_DEADLINE_SECONDS by path. Once it is spent,
+    further upstream calls are skipped; an error answer from the view is then replaced by a 504
+    listing the calls that completed and the ones that were skipped.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = deadline.start(deadline.budget_for(request.path_info))
+        try:
+            return self._finish(self.get_response(request))
+        finally:
+            deadline.stop(token)
+
+    async def __acall__(self, request):
+        token = deadline.start(deadline.budget_for(request.path_info))
+        try:
+            return self._finish(await self.get_response(request))
+        finally:
+            deadline.stop(token)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, deadline.DeadlineExceeded):
+            return self._partial_failure(deadline.current())
+        return None
+
+    def _finish(self, response):
+        current = deadline.current()
+        if current is not None and current.exceeded and response.status_code >= 400:
+            # پاسخ خطای view پس از تمام شدن مهلت بیانگر وضعیت واقعی نیست (مثلاً 404 برای GET انجام نشده)
+            return self._partial_failure(current)
+        return response
+
+    def _partial_failure(self, current):
+        logger.warning(f"مهلت درخواست تمام شد؛ فراخوانی‌های انجام نشده: {current.skipped if current else []}")
+        return JsonResponse(
+            {
+                "detail": "مهلت درخواست تمام شد و بخشی از عملیات انجام نشد",
+                "deadline_seconds": current.seconds if current else None,
+                "completed_calls": current.completed if current else [],
+                "skipped_calls": current.skipped if current else [],
+            },
+            status=504,
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+
+class UpstreamUnavailableMiddleware:
+    """
+    پاسخ 503 با Retry-After وقتی Supabase در طول درخواست در دسترس نبوده است (console.resilience)
+    Views turn a failed upstream call into a 404 or a 500; when the circuit was open or every retry failed
+    during the request, such an answer is replaced so clients retry instead of treating the row as missing.
+    Other answers (e.g. a fan-out queued after the outage) are kept; a view's own 503 gets Retry-After.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = resilience.start_request()
+        try:
+            return self._finish(self.get_response(request))
+        finally:
+            resilience.stop_request(token)
+
+    async def __acall__(self, request):
+        token = resilience.start_request()
+        try:
+            return self._finish(await self.get_response(request))
+        finally:
+            resilience.stop_request(token)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, resilience.UpstreamUnavailable):
+            resilience.note_unavailable(exception)
+            return self._unavailable(resilience.unavailable_retry_after())
+        return None
+
+    def _finish(self, response):
+        retry_after = resilience.unavailable_retry_after()
+        if retry_after is None:
+            return response
+        if response.status_code in (404, 500):
+            # «یافت نشد» یا خطای کلی view پیامد در دسترس نبودن upstream است
+            return self._unavailable(retry_after)
+        if response.status_code == 503:
+            response.setdefault('Retry-After', str(retry_after))
+        return response
+
+    def _unavailable(self, retry_after):
+        logger.warning(f"Supabase در دسترس نبود؛ پاسخ 503 با Retry-After={retry_after} داده شد")
+        response = JsonResponse(
+            {"detail": "سرویس Supabase موقتاً در دسترس نیست؛ کمی بعد دوباره تلاش کنید"},
+            status=503,
+            json_dumps_params={'ensure_ascii': False},
+        )
+        response['Retry-After'] = str(retry_after)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    خواندن از primary برای درخواست‌های نوشتنی و کلاینت‌هایی که به تازگی نوشته‌اند
+    A write request reads from the primary and sets a cookie that pins the client's next requests
+    for REPLICA_PIN_SECONDS. Without a read replica (console.replica.configured) it does nothing.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not replica.configured():
+            return self.get_response(request)
+        token = replica.start_pin(self._pinned(request))
+        try:
+            return self._finish(request, self.get_response(request))
+        finally:
+            replica.stop_pin(token)
+
+    async def __acall__(self, request):
+        if not replica.configured():
+            return await self.get_response(request)
+        token = replica.start_pin(self._pinned(request))
+        try:
+            return self._finish(request, await self.get_response(request))
+        finally:
+            replica.stop_pin(token)
+
+    def _pinned(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS') or replica.PIN_COOKIE in request.COOKIES
+
+    def _finish(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            # تا رسیدن این نوشته به replica، خواندن‌های بعدی همین کلاینت از primary انجام می‌شود
+            response.set_cookie(
+                replica.PIN_COOKIE, '1', max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 5),
+                httponly=True, samesite='Lax'
+            )
+        return response
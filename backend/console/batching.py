@@ -0,0 +1,175 @@
+"""
+console/batching.py
+Per-process write-behind buffer for rows that are written to the supabase database in batches:
+- BatchBuffer: thread-safe bounded buffer with a background flusher thread. Subclasses name their
+  settings with `setting_prefix` (<prefix>_BATCH_SIZE, <prefix>_FLUSH_SECONDS, <prefix>_MAX_BUFFER).
+- insert_rows: one multi-row INSERT per batch_size rows, the usual writer of a BatchBuffer.
+
+Used by console.livekit_webhooks and console.audit. Rows still buffered when a process dies are lost;
+a normal exit flushes them (atexit).
+
+Only operational failures (database down, connection lost) put rows back for a retry. A batch that
+fails on its data (DataError, IntegrityError, or an error raised before the query is sent, such as
+psycopg2's ValueError for a NUL character) is split until the bad rows are found; those are dropped
+and counted in `rejected`, so one bad row cannot block everything behind it.
+"""
+
+import atexit
+import logging
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError, DataError, IntegrityError, connections, transaction
+
+from .membership_sync import DB_ALIAS
+from .resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+def insert_rows(table, columns, rows, batch_size, suffix='', using=None):
+    """
+    INSERT rows (tuples in `columns` order) batch_size per statement; returns the number of rows inserted.
+    All statements run in one transaction, so a failed call inserted nothing and may be retried or split.
+    """
+    placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    inserted = 0
+    using = using or DB_ALIAS
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES {', '.join([placeholder] * len(batch))} {suffix}",
+                [value for row in batch for value in row]
+            )
+            inserted += cursor.rowcount
+    return inserted
+
+
+class BatchBuffer:
+    """
+    add() only appends; the flusher thread (started with the first row) hands everything buffered to
+    `writer` every <prefix>_FLUSH_SECONDS, or as soon as <prefix>_BATCH_SIZE rows are waiting. Rows of a
+    failed write go back to the front of the buffer and the thread backs off before trying again;
+    rows the database will never accept are dropped and counted in `rejected`.
+    When <prefix>_MAX_BUFFER rows are waiting, add() refuses new rows and counts them in `dropped`.
+    """
+
+    setting_prefix = None
+    label = 'ردیف'
+    default_batch_size = 500
+    default_flush_seconds = 1.0
+    default_max_buffer = 50000
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._rows = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._failures = 0
+        self.dropped = 0
+        self.rejected = 0
+        atexit.register(self.flush)
+
+    def _setting(self, name, default):
+        return getattr(settings, f'{self.setting_prefix}_{name}', default)
+
+    def batch_size(self):
+        return self._setting('BATCH_SIZE', self.default_batch_size)
+
+    def _max_buffer(self):
+        return self._setting('MAX_BUFFER', self.default_max_buffer)
+
+    def add(self, row):
+        """Buffer one row; False when the buffer is full and the row was dropped."""
+        with self._lock:
+            if len(self._rows) >= self._max_buffer():
+                self.dropped += 1
+                dropped = self.dropped
+                accepted = False
+            else:
+                self._rows.append(row)
+                full = len(self._rows) >= self.batch_size()
+                self._ensure_thread()
+                accepted = True
+        if not accepted:
+            # هر هزار ردیف یک بار لاگ می‌شود تا خود لاگ بار اضافه نسازد
+            if dropped % 1000 == 1:
+                logger.warning(f"بافر {self.label} پر است؛ تاکنون {dropped} ردیف کنار گذاشته شده است")
+            return False
+        if full and not self._failures:
+            self._wake.set()
+        return True
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _ensure_thread(self):
+        # با نگه داشتن self._lock فراخوانی می‌شود
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f'console-{self.setting_prefix}', daemon=True)
+            self._thread.start()
+
+    def _reject(self, batch, error):
+        """A batch the database refused for its data: split it, or drop it when it is a single row."""
+        if len(batch) > 1:
+            middle = len(batch) // 2
+            return [batch[:middle], batch[middle:]]
+        self.rejected += 1
+        logger.error(f"یک {self.label} نامعتبر کنار گذاشته شد (تاکنون {self.rejected}): {error}")
+        return []
+
+    def _requeue(self, rows):
+        with self._lock:
+            self._rows[:0] = rows
+            overflow = len(self._rows) - self._max_buffer()
+            if overflow > 0:
+                del self._rows[-overflow:]
+                self.dropped += overflow
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows taken from the buffer."""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+            if not rows:
+                return 0
+            written = 0
+            # دسته‌هایی که باید نوشته شوند؛ دسته رد شده به دو نیمه تقسیم و به جای خودش گذاشته می‌شود
+            pending = [rows]
+            while pending:
+                batch = pending.pop(0)
+                try:
+                    written += self._writer(batch) or 0
+                except (DataError, IntegrityError) as e:
+                    pending[:0] = self._reject(batch, e)
+                except DatabaseError as e:
+                    unwritten = batch + [row for rest in pending for row in rest]
+                    self._failures += 1
+                    logger.error(f"ذخیره {len(unwritten)} {self.label} ناموفق بود (تلاش {self._failures}): {e}")
+                    # اتصال خراب در تلاش بعدی دوباره ساخته می‌شود
+                    connections[DB_ALIAS].close()
+                    self._requeue(unwritten)
+                    return len(rows) - len(unwritten)
+                except Exception as e:
+                    # خطای پیش از ارسال پرس‌وجو (مثلاً کاراکتر NUL) با تکرار برطرف نمی‌شود
+                    pending[:0] = self._reject(batch, e)
+            self._failures = 0
+            logger.debug(f"{written} {self.label} از {len(rows)} ردیف بافر شده ذخیره شد")
+            return len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._setting('FLUSH_SECONDS', self.default_flush_seconds))
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # رشته پس‌زمینه نباید از کار بیفتد؛ ردیف‌های بعدی همچنان نوشته می‌شوند
+                logger.error(traceback.format_exc())
+            if self._failures:
+                time.sleep(backoff_delay(self._failures))
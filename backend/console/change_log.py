@@ -0,0 +1,170 @@
+"""
+console/change_log.py
+Delta sync over the trigger-maintained change_log table (migration 0015):
+- current_cursor: cursor a client takes before a full list download, to sync from afterwards.
+- parse_cursor / format_cursor: the opaque "<txid>-<id>" cursor string.
+- changes_since: upserted rows and tombstoned uids of one table after a cursor, optionally of one tenant
+  (each entry records the tenant of its row).
+- prune: delete entries older than the retention period (CHANGES_RETENTION_DAYS, prune_change_log command);
+  a cursor from before the pruned part gets CursorExpired, and the client must resync from a full list.
+
+Entries are read in (txid, id) order and only up to the oldest transaction still running, so a
+transaction that commits after a page was served can never land behind the cursor already handed out.
+"""
+
+import logging
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from .models import ChangeLogEntry, ChangeLogPrune
+from .membership_sync import DB_ALIAS
+from .supabase_client import _make_request
+from .tenancy import scoped
+
+logger = logging.getLogger(__name__)
+
+# تعداد uid در هر درخواست in.() تا طول URL محدود بماند
+FETCH_CHUNK_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Raised for a `since` value that is not a cursor issued by this endpoint."""
+
+
+class CursorExpired(Exception):
+    """Raised for a cursor older than the pruned part of change_log; entries after it may be gone."""
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when the changed rows could not be fetched; the cursor must not advance."""
+
+
+def format_cursor(txid, entry_id):
+    return f"{txid}-{entry_id}"
+
+
+def parse_cursor(value):
+    try:
+        txid, entry_id = value.split('-', 1)
+        txid, entry_id = int(txid), int(entry_id)
+    except (AttributeError, ValueError):
+        raise InvalidCursor(value)
+    if txid < 0 or entry_id < 0:
+        raise InvalidCursor(value)
+    return txid, entry_id
+
+
+def _visible_horizon():
+    """txid of the oldest transaction still in progress; everything below it is final."""
+    with connections[DB_ALIAS].cursor() as cursor:
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        return cursor.fetchone()[0]
+
+
+def current_cursor():
+    return format_cursor(_visible_horizon(), 0)
+
+
+def _read_entries(table, since_txid, since_id, horizon, count, tenant=None):
+    """(txid, id, row_uid, op) tuples after the cursor and below the horizon, in cursor order."""
+    entries = ChangeLogEntry.objects.using(DB_ALIAS).filter(table_name=table, txid__lt=horizon)
+    if tenant is not None:
+        entries = entries.filter(tenant_id=int(tenant))
+    return list(
+        entries
+        .filter(Q(txid__gt=since_txid) | Q(txid=since_txid, id__gt=since_id))
+        .order_by('txid', 'id')
+        .values_list('txid', 'id', 'row_uid', 'op')[:count]
+    )
+
+
+def _pruned_through():
+    """txid up to which entries may have been pruned, or None before the first prune."""
+    return (
+        ChangeLogPrune.objects.using(DB_ALIAS)
+        .filter(id=1)
+        .values_list('pruned_through_txid', flat=True)
+        .first()
+    )
+
+
+def prune(older_than, batch_size=5000):
+    """
+    Delete entries logged before `older_than`, `batch_size` rows per statement, and return their number.
+    The watermark is raised before the first delete, so from then on a cursor that could miss a deleted
+    entry is refused instead of silently skipping it.
+    """
+    entries = ChangeLogEntry.objects.using(DB_ALIAS)
+    through = entries.filter(changed_at__lt=older_than).aggregate(txid=Max('txid'))['txid']
+    if through is None:
+        return 0
+    # واترمارک هرگز عقب نمی‌رود، حتی اگر دوره نگهداری بیشتر شده باشد
+    through = max(through, _pruned_through() or 0)
+    ChangeLogPrune.objects.using(DB_ALIAS).update_or_create(
+        id=1, defaults={'pruned_through_txid': through, 'pruned_at': timezone.now()}
+    )
+
+    deleted = 0
+    while True:
+        ids = list(entries.filter(changed_at__lt=older_than).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            break
+        deleted += entries.filter(id__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            break
+    logger.info(f"{deleted} ورودی change_log تا txid {through} حذف شد")
+    return deleted
+
+
+def _fetch_rows(table, uids, tenant=None):
+    rows = []
+    for start in range(0, len(uids), FETCH_CHUNK_SIZE):
+        chunk = uids[start:start + FETCH_CHUNK_SIZE]
+        in_list = ','.join(f'"{uid}"' for uid in chunk)
+        response = _make_request("GET", scoped(f"/rest/v1/{table}?uid=in.({in_list})", tenant))
+        if response is None:
+            raise UpstreamUnavailable(f"خطا در دریافت ردیف‌های تغییر یافته جدول {table}")
+        if isinstance(response, list):
+            rows.extend(response)
+    return rows
+
+
+def changes_since(table, since, limit=None, tenant=None):
+    """
+    Changes of `table` after the `since` cursor, at most `limit` log entries.
+    Returns {'cursor', 'has_more', 'upserts', 'deletes'}; a uid changed several times in the page
+    appears once, as an upsert with its current row or as a tombstone. With `tenant` only that
+    tenant's log entries are read, tombstones included (entries logged before migration 0026 have no
+    tenant and are only returned unscoped).
+    """
+    max_limit = getattr(settings, 'CHANGES_MAX_PAGE_SIZE', 1000)
+    limit = min(limit or max_limit, max_limit)
+    since_txid, since_id = parse_cursor(since)
+    horizon = _visible_horizon()
+
+    entries = _read_entries(table, since_txid, since_id, horizon, limit + 1, tenant)
+    # واترمارک پس از خواندن بررسی می‌شود: prune آن را پیش از حذف بالا می‌برد، پس اگر اینجا هنوز کمتر از
+    # cursor باشد هیچ ورودی از صفحه خوانده شده حذف نشده بود
+    pruned_through = _pruned_through()
+    if pruned_through is not None and since_txid <= pruned_through:
+        raise CursorExpired(since)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for _txid, _id, row_uid, op in entries:
+        latest[row_uid] = op
+    upsert_uids = [uid for uid, op in latest.items() if op == ChangeLogEntry.OP_UPSERT]
+    # ردیفی که پس از ثبت تغییر حذف شده در این صفحه نمی‌آید و در صفحه بعدی به صورت tombstone می‌آید
+    rows = _fetch_rows(table, upsert_uids, tenant) if upsert_uids else []
+    deletes = [uid for uid, op in latest.items() if op == ChangeLogEntry.OP_DELETE]
+
+    if has_more:
+        cursor = format_cursor(entries[-1][0], entries[-1][1])
+    else:
+        cursor = format_cursor(max(horizon, since_txid), 0 if horizon > since_txid else since_id)
+    logger.info(f"{len(entries)} تغییر از جدول {table} پس از {since} بازگردانده شد")
+    return {'cursor': cursor, 'has_more': has_more, 'upserts': rows, 'deletes': deletes}
@@ -0,0 +1,91 @@
+"""
+console/coalescing.py
+Request coalescing ("singleflight") for identical concurrent upstream reads:
+- SingleFlight: runs one call per key at a time; concurrent callers with the same key wait
+  for that call and receive a private copy of its result (or its exception). A waiter gives up
+  when its own request's deadline (console.deadline) runs out before the shared call returns.
+- upstream_gets / view_gets: the process-wide instances for GET requests to Kong made through
+  console.supabase_client (errors raised) and console.views (errors turned into None). They are kept
+  apart so a caller never receives a result shaped by the other helper's error handling.
+
+Only plain reads are coalesced: a caller that reads a row in order to write it back (or reads right
+after its own write) passes coalesce=False, since a shared GET may have been sent before that write.
+"""
+
+import copy
+import logging
+import threading
+
+from django.conf import settings
+
+from . import deadline
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.waiters = 0
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Thread-safe call deduplication keyed by an arbitrary hashable key.
+    The leader gets the object returned by fn; followers each get a deep copy of a
+    snapshot taken before the leader returns, so callers may mutate their result freely.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+            else:
+                call.waiters += 1
+        if not leader:
+            return self._wait(key, call)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            call.result = result
+            return result
+        finally:
+            # از این لحظه درخواست‌های جدید یک فراخوانی تازه شروع می‌کنند
+            with self._lock:
+                self._calls.pop(key, None)
+                if call.waiters and call.error is None:
+                    call.result = copy.deepcopy(call.result)
+            call.done.set()
+
+    def _wait(self, key, call):
+        logger.debug(f"درخواست تکراری در انتظار پاسخ درخواست جاری: {key}")
+        if not call.done.wait(deadline.remaining()):
+            # درخواست مشترک برای دیگران ادامه می‌یابد؛ فقط این درخواست منتظر نمی‌ماند
+            raise deadline.current().skip(f"GET {key}")
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+
+upstream_gets = SingleFlight()
+view_gets = SingleFlight()
+
+
+def coalesce_get(url, fn, flight=None, coalesce=True):
+    """Run fn through flight (upstream_gets by default) keyed by url, unless coalescing is off."""
+    if not coalesce or not getattr(settings, 'SUPABASE_COALESCE_GETS', True):
+        return fn()
+    return (flight or upstream_gets).do(url, fn)
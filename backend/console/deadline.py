@@ -0,0 +1,104 @@
+"""
+console/deadline.py
+Per-request time budget for upstream calls:
+- Deadline: the budget of one request and the upstream calls it completed or skipped.
+- start / stop: bind a deadline to the current context (see admin_panel.middleware.RequestDeadlineMiddleware).
+- budget_for: the budget of a request path from REQUEST_DEADLINE_SECONDS and REQUEST_DEADLINES.
+- clamp / check: used by resilience.send and coalescing so no call outlives the budget.
+
+Without a bound deadline (management commands, outbox workers) every helper is a no-op.
+"""
+
+import contextvars
+import time
+
+import requests
+from django.conf import settings
+
+_current = contextvars.ContextVar('console_request_deadline', default=None)
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised instead of calling an upstream once the request's budget is spent.
+    It is a requests Timeout, so helpers that already degrade on timeouts keep doing so.
+    """
+
+
+class Deadline:
+    def __init__(self, seconds, clock=None):
+        self.seconds = seconds
+        self._clock = clock = clock or time.monotonic
+        self.expires_at = clock() + seconds
+        self.completed = []
+        self.skipped = []
+        self.exceeded = False
+
+    def remaining(self):
+        return max(0.0, self.expires_at - self._clock())
+
+    def skip(self, call):
+        self.exceeded = True
+        self.skipped.append(call)
+        return DeadlineExceeded(f"مهلت {self.seconds} ثانیه‌ای درخواست تمام شد؛ {call} انجام نشد")
+
+
+def start(seconds, clock=None):
+    """Bind a new deadline to the current context; returns the token for stop()."""
+    return _current.set(Deadline(seconds, clock) if seconds else None)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def remaining():
+    """Seconds left in the current budget, or None without a deadline."""
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def exceeded():
+    deadline = _current.get()
+    return deadline is not None and deadline.exceeded
+
+
+def check(call, needed=0.0):
+    """Raise DeadlineExceeded if less than `needed` seconds (or nothing) is left for `call`."""
+    deadline = _current.get()
+    if deadline is not None and deadline.remaining() <= needed:
+        raise deadline.skip(call)
+
+
+def clamp(timeout, call):
+    """The timeout for one attempt of `call`: at most what is left of the budget."""
+    check(call)
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+def interrupted(call):
+    """DeadlineExceeded for a call whose clamped timeout ran out mid-flight."""
+    return _current.get().skip(call)
+
+
+def completed(call):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.completed.append(call)
+
+
+def budget_for(path):
+    """
+    Budget of a request path: the longest matching prefix in REQUEST_DEADLINES, else
+    REQUEST_DEADLINE_SECONDS. A budget of 0 disables the deadline for that route.
+    """
+    routes = getattr(settings, 'REQUEST_DEADLINES', {})
+    matches = [prefix for prefix in routes if path.startswith(prefix)]
+    if matches:
+        return routes[max(matches, key=len)]
+    return getattr(settings, 'REQUEST_DEADLINE_SECONDS', 30.0)
@@ -0,0 +1,245 @@
+"""
+console/events.py
+Server-sent events for channel, user and membership changes (GET /api/events/, ASGI only):
+- EventFilter: per-subscriber filter built from the query string (types, channel, user) and the
+  subscriber's tenant.
+- Broker: one LISTEN connection per process fanning NOTIFY payloads out to subscriber queues and
+  in-process listeners.
+- stream: async generator of SSE frames for one subscriber, with heartbeats.
+
+Events come from the console_log_change() trigger (migration 0016). A `reset` event means events may
+have been lost (listener reconnect, slow subscriber, client reconnect); the client should catch up
+through /api/users/changes/ and /api/channels/changes/.
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+
+from django.conf import settings
+
+from .resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'console_changes'
+EVENT_TYPES = ('channel', 'user', 'membership')
+_TABLE_TYPES = {'channels': 'channel', 'users': 'user'}
+
+
+def to_event(payload):
+    """Turn a trigger NOTIFY payload into the event sent to clients; None if it is not one of ours."""
+    try:
+        data = json.loads(payload)
+        table = data['table']
+        event_type = 'membership' if data['kind'] == 'membership' else _TABLE_TYPES[table]
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"payload نامعتبر از {NOTIFY_CHANNEL}: {payload}")
+        return None
+    event = {'type': event_type, 'table': table, 'uid': data.get('uid'), 'id': data.get('id')}
+    if 'tenant' in data:
+        # از مهاجرت 0026؛ EventFilter رویدادهای سوپر ادمین‌های دیگر را کنار می‌گذارد
+        event['tenant'] = data['tenant']
+    if event_type == 'membership':
+        event['added'] = data.get('added', [])
+        event['removed'] = data.get('removed', [])
+        event['truncated'] = bool(data.get('truncated'))
+    else:
+        event['op'] = data.get('op')
+    return event
+
+
+def _split(value):
+    if not isinstance(value, str) or not value:
+        return set()
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class EventFilter:
+    """
+    Which events a subscriber receives:
+    - types: any of channel, user, membership (default: all)
+    - channels / users: only events about these uids; a membership event also matches when one of
+      them was added or removed (or the member list was too large to send)
+    - tenant: only events of rows owned by this super admin (migration 0026); None for platform staff
+    """
+
+    def __init__(self, types=None, channels=None, users=None, tenant=None):
+        self.types = set(types or EVENT_TYPES)
+        self.channels = set(channels or ())
+        self.users = set(users or ())
+        self.tenant = tenant
+
+    @classmethod
+    def from_query(cls, params, tenant=None):
+        types = _split(params.get('types')) & set(EVENT_TYPES)
+        return cls(types or None, _split(params.get('channel')), _split(params.get('user')), tenant)
+
+    def matches(self, event):
+        if event['type'] == 'reset':
+            return True
+        if event['type'] not in self.types:
+            return False
+        if self.tenant is not None and event.get('tenant') != self.tenant:
+            return False
+        if not self.channels and not self.users:
+            return True
+        own, other = (self.channels, self.users) if event['table'] == 'channels' else (self.users, self.channels)
+        if event['uid'] in own:
+            return True
+        if event['type'] == 'membership' and other:
+            return event['truncated'] or bool(other & (set(event['added']) | set(event['removed'])))
+        return False
+
+
+class _Subscriber:
+    def __init__(self, event_filter, loop):
+        self.filter = event_filter
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=getattr(settings, 'EVENTS_QUEUE_SIZE', 1000))
+
+    def deliver(self, event):
+        # روی event loop مشترک اجرا می‌شود
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # مشترک کند: رویدادهای معوق دور ریخته می‌شوند و کلاینت از /changes/ همگام می‌شود
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'reset'})
+
+
+class Broker:
+    """
+    Process-wide LISTEN connection; the listener thread starts with the first subscriber or listener.
+    Listeners are plain callbacks run on the listener thread for every event (including `reset`), for
+    in-process caches such as console.livekit; `connected` tells them whether events are flowing.
+    """
+
+    def __init__(self):
+        self._subscribers = set()
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.connected = False
+
+    def _ensure_thread(self):
+        # با نگه داشتن self._lock فراخوانی می‌شود
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._listen, name='console-events', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, event_filter):
+        subscriber = _Subscriber(event_filter, asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+            self._ensure_thread()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def add_listener(self, callback):
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+            self._ensure_thread()
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.error(f"خطا در پردازش رویداد {event.get('type')} در listener: {e}")
+        for subscriber in subscribers:
+            if subscriber.filter.matches(event):
+                subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+
+    def _connect(self):
+        import psycopg2
+
+        db = settings.DATABASES['supabase']
+        connection = psycopg2.connect(
+            dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+            host=db['HOST'], port=db['PORT'],
+        )
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        return connection
+
+    def _listen(self):
+        attempt = 0
+        connected_before = False
+        while True:
+            try:
+                connection = self._connect()
+            except Exception as e:
+                attempt += 1
+                logger.error(f"اتصال LISTEN به Postgres ناموفق بود (تلاش {attempt}): {e}")
+                time.sleep(backoff_delay(attempt))
+                continue
+            attempt = 0
+            self.connected = True
+            if connected_before:
+                # رویدادهای زمان قطع اتصال از دست رفته‌اند
+                self.publish({'type': 'reset'})
+            connected_before = True
+            logger.info(f"LISTEN روی {NOTIFY_CHANNEL} آغاز شد")
+            try:
+                while True:
+                    if select.select([connection], [], [], 5) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        event = to_event(connection.notifies.pop(0).payload)
+                        if event is not None:
+                            self.publish(event)
+            except Exception as e:
+                logger.error(f"اتصال LISTEN قطع شد: {e}")
+            finally:
+                self.connected = False
+                try:
+                    connection.close()
+                except Exception:
+                    pass
+
+
+broker = Broker()
+
+
+def format_event(event):
+    """One SSE frame; the change_log id becomes the SSE id when there is one."""
+    lines = []
+    if event.get('id') is not None:
+        lines.append(f"id: {event['id']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event, ensure_ascii=False)}")
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+async def stream(event_filter, last_event_id=None):
+    """SSE frames for one subscriber until the client disconnects."""
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15)
+    subscriber = broker.subscribe(event_filter)
+    try:
+        yield f"retry: {int(getattr(settings, 'EVENTS_RETRY_MS', 3000))}\n\n".encode('utf-8')
+        if last_event_id:
+            # کلاینت پس از قطع اتصال برگشته است؛ رویدادهای این فاصله بازپخش نمی‌شوند
+            yield format_event({'type': 'reset'})
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield b': keep-alive\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        broker.unsubscribe(subscriber)
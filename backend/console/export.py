@@ -0,0 +1,209 @@
+"""
+console/export.py
+Streaming exports of users, channels and channel memberships for audits:
+- DATASETS / FORMATS: what can be exported and in which encodings (csv, jsonl).
+- iter_rows: the column names, then every row of a dataset, read page by page from the supabase database.
+- stream: encoded byte chunks of a dataset, for a StreamingHttpResponse or a file.
+
+Pages are read with keyset pagination (WHERE key > last key ORDER BY key LIMIT n), so each page is one
+short indexed query: memory stays constant and no transaction is held open for the whole export.
+Memberships are flattened from channel_membership (kept in sync with both arrays by migration 0017)
+with channel names and usernames looked up per page. Pages are read from the read replica when one is
+configured and healthy (console.replica). With a tenant (console.tenancy) only that super admin's
+users and channels, and the memberships of its channels, are exported.
+"""
+
+import csv
+import datetime
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connections
+
+from . import jsoncodec, replica
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+# ستون‌های آرایه عضویت در خروجی users و channels نمی‌آیند؛ عضویت‌ها خروجی جداگانه memberships دارند
+_OMITTED_COLUMNS = {'allowed_channels', 'allowed_users', 'name_normalized'}
+
+DATASETS = ('users', 'channels', 'memberships')
+
+MEMBERSHIP_COLUMNS = ['channel_uid', 'channel_name', 'user_uid', 'username', 'created_at']
+
+
+def _batch_size():
+    return getattr(settings, 'EXPORT_BATCH_SIZE', 1000)
+
+
+def _query(sql, params):
+    """(column names, rows) of one query on the supabase database or its replica."""
+    with connections[replica.read_alias()].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def _tenant_clause(tenant, column='tenant_id'):
+    """(SQL condition, params) limiting rows to one tenant; always true without a tenant."""
+    if tenant is None:
+        return 'TRUE', []
+    return f"{column} = %s", [int(tenant)]
+
+
+def _table_rows(table, batch_size, tenant=None):
+    last_uid = None
+    header_sent = False
+    # ایندکس (tenant_id, uid) مهاجرت 0022 صفحه‌های هر سوپر ادمین را هم با keyset می‌خواند
+    condition, params = _tenant_clause(tenant)
+    while True:
+        if last_uid is None:
+            columns, rows = _query(
+                f"SELECT * FROM {table} WHERE {condition} ORDER BY uid LIMIT %s", [*params, batch_size]
+            )
+        else:
+            columns, rows = _query(
+                f"SELECT * FROM {table} WHERE {condition} AND uid > %s ORDER BY uid LIMIT %s",
+                [*params, last_uid, batch_size]
+            )
+        keep = [i for i, name in enumerate(columns) if name not in _OMITTED_COLUMNS]
+        if not header_sent:
+            yield [columns[i] for i in keep]
+            header_sent = True
+        for row in rows:
+            yield tuple(row[i] for i in keep)
+        if len(rows) < batch_size:
+            return
+        last_uid = rows[-1][columns.index('uid')]
+
+
+def _uid_cast(table):
+    """Array type of `table`.uid (uuid, text, varchar...) for `uid = ANY(%s::<type>)` lookups."""
+    _columns, rows = _query(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'uid'",
+        [table]
+    )
+    return f"{rows[0][0]}[]" if rows else 'text[]'
+
+
+def _names(table, column, uids, cast, tenant=None):
+    """{uid: column} for the given uids of `tenant`; uids that cannot be cast to the uid type are skipped."""
+    if cast == 'uuid[]':
+        valid = []
+        for uid in uids:
+            try:
+                valid.append(str(uuid.UUID(uid)))
+            except (ValueError, TypeError):
+                continue
+        uids = valid
+    if not uids:
+        return {}
+    condition, params = _tenant_clause(tenant)
+    _columns, rows = _query(
+        f"SELECT uid::text, {column} FROM {table} WHERE uid = ANY(%s::{cast}) AND {condition}", [list(uids), *params]
+    )
+    return dict(rows)
+
+
+def _membership_rows(batch_size, tenant=None):
+    yield list(MEMBERSHIP_COLUMNS)
+    channel_cast, user_cast = _uid_cast('channels'), _uid_cast('users')
+    if tenant is None:
+        condition, params = 'TRUE', []
+    else:
+        # عضویت‌ها tenant ندارند؛ مالک آنها سوپر ادمین کانال است
+        condition, params = "channel_uid IN (SELECT uid::text FROM channels WHERE tenant_id = %s)", [int(tenant)]
+    last = None
+    while True:
+        if last is None:
+            _columns, rows = _query(
+                "SELECT channel_uid, user_uid, created_at FROM channel_membership "
+                f"WHERE {condition} ORDER BY channel_uid, user_uid LIMIT %s", [*params, batch_size]
+            )
+        else:
+            _columns, rows = _query(
+                "SELECT channel_uid, user_uid, created_at FROM channel_membership "
+                f"WHERE {condition} AND (channel_uid, user_uid) > (%s, %s) ORDER BY channel_uid, user_uid LIMIT %s",
+                [*params, last[0], last[1], batch_size]
+            )
+        channel_names = _names('channels', 'name', {row[0] for row in rows}, channel_cast, tenant)
+        # نام کاربری کاربران سوپر ادمین دیگر (عضویت‌های قدیمی بین tenantها) خالی می‌ماند
+        usernames = _names('users', 'username', {row[1] for row in rows}, user_cast, tenant)
+        for channel_uid, user_uid, created_at in rows:
+            yield (channel_uid, channel_names.get(channel_uid), user_uid, usernames.get(user_uid), created_at)
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def iter_rows(dataset, batch_size=None, tenant=None):
+    """Column names first, then one tuple per row of the dataset (of one tenant when given)."""
+    batch_size = batch_size or _batch_size()
+    if dataset == 'memberships':
+        return _membership_rows(batch_size, tenant)
+    if dataset in ('users', 'channels'):
+        return _table_rows(dataset, batch_size, tenant)
+    raise ValueError(dataset)
+
+
+def _plain(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (uuid.UUID, Decimal)):
+        return str(value)
+    return value
+
+
+def _csv_cell(value):
+    value = _plain(value)
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, dict)):
+        return jsoncodec.dumps(value).decode('utf-8')
+    return value
+
+
+class _Echo:
+    """File-like object whose write() returns the written line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def stream(dataset, fmt, batch_size=None, tenant=None):
+    """
+    Encoded chunks of one dataset, about one page per chunk.
+    CSV starts with a UTF-8 BOM so spreadsheet programs read Persian text correctly.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(fmt)
+    batch_size = batch_size or _batch_size()
+    rows = iter_rows(dataset, batch_size, tenant)
+    header = next(rows)
+    writer = csv.writer(_Echo())
+    if fmt == 'csv':
+        yield ('\ufeff' + writer.writerow(header)).encode('utf-8')
+
+    chunk = []
+    count = 0
+    for row in rows:
+        if fmt == 'csv':
+            chunk.append(writer.writerow([_csv_cell(value) for value in row]).encode('utf-8'))
+        else:
+            chunk.append(jsoncodec.dumps({name: _plain(value) for name, value in zip(header, row)}) + b'\n')
+        count += 1
+        if len(chunk) >= batch_size:
+            yield b''.join(chunk)
+            chunk = []
+    if chunk:
+        yield b''.join(chunk)
+    logger.info(f"خروجی {dataset} با {count} ردیف در قالب {fmt} تولید شد")
@@ -0,0 +1,196 @@
+"""
+console/idempotency.py
+Idempotency-Key support for create endpoints:
+- idempotent(scope): decorator for viewset actions. The first request with a given key runs the
+  action and stores its response in idempotency_record; retries with the same key get the stored
+  response back without touching Supabase, and concurrent duplicates wait for the original.
+
+Keys are scoped per tenant (or per session user without one), so two super admins never see each
+other's stored responses. An in-progress record older than IDEMPOTENCY_LEASE_SECONDS belongs to a
+request that died; the next retry with the same key and body takes it over.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpRequest
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import deadline, tenancy
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+DB_ALIAS = 'supabase'
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+# هدرهایی از پاسخ اصلی که همراه بدنه ذخیره و بازپخش می‌شوند؛ Content-Type را رندر همان درخواست تعیین می‌کند
+REPLAYED_HEADERS = ('ETag', 'Location')
+
+
+def request_fingerprint(data):
+    """SHA-256 of the request body in canonical JSON form."""
+    body = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+def _records():
+    return IdempotencyRecord.objects.using(DB_ALIAS)
+
+
+def _owner(request):
+    """Part of the scope naming whose keys these are: the tenant, else the session user."""
+    tenant = tenancy.tenant_for(request)
+    if tenant is not None:
+        return f"t{tenant}"
+    django_request = getattr(request, '_request', request)
+    user = getattr(django_request, 'user', None) if isinstance(django_request, HttpRequest) else None
+    if user is not None and user.is_authenticated:
+        return f"u{user.pk}"
+    return 'anonymous'
+
+
+def _take_over(record, fingerprint, now, ttl):
+    """
+    Claim an in-progress record whose lease ran out; created_at is the owner's lease start.
+    Returns the record (with the new created_at) or None when it is still leased or taken.
+    """
+    lease = getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 120)
+    if (record is None or record.state != IdempotencyRecord.STATE_IN_PROGRESS
+            or record.request_hash != fingerprint or record.created_at > now - timedelta(seconds=lease)):
+        return None
+    taken = _records().filter(
+        id=record.id, state=IdempotencyRecord.STATE_IN_PROGRESS, created_at=record.created_at
+    ).update(created_at=now, expires_at=now + timedelta(seconds=ttl))
+    if not taken:
+        return None
+    logger.warning(f"رکورد Idempotency-Key {record.key} ({record.scope}) پس از پایان مهلت به این درخواست سپرده شد")
+    record.created_at = now
+    return record
+
+
+def _claim(scope, key, fingerprint):
+    """
+    Insert an in-progress record for (scope, key). Returns (record, claimed); claimed is False
+    when another request already owns the key and its lease has not run out.
+    """
+    now = timezone.now()
+    # حذف تصادفی رکوردهای منقضی تا جدول بدون کار زمان‌بندی شده کوچک بماند
+    if random.random() < 0.01:
+        _records().filter(expires_at__lt=now).delete()
+    _records().filter(scope=scope, key=key, expires_at__lt=now).delete()
+
+    ttl = getattr(settings, 'IDEMPOTENCY_TTL_SECONDS', 86400)
+    try:
+        with transaction.atomic(using=DB_ALIAS):
+            record = _records().create(
+                scope=scope,
+                key=key,
+                request_hash=fingerprint,
+                expires_at=now + timedelta(seconds=ttl),
+            )
+        return record, True
+    except IntegrityError:
+        record = _records().filter(scope=scope, key=key).first()
+        taken = _take_over(record, fingerprint, now, ttl)
+        if taken is not None:
+            return taken, True
+        return record, False
+
+
+def _wait_for_completion(record):
+    """
+    Poll until the owning request stores its response; None if it gave up or timed out.
+    Waits at most IDEMPOTENCY_WAIT_SECONDS, and never past this request's own deadline.
+    """
+    wait = getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 10)
+    left = deadline.remaining()
+    if left is not None:
+        wait = min(wait, left)
+    stop_at = time.monotonic() + wait
+    while record is not None and record.state == IdempotencyRecord.STATE_IN_PROGRESS:
+        now = time.monotonic()
+        if now >= stop_at:
+            return record
+        time.sleep(min(0.2, stop_at - now))
+        record = _records().filter(id=record.id).first()
+    return record
+
+
+def _replay(record):
+    response = Response(record.response_body, status=record.response_status, headers=record.response_headers or None)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(scope):
+    """
+    Make a viewset action honour the Idempotency-Key header.
+    Requests without the header run unchanged. 5xx responses are not stored, so the client may retry them.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            key = request.META.get(HEADER)
+            if not isinstance(key, str) or not key:
+                return view_method(self, request, *args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return Response(
+                    {"detail": f"Idempotency-Key نباید بیشتر از {MAX_KEY_LENGTH} کاراکتر باشد"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            fingerprint = request_fingerprint(request.data)
+            record, claimed = _claim(f"{scope}:{_owner(request)}", key, fingerprint)
+
+            if not claimed:
+                if record is None:
+                    # رکورد همزمان حذف شد؛ درخواست بدون کلید اجرا نمی‌شود تا تکرار رخ ندهد
+                    return Response(
+                        {"detail": "درخواست با این Idempotency-Key در حال پردازش است"},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                if record.request_hash != fingerprint:
+                    return Response(
+                        {"detail": "این Idempotency-Key قبلاً با داده‌های متفاوتی استفاده شده است"},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                    )
+                record = _wait_for_completion(record)
+                if record is None or record.state != IdempotencyRecord.STATE_COMPLETED:
+                    return Response(
+                        {"detail": "درخواست با این Idempotency-Key در حال پردازش است"},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                logger.info(f"پاسخ ذخیره شده برای Idempotency-Key {key} ({scope}) بازگردانده شد")
+                return _replay(record)
+
+            # اگر درخواست دیگری رکورد را پس از پایان مهلت گرفته باشد، created_at آن دیگر با این یکی برابر نیست
+            owned = _records().filter(id=record.id, created_at=record.created_at)
+            try:
+                response = view_method(self, request, *args, **kwargs)
+            except Exception:
+                owned.delete()
+                raise
+
+            if response.status_code >= 500:
+                owned.delete()
+                return response
+
+            owned.update(
+                state=IdempotencyRecord.STATE_COMPLETED,
+                response_status=response.status_code,
+                response_body=response.data,
+                response_headers={name: response[name] for name in REPLAYED_HEADERS if response.has_header(name)},
+            )
+            return response
+        return wrapper
+    return decorator
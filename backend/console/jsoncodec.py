@@ -0,0 +1,34 @@
+"""
+console/jsoncodec.py
+Single JSON codec for the console app:
+- loads: parse PostgREST/GoTrue response bodies and API request bodies.
+- dumps: serialize to UTF-8 bytes (non-ASCII characters are kept, as with ensure_ascii=False).
+Uses orjson when it is installed and falls back to the standard library otherwise.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson در requirements.txt آمده است
+    orjson = None
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def loads(data):
+    """Parse JSON from bytes or str."""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def dumps(obj, default=None):
+    """Serialize obj to UTF-8 JSON bytes; `default` handles types the codec does not know."""
+    if orjson is not None:
+        # datetime و dataclass مانند کتابخانه استاندارد به default سپرده می‌شوند تا خروجی هر دو مسیر یکسان باشد
+        return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
@@ -0,0 +1,256 @@
+"""
+console/livekit.py
+LiveKit room tokens for the channels a user may join (POST /api/livekit-token/):
+- load_grants: the user's username, active flag and allowed channels in one query on the supabase database
+  (or its read replica; see grants_for).
+- GrantCache: per-process cache of resolved grants and the tokens minted from them, invalidated by the
+  change events of console.events (user rows, membership changes, channel renames and deletes).
+- mint_token: a LiveKit access token (HS256 JWT with a `video` grant for one room).
+- issue_tokens: grants plus one token per channel, reusing cached tokens until they are close to expiry.
+- user_from_access_token: the user uid of a Supabase Auth access token, verified locally.
+
+Grants are only cached while the process's LISTEN connection is up; without it every request resolves
+grants again, and LIVEKIT_GRANT_CACHE_SECONDS bounds how long an entry can miss an invalidation.
+A token already handed out stays valid until it expires, even after the membership is removed.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import jwt
+from django.conf import settings
+from django.db import connections
+
+from . import events, replica
+from .membership_sync import DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Grants:
+    """What a user may join: username (the LiveKit identity), active flag and {channel_uid: name}."""
+
+    def __init__(self, username, active, channels):
+        self.username = username
+        self.active = active
+        self.channels = channels
+        # channel_uid -> (token, expires_at به ثانیه یونیکس)
+        self.tokens = {}
+        self.cached_until = None
+
+
+def load_grants(user_uid, using=DB_ALIAS):
+    """Grants of one user, or None when there is no such user."""
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT u.username, u.active, c.uid::text, c.name
+            FROM users u
+            LEFT JOIN LATERAL jsonb_array_elements_text(console_member_array(to_jsonb(u), 'allowed_channels'))
+                AS m(channel_uid) ON true
+            LEFT JOIN channels c ON c.uid::text = m.channel_uid
+            WHERE u.uid::text = %s
+            """,
+            [str(user_uid)]
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return None
+    username, active = rows[0][0], rows[0][1]
+    # کانالی که در آرایه هست ولی ردیفش حذف شده نادیده گرفته می‌شود
+    channels = {channel_uid: name for _username, _active, channel_uid, name in rows if channel_uid is not None}
+    return Grants(username, active is not False, channels)
+
+
+class GrantCache:
+    """
+    Thread-safe LRU of Grants by user uid with a channel -> users index for invalidation.
+    Every invalidation bumps `version`; put() with a version read before loading is refused when an
+    invalidation happened meanwhile, so a load racing with a change is never cached.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._by_channel = {}
+        self._clock = clock
+        self.version = 0
+        self.invalidated_at = None
+
+    def get(self, user_uid):
+        with self._lock:
+            grants = self._entries.get(user_uid)
+            if grants is None:
+                return None
+            if grants.cached_until <= self._clock():
+                self._drop(user_uid)
+                return None
+            self._entries.move_to_end(user_uid)
+            return grants
+
+    def put(self, user_uid, grants, version):
+        with self._lock:
+            if version != self.version:
+                return False
+            self._drop(user_uid)
+            grants.cached_until = self._clock() + _setting('LIVEKIT_GRANT_CACHE_SECONDS', 300)
+            self._entries[user_uid] = grants
+            for channel_uid in grants.channels:
+                self._by_channel.setdefault(channel_uid, set()).add(user_uid)
+            while len(self._entries) > _setting('LIVEKIT_GRANT_CACHE_SIZE', 10000):
+                self._drop(next(iter(self._entries)))
+            return True
+
+    def _drop(self, user_uid):
+        grants = self._entries.pop(user_uid, None)
+        if grants is None:
+            return
+        for channel_uid in grants.channels:
+            users = self._by_channel.get(channel_uid)
+            if users is not None:
+                users.discard(user_uid)
+                if not users:
+                    del self._by_channel[channel_uid]
+
+    def _invalidated(self):
+        self.version += 1
+        self.invalidated_at = self._clock()
+
+    def recently_invalidated(self, seconds):
+        """True while a change seen less than `seconds` ago may not have reached the read replica yet."""
+        invalidated_at = self.invalidated_at
+        return invalidated_at is not None and self._clock() - invalidated_at < seconds
+
+    def invalidate_users(self, user_uids):
+        with self._lock:
+            self._invalidated()
+            for user_uid in user_uids:
+                self._drop(user_uid)
+
+    def invalidate_channel(self, channel_uid):
+        with self._lock:
+            self._invalidated()
+            for user_uid in list(self._by_channel.get(channel_uid, ())):
+                self._drop(user_uid)
+
+    def clear(self):
+        with self._lock:
+            self._invalidated()
+            self._entries.clear()
+            self._by_channel.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def on_event(self, event):
+        """console.events listener."""
+        if event['type'] == 'reset':
+            self.clear()
+        elif event['table'] == 'users':
+            self.invalidate_users([event['uid']])
+        elif event['type'] == 'membership':
+            if event['truncated']:
+                # لیست اعضای تغییر کرده ارسال نشده است
+                self.clear()
+            else:
+                self.invalidate_users(set(event['added']) | set(event['removed']))
+                self.invalidate_channel(event['uid'])
+        else:
+            # تغییر نام یا حذف کانال
+            self.invalidate_channel(event['uid'])
+
+
+cache = GrantCache()
+_listening = False
+
+
+def _listen():
+    global _listening
+    if not _listening:
+        events.broker.add_listener(cache.on_event)
+        _listening = True
+
+
+def grants_for(user_uid):
+    _listen()
+    user_uid = str(user_uid)
+    grants = cache.get(user_uid)
+    if grants is not None:
+        return grants
+    version = cache.version
+    # پس از یک تغییر، replica ممکن است هنوز آن را نداشته باشد و دسترسی قدیمی کش شود
+    if cache.recently_invalidated(_setting('REPLICA_PIN_SECONDS', 5)):
+        using = DB_ALIAS
+    else:
+        using = replica.read_alias()
+    grants = load_grants(user_uid, using)
+    if grants is not None and events.broker.connected:
+        cache.put(user_uid, grants, version)
+    return grants
+
+
+def is_configured():
+    return bool(_setting('LIVEKIT_API_KEY', '') and _setting('LIVEKIT_API_SECRET', ''))
+
+
+def mint_token(identity, channel_uid, channel_name, now=None):
+    """(token, expires_at) granting `identity` join/publish/subscribe in the room named after the channel uid."""
+    now = int(now if now is not None else time.time())
+    expires_at = now + _setting('LIVEKIT_TOKEN_TTL', 6 * 60 * 60)
+    claims = {
+        'iss': settings.LIVEKIT_API_KEY,
+        'sub': identity,
+        'nbf': now,
+        'exp': expires_at,
+        'jti': str(uuid.uuid4()),
+        'name': identity,
+        'metadata': json.dumps({'name': identity, 'channelName': channel_name}, ensure_ascii=False),
+        'video': {'room': channel_uid, 'roomJoin': True, 'canPublish': True, 'canSubscribe': True},
+    }
+    return jwt.encode(claims, settings.LIVEKIT_API_SECRET, algorithm='HS256'), expires_at
+
+
+def issue_tokens(grants, channel_uid=None, now=None):
+    """
+    [{token, channelUid, channelName, livekitHost, expiresAt}] for all of the user's channels, or only
+    `channel_uid`. A cached token is reused while more than LIVEKIT_TOKEN_REUSE_MARGIN seconds remain.
+    """
+    now = int(now if now is not None else time.time())
+    margin = _setting('LIVEKIT_TOKEN_REUSE_MARGIN', 60 * 60)
+    host = _setting('LIVEKIT_HOST', 'localhost:7880')
+    channels = grants.channels if channel_uid is None else {channel_uid: grants.channels[channel_uid]}
+    issued = []
+    for uid, name in channels.items():
+        token, expires_at = grants.tokens.get(uid, (None, 0))
+        if expires_at - now <= margin:
+            token, expires_at = mint_token(grants.username, uid, name, now)
+            grants.tokens[uid] = (token, expires_at)
+        issued.append({
+            'token': token,
+            'channelUid': uid,
+            'channelName': name,
+            'livekitHost': host,
+            'expiresAt': expires_at,
+        })
+    return issued
+
+
+def user_from_access_token(access_token):
+    """User uid (`sub`) of a valid Supabase Auth access token, else None."""
+    secret = _setting('SUPABASE_JWT_SECRET', '')
+    if not secret:
+        return None
+    try:
+        claims = jwt.decode(access_token, secret, algorithms=['HS256'], audience='authenticated')
+    except jwt.InvalidTokenError as e:
+        logger.info(f"توکن دسترسی نامعتبر برای LiveKit: {e}")
+        return None
+    return claims.get('sub')
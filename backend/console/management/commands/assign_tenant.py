@@ -0,0 +1,40 @@
+"""
+console/management/commands/assign_tenant.py
+Give users and channels rows without a tenant (created before migration 0022) to one super admin:
+    python manage.py assign_tenant admin@example.com
+    python manage.py assign_tenant admin@example.com --dry-run
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from console.membership_sync import DB_ALIAS
+from console.models import SuperAdmin
+from console.tenancy import TENANT_COLUMN
+
+TABLES = ('users', 'channels')
+
+
+class Command(BaseCommand):
+    help = "Assign users and channels without a tenant to a super admin"
+
+    def add_arguments(self, parser):
+        parser.add_argument('super_admin', help="admin_super_user of the super admin that receives the rows")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the rows without a tenant")
+
+    def handle(self, *args, **options):
+        tenant = SuperAdmin.objects.using(DB_ALIAS).filter(
+            admin_super_user=options['super_admin']
+        ).values_list('id', flat=True).first()
+        if tenant is None:
+            raise CommandError(f"سوپر ادمین {options['super_admin']} پیدا نشد")
+
+        with transaction.atomic(using=DB_ALIAS), connections[DB_ALIAS].cursor() as cursor:
+            for table in TABLES:
+                if options['dry_run']:
+                    cursor.execute(f"SELECT count(*) FROM {table} WHERE {TENANT_COLUMN} IS NULL")
+                    self.stdout.write(f"{table}: would assign {cursor.fetchone()[0]} rows to tenant {tenant}")
+                else:
+                    cursor.execute(f"UPDATE {table} SET {TENANT_COLUMN} = %s WHERE {TENANT_COLUMN} IS NULL", [tenant])
+                    self.stdout.write(f"{table}: assigned {cursor.rowcount} rows to tenant {tenant}")
+        self.stdout.write(self.style.SUCCESS("Done"))
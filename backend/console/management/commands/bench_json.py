@@ -0,0 +1,73 @@
+"""
+console/management/commands/bench_json.py
+Micro-benchmark for the API's JSON and compression path on a synthetic user list:
+    python manage.py bench_json --rows 10000
+"""
+
+import gzip
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from console import jsoncodec
+from console.renderers import FastJSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _rows(count):
+    channels = [str(uuid.uuid4()) for _ in range(20)]
+    return [
+        {
+            "uid": str(uuid.uuid4()),
+            "username": f"کاربر_{i}",
+            "role": "user",
+            "active": i % 7 != 0,
+            "allowed_channels": channels[: i % 20],
+            "created_at": "2025-01-01T00:00:00+00:00",
+        }
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Time JSON parse/render (stdlib vs console.jsoncodec) and report compressed response sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def _time(self, fn, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        return best * 1000
+
+    def handle(self, *args, **options):
+        rows = _rows(options['rows'])
+        repeat = options['repeat']
+        body = json.dumps(rows).encode('utf-8')
+
+        results = [
+            ("parse stdlib", self._time(lambda: json.loads(body), repeat)),
+            ("parse jsoncodec", self._time(lambda: jsoncodec.loads(body), repeat)),
+            ("render DRF JSONRenderer", self._time(lambda: JSONRenderer().render(rows), repeat)),
+            ("render FastJSONRenderer", self._time(lambda: FastJSONRenderer().render(rows), repeat)),
+        ]
+        self.stdout.write(f"rows={len(rows)} orjson={'yes' if jsoncodec.orjson else 'no'}")
+        for name, ms in results:
+            self.stdout.write(f"{name:<26} {ms:8.1f} ms")
+
+        rendered = FastJSONRenderer().render(rows)
+        self.stdout.write(f"{'size identity':<26} {len(rendered):8d} B")
+        self.stdout.write(f"{'size gzip':<26} {len(gzip.compress(rendered, compresslevel=6)):8d} B")
+        if brotli is not None:
+            self.stdout.write(f"{'size br (q=5)':<26} {len(brotli.compress(rendered, quality=5)):8d} B")
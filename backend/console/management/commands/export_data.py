@@ -0,0 +1,44 @@
+"""
+console/management/commands/export_data.py
+Write audit exports of users, channels and memberships to gzip-compressed files:
+    python manage.py export_data --output-dir /backups/export
+    python manage.py export_data --output-dir . --format jsonl --dataset memberships
+"""
+
+import datetime
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from console import export
+
+
+class Command(BaseCommand):
+    help = "Export users, channels and memberships as compressed CSV or JSONL files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', required=True, help="Directory the .gz files are written to")
+        parser.add_argument('--format', choices=export.FORMATS, default='csv', help="File format")
+        parser.add_argument('--dataset', action='append', choices=export.DATASETS,
+                            help="Dataset to export (repeatable; default: all)")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows read per query")
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir']
+        if not os.path.isdir(output_dir):
+            raise CommandError(f"پوشه {output_dir} وجود ندارد")
+        fmt = options['format']
+        stamp = datetime.date.today().isoformat()
+
+        for dataset in options['dataset'] or export.DATASETS:
+            path = os.path.join(output_dir, f"{dataset}-{stamp}.{fmt}.gz")
+            # ابتدا در فایل موقت نوشته می‌شود تا خروجی ناقص با نام نهایی باقی نماند
+            partial = f"{path}.partial"
+            size = 0
+            with gzip.open(partial, 'wb') as output:
+                for chunk in export.stream(dataset, fmt, options['batch_size']):
+                    output.write(chunk)
+                    size += len(chunk)
+            os.replace(partial, path)
+            self.stdout.write(f"{dataset}: {path} ({size} bytes uncompressed)")
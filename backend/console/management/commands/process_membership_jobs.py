@@ -0,0 +1,33 @@
+"""
+console/management/commands/process_membership_jobs.py
+Worker that drains the membership_sync_job queue:
+    python manage.py process_membership_jobs            # run forever
+    python manage.py process_membership_jobs --once     # drain what is queued and exit
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from console import membership_sync
+
+
+class Command(BaseCommand):
+    help = "Apply queued membership sync jobs, merging repeated edits to the same row into one write"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Jobs claimed per batch")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = membership_sync.drain(batch_size=options['batch_size'])
+            if done or failed:
+                self.stdout.write(f"done={done} failed={failed}")
+            # موارد ناموفق تا دور بعد صبر می‌کنند تا Kong زیر بار تلاش‌های پیاپی نرود
+            if done:
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
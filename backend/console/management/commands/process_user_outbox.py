@@ -0,0 +1,33 @@
+"""
+console/management/commands/process_user_outbox.py
+Worker that resumes pending user lifecycle outbox entries:
+    python manage.py process_user_outbox            # run forever
+    python manage.py process_user_outbox --once     # drain what is queued and exit
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from console import user_lifecycle
+
+
+class Command(BaseCommand):
+    help = "Resume pending user create/update/delete outbox entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Entries claimed per batch")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        while True:
+            done, failed = user_lifecycle.drain(batch_size=options['batch_size'])
+            if done or failed:
+                self.stdout.write(f"done={done} failed={failed}")
+            # موارد ناموفق تا دور بعد صبر می‌کنند تا Kong زیر بار تلاش‌های پیاپی نرود
+            if done:
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+"""
+console/management/commands/prune_change_log.py
+Delete change_log entries older than the retention period (run daily, e.g. from cron):
+    python manage.py prune_change_log
+    python manage.py prune_change_log --days 7 --batch-size 10000
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from console import change_log
+
+
+class Command(BaseCommand):
+    help = "Delete change_log entries older than CHANGES_RETENTION_DAYS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Retention in days (default: CHANGES_RETENTION_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=5000, help="Entries deleted per statement")
+
+    def handle(self, *args, **options):
+        days = options['days'] if options['days'] is not None else settings.CHANGES_RETENTION_DAYS
+        if days < 1:
+            raise CommandError("دوره نگهداری باید حداقل یک روز باشد")
+        deleted = change_log.prune(timezone.now() - timedelta(days=days), options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} change_log entries older than {days} days"))
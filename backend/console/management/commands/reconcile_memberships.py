@@ -0,0 +1,65 @@
+"""
+console/management/commands/reconcile_memberships.py
+Report membership drift between users.allowed_channels, channels.allowed_users and channel_membership,
+and optionally repair it:
+    python manage.py reconcile_memberships
+    python manage.py reconcile_memberships --repair --dry-run
+    python manage.py reconcile_memberships --repair --source union
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from console import reconcile
+
+
+class Command(BaseCommand):
+    help = "Report (and optionally repair) drift between the membership arrays and channel_membership"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', choices=reconcile.SOURCES, default=None,
+                            help="Store treated as correct (default: membership when table writes are on, else union)")
+        parser.add_argument('--repair', action='store_true', help="Write the missing and remove the extra pairs")
+        parser.add_argument('--dry-run', action='store_true', help="With --repair, only count the rows to be written")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows read or written per query")
+        parser.add_argument('--show', type=int, default=10, help="Sample pairs printed per drift category")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        state = reconcile.load(options['batch_size'])
+        has_table = state['membership'] is not None
+        source = options['source'] or reconcile.default_source(has_table)
+        try:
+            result = reconcile.plan(state, source)
+        except ValueError:
+            raise CommandError(f"منبع {source} در دسترس نیست (جدول channel_membership وجود ندارد)")
+
+        self.stdout.write(
+            f"{len(state['user_uids'])} users, {len(state['channel_uids'])} channels, "
+            f"{len(result['target'])} pairs in target (source: {source}), "
+            f"loaded in {time.monotonic() - started:.1f}s"
+        )
+        drift = 0
+        for store in result['missing']:
+            self._report(f"{store} missing", result['missing'][store], options['show'])
+            self._report(f"{store} extra", result['extra'][store], options['show'])
+            self._report(f"{store} orphans", result['orphans'][store], options['show'])
+            drift += len(result['missing'][store]) + len(result['extra'][store])
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("No drift"))
+            return
+        if not options['repair']:
+            self.stdout.write(self.style.WARNING(f"{drift} drifted pairs; run with --repair to fix"))
+            return
+
+        written = reconcile.apply(result, options['batch_size'], dry_run=options['dry_run'])
+        verb = "would write" if options['dry_run'] else "wrote"
+        for store, rows in written.items():
+            self.stdout.write(f"{store}: {verb} {rows} rows")
+        self.stdout.write(self.style.SUCCESS(f"Done in {time.monotonic() - started:.1f}s"))
+
+    def _report(self, label, pairs, show):
+        self.stdout.write(f"{label}: {len(pairs)}")
+        for channel_uid, user_uid in sorted(pairs)[:show]:
+            self.stdout.write(f"    channel={channel_uid} user={user_uid}")
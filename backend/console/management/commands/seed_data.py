@@ -0,0 +1,76 @@
+"""
+console/management/commands/seed_data.py
+Seed synthetic super admins, users and channels for capacity testing:
+    python manage.py seed_data --users 100000 --channels 2000 --super-admins 20 --seed 1
+    python manage.py seed_data --clear
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connections
+
+from console import synthetic
+from console.membership_sync import DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = "Bulk-insert synthetic super admins, users, channels and memberships (or delete them with --clear)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--channels', type=int, default=100)
+        parser.add_argument('--super-admins', type=int, default=1)
+        parser.add_argument('--min-channels', type=int, default=1, help="Fewest channels per user")
+        parser.add_argument('--max-channels', type=int, default=200, help="Most channels per user")
+        parser.add_argument('--alpha', type=float, default=1.0, help="Zipf exponent of channel popularity")
+        parser.add_argument('--prefix', default='seed', help="Prefix of generated names, used by --clear")
+        parser.add_argument('--seed', type=int, default=None, help="Random seed for a reproducible dataset")
+        parser.add_argument('--admin-password', default=None,
+                            help="Password of the seeded super admins (default: unusable)")
+        parser.add_argument('--batch-size', type=int, default=None, help="Rows inserted per query")
+        parser.add_argument('--database', default=DB_ALIAS, help="Database alias to seed (e.g. a local stand-in)")
+        parser.add_argument('--clear', action='store_true', help="Delete the rows created with --prefix")
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help="Do not ask for confirmation")
+
+    def handle(self, *args, **options):
+        database = options['database']
+        if database not in connections:
+            raise CommandError(f"پایگاه داده {database} تعریف نشده است")
+        if options['min_channels'] < 1 or options['max_channels'] < options['min_channels']:
+            raise CommandError("بازه تعداد کانال هر کاربر نامعتبر است")
+
+        settings_dict = connections[database].settings_dict
+        target = f"{database} ({settings_dict.get('HOST') or 'local'}/{settings_dict.get('NAME')})"
+        action = f"delete '{options['prefix']}' rows from" if options['clear'] else "insert synthetic rows into"
+        if options['interactive']:
+            answer = input(f"This will {action} {target}. Type 'yes' to continue: ")
+            if answer != 'yes':
+                raise CommandError("لغو شد")
+
+        started = time.monotonic()
+        try:
+            if options['clear']:
+                counts = synthetic.clear(options['prefix'], using=database)
+            else:
+                counts = synthetic.write(
+                    users=options['users'],
+                    channels=options['channels'],
+                    super_admins=options['super_admins'],
+                    prefix=options['prefix'],
+                    seed=options['seed'],
+                    alpha=options['alpha'],
+                    min_channels=options['min_channels'],
+                    max_channels=options['max_channels'],
+                    admin_password=options['admin_password'],
+                    batch_size=options['batch_size'],
+                    using=database,
+                )
+        except DatabaseError as e:
+            # نام‌های تکراری (اجرای دوباره با همان پیشوند) کل تراکنش را برمی‌گرداند
+            raise CommandError(f"خطای پایگاه داده: {e}")
+
+        summary = ', '.join(f"{count} {name}" for name, count in counts.items())
+        verb = "Deleted" if options['clear'] else "Inserted"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {summary} in {time.monotonic() - started:.1f}s"))
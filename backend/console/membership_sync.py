@@ -0,0 +1,279 @@
+"""
+console/membership_sync.py
+Deferred membership fan-out backed by the membership_sync_job table:
+- is_deferred: decide per request whether membership sync is queued or run inline.
+- enqueue: record a channel/user membership change as a MembershipSyncJob.
+- jobs_of_tenant: restrict a job queryset to the jobs of one tenant's channels and users.
+- coalesce_jobs: merge queued jobs into one net change per users/channels row.
+- apply_row_change: read-modify-write one row's membership array through PostgREST.
+- claim_batch: lock and lease a batch of queued rows (shared with the user lifecycle outbox).
+- drain: claim a batch of jobs, apply the merged changes and record job outcomes.
+- table_writes_enabled / add_memberships / remove_memberships: single-row writes to channel_membership
+  (MEMBERSHIP_TABLE_WRITES); database triggers then update both arrays.
+- apply_delta: add and remove memberships of one channel or user without sending its whole array
+  (POST /api/channels/<uid>/members/ and /api/users/<uid>/channels/).
+"""
+
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+
+from . import deadline
+from .models import MembershipSyncJob
+from .supabase_client import _make_request
+
+logger = logging.getLogger(__name__)
+
+DB_ALIAS = 'supabase'
+
+# ستون آرایه عضویت در هر جدول
+MEMBERSHIP_COLUMNS = {
+    'users': 'allowed_channels',
+    'channels': 'allowed_users',
+}
+
+
+def table_writes_enabled():
+    return getattr(settings, 'MEMBERSHIP_TABLE_WRITES', False)
+
+
+def _in_list(values):
+    return ','.join(f'"{value}"' for value in values)
+
+
+def add_memberships(pairs):
+    """Insert (channel_uid, user_uid) pairs with one request; pairs that already exist are ignored."""
+    rows = [{'channel_uid': str(channel_uid), 'user_uid': str(user_uid)} for channel_uid, user_uid in pairs]
+    if not rows:
+        return True
+    return _make_request(
+        "POST", "/rest/v1/channel_membership?on_conflict=channel_uid,user_uid", rows,
+        prefer="resolution=ignore-duplicates,return=minimal"
+    ) is not None
+
+
+def remove_memberships(channel_uid=None, user_uid=None, others=()):
+    """Delete the pairs of one channel with the users in `others` (or of one user with channels)."""
+    others = [str(uid) for uid in others]
+    if not others:
+        return True
+    if channel_uid is not None:
+        query = f"channel_uid=eq.{channel_uid}&user_uid=in.({_in_list(others)})"
+    else:
+        query = f"user_uid=eq.{user_uid}&channel_uid=in.({_in_list(others)})"
+    return _make_request("DELETE", f"/rest/v1/channel_membership?{query}", prefer="return=minimal") is not None
+
+
+def is_deferred(request):
+    """
+    پارامتر defer_sync در آدرس درخواست بر تنظیم MEMBERSHIP_SYNC_DEFERRED اولویت دارد
+    With MEMBERSHIP_TABLE_WRITES nothing is deferred: a membership change is one insert/delete request.
+    """
+    if table_writes_enabled():
+        return False
+    value = request.query_params.get('defer_sync')
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return getattr(settings, 'MEMBERSHIP_SYNC_DEFERRED', False)
+
+
+def enqueue(source_type, source_uid, added=None, removed=None):
+    """Queue a membership fan-out and return the job (None when there is nothing to do)."""
+    added = list(added or [])
+    removed = list(removed or [])
+    if not source_uid or not (added or removed):
+        return None
+    job = MembershipSyncJob.objects.using(DB_ALIAS).create(
+        source_type=source_type,
+        source_uid=str(source_uid),
+        added=added,
+        removed=removed,
+    )
+    logger.info(f"همگام‌سازی عضویت {source_type}:{source_uid} در صف قرار گرفت (job={job.id})")
+    return job
+
+
+def jobs_of_tenant(queryset, tenant):
+    """Jobs whose source channel/user belongs to `tenant`; unfiltered when tenant is None (platform staff)."""
+    if tenant is None:
+        return queryset
+    tenant = int(tenant)
+    # کار شناسه tenant ندارد؛ مالک آن ردیف مبدأ در همان پایگاه داده است
+    return queryset.filter(
+        Q(source_type=MembershipSyncJob.SOURCE_CHANNEL,
+          source_uid__in=RawSQL("SELECT uid::text FROM channels WHERE tenant_id = %s", [tenant]))
+        | Q(source_type=MembershipSyncJob.SOURCE_USER,
+            source_uid__in=RawSQL("SELECT uid::text FROM users WHERE tenant_id = %s", [tenant]))
+    )
+
+
+def _target_table(source_type):
+    # ویرایش کانال روی ردیف‌های users اثر دارد و ویرایش کاربر روی ردیف‌های channels
+    if source_type == MembershipSyncJob.SOURCE_CHANNEL:
+        return 'users'
+    return 'channels'
+
+
+def coalesce_jobs(jobs):
+    """
+    Merge jobs (in id order) into {(table, row_uid): {'add': set, 'remove': set, 'jobs': set}}.
+    A later job wins when two jobs disagree about the same reference.
+    """
+    changes = {}
+    for job in sorted(jobs, key=lambda j: j.id):
+        table = _target_table(job.source_type)
+        for row_uid, adding in [(uid, True) for uid in job.added] + [(uid, False) for uid in job.removed]:
+            change = changes.setdefault((table, str(row_uid)), {'add': set(), 'remove': set(), 'jobs': set()})
+            change['jobs'].add(job.id)
+            if adding:
+                change['add'].add(job.source_uid)
+                change['remove'].discard(job.source_uid)
+            else:
+                change['remove'].add(job.source_uid)
+                change['add'].discard(job.source_uid)
+    return changes
+
+
+def apply_row_change(table, row_uid, add, remove):
+    """
+    اعمال تغییرات عضویت روی یک ردیف با یک GET و حداکثر یک PATCH
+    Returns True on success; a row that no longer exists counts as success.
+    """
+    column = MEMBERSHIP_COLUMNS[table]
+    rows = _make_request("GET", f"/rest/v1/{table}?uid=eq.{row_uid}&select=uid,{column}", coalesce=False)
+    if rows is None:
+        return False
+    if rows is True or not rows:
+        logger.warning(f"ردیف {row_uid} در جدول {table} یافت نشد؛ همگام‌سازی آن نادیده گرفته شد")
+        return True
+
+    current = rows[0].get(column) or []
+    updated = [uid for uid in current if uid not in remove]
+    present = set(updated)
+    updated.extend(uid for uid in sorted(add) if uid not in present)
+    if updated == current:
+        return True
+    return _make_request("PATCH", f"/rest/v1/{table}?uid=eq.{row_uid}", {column: updated}) is not None
+
+
+def _source_table(source_type):
+    return 'channels' if source_type == MembershipSyncJob.SOURCE_CHANNEL else 'users'
+
+
+def apply_delta(source_type, source_uid, add, remove, deferred=False):
+    """
+    Add and remove the memberships of one channel (SOURCE_CHANNEL) or user (SOURCE_USER).
+    Returns (ok, job): ok is False when the source row (or channel_membership) could not be written;
+    job is the MembershipSyncJob holding the fan-out that was queued instead of run inline, if any.
+    Work and requests scale with len(add) + len(remove), not with the size of the membership arrays.
+    """
+    add = [str(uid) for uid in add]
+    remove = [str(uid) for uid in remove]
+    if not (add or remove):
+        return True, None
+
+    if table_writes_enabled():
+        # تریگرهای channel_membership هر دو آرایه را به‌روز می‌کنند
+        if source_type == MembershipSyncJob.SOURCE_CHANNEL:
+            ok = (add_memberships((source_uid, uid) for uid in add)
+                  and remove_memberships(channel_uid=source_uid, others=remove))
+        else:
+            ok = (add_memberships((uid, source_uid) for uid in add)
+                  and remove_memberships(user_uid=source_uid, others=remove))
+        return ok, None
+
+    if not apply_row_change(_source_table(source_type), source_uid, set(add), set(remove)):
+        return False, None
+    if deferred:
+        return True, enqueue(source_type, source_uid, added=add, removed=remove)
+
+    # ردیف‌های طرف مقابل یکی‌یکی؛ هر چه انجام نشد (خطا یا پایان مهلت درخواست) به صف سپرده می‌شود
+    target = _target_table(source_type)
+    pending_add, pending_remove = list(add), list(remove)
+    failed_add, failed_remove = [], []
+    try:
+        while pending_add:
+            if not apply_row_change(target, pending_add[0], {str(source_uid)}, set()):
+                failed_add.append(pending_add[0])
+            pending_add.pop(0)
+        while pending_remove:
+            if not apply_row_change(target, pending_remove[0], set(), {str(source_uid)}):
+                failed_remove.append(pending_remove[0])
+            pending_remove.pop(0)
+    except deadline.DeadlineExceeded:
+        logger.warning(f"مهلت درخواست در همگام‌سازی عضویت {source_type}:{source_uid} تمام شد؛ باقی‌مانده در صف قرار می‌گیرد")
+    return True, enqueue(source_type, source_uid, added=failed_add + pending_add, removed=failed_remove + pending_remove)
+
+
+def claim_batch(model, batch_size):
+    """
+    Claim up to batch_size pending rows of a queue model (MembershipSyncJob or any model with
+    the same status/attempts/updated_at fields). Rows left running past the lease are reclaimed.
+    """
+    lease = getattr(settings, 'MEMBERSHIP_SYNC_LEASE_SECONDS', 300)
+    stale_before = timezone.now() - timedelta(seconds=lease)
+    with transaction.atomic(using=DB_ALIAS):
+        jobs = list(
+            model.objects.using(DB_ALIAS)
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status=model.STATUS_PENDING)
+                | Q(status=model.STATUS_RUNNING, updated_at__lt=stale_before)
+            )
+            .order_by('id')[:batch_size]
+        )
+        if jobs:
+            model.objects.using(DB_ALIAS).filter(id__in=[job.id for job in jobs]).update(
+                status=model.STATUS_RUNNING,
+                attempts=F('attempts') + 1,
+                updated_at=timezone.now(),
+            )
+    return jobs
+
+
+def drain(batch_size=500):
+    """
+    Process one batch of queued jobs. Returns (done, failed) job counts.
+    Jobs whose rows could not be written go back to pending until MEMBERSHIP_SYNC_MAX_ATTEMPTS.
+    """
+    jobs = claim_batch(MembershipSyncJob, batch_size)
+    if not jobs:
+        return 0, 0
+
+    changes = coalesce_jobs(jobs)
+    logger.info(f"{len(jobs)} کار همگام‌سازی در {len(changes)} نوشتن ادغام شد")
+
+    failed_jobs = {}
+    for (table, row_uid), change in changes.items():
+        try:
+            ok = apply_row_change(table, row_uid, change['add'], change['remove'])
+            error = '' if ok else f"خطا در به‌روزرسانی ردیف {row_uid} در جدول {table}"
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            ok, error = False, f"{table}:{row_uid}: {e}"
+        if not ok:
+            for job_id in change['jobs']:
+                failed_jobs.setdefault(job_id, error)
+
+    max_attempts = getattr(settings, 'MEMBERSHIP_SYNC_MAX_ATTEMPTS', 5)
+    queryset = MembershipSyncJob.objects.using(DB_ALIAS)
+    done_ids = [job.id for job in jobs if job.id not in failed_jobs]
+    if done_ids:
+        queryset.filter(id__in=done_ids).update(
+            status=MembershipSyncJob.STATUS_DONE, last_error='', updated_at=timezone.now()
+        )
+    for job in jobs:
+        if job.id in failed_jobs:
+            exhausted = job.attempts + 1 >= max_attempts
+            queryset.filter(id=job.id).update(
+                status=MembershipSyncJob.STATUS_FAILED if exhausted else MembershipSyncJob.STATUS_PENDING,
+                last_error=failed_jobs[job.id],
+                updated_at=timezone.now(),
+            )
+    return len(done_ids), len(failed_jobs)
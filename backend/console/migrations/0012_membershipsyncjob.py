@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-19 00:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0011_channel_uid_alter_channel_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipSyncJob',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('source_type', models.CharField(choices=[('channel', 'Channel'), ('user', 'User')], max_length=10)),
+                ('source_uid', models.CharField(max_length=50)),
+                ('added', models.JSONField(default=list)),
+                ('removed', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Membership Sync Job',
+                'verbose_name_plural': 'Membership Sync Jobs',
+                'db_table': 'membership_sync_job',
+                'indexes': [models.Index(fields=['status', 'id'], name='membership_sync_job_queue')],
+            },
+        ),
+    ]
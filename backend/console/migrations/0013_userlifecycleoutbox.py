@@ -0,0 +1,34 @@
+# Generated by Django 5.2 on 2026-10-19 00:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0012_membershipsyncjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLifecycleOutbox',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('operation', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('user_uid', models.CharField(max_length=50)),
+                ('payload', models.JSONField(default=dict)),
+                ('completed_steps', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'User Lifecycle Outbox',
+                'verbose_name_plural': 'User Lifecycle Outbox',
+                'db_table': 'user_lifecycle_outbox',
+                'indexes': [models.Index(fields=['status', 'id'], name='user_lifecycle_outbox_queue'), models.Index(fields=['user_uid'], name='user_lifecycle_outbox_user')],
+            },
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2 on 2026-10-19 00:49
+
+from django.db import migrations, models
+
+
+LOG_CHANGE_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND to_jsonb(NEW) = to_jsonb(OLD) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.uid IS DISTINCT FROM OLD.uid) THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, OLD.uid::text, 'delete', txid_current(), now());
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, NEW.uid::text, 'upsert', txid_current(), now());
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# تریگر فقط روی جدول‌های واقعی ساخته می‌شود؛ channels در برخی نصب‌ها view است (0010)
+CREATE_TRIGGERS = """
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['users', 'channels'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relname = t AND c.relkind IN ('r', 'p')
+        ) THEN
+            EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_change_log', t);
+            EXECUTE format(
+                'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I '
+                'FOR EACH ROW EXECUTE FUNCTION console_log_change()', t || '_change_log', t
+            );
+        END IF;
+    END LOOP;
+END;
+$$;
+"""
+
+DROP_TRIGGERS = "DROP FUNCTION IF EXISTS console_log_change() CASCADE;"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0014_idempotencyrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('table_name', models.CharField(max_length=20)),
+                ('row_uid', models.CharField(max_length=50)),
+                ('op', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=6)),
+                ('txid', models.BigIntegerField()),
+                ('changed_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Change Log Entry',
+                'verbose_name_plural': 'Change Log',
+                'db_table': 'change_log',
+                'indexes': [models.Index(fields=['table_name', 'txid', 'id'], name='change_log_cursor')],
+            },
+        ),
+        migrations.RunSQL(LOG_CHANGE_FUNCTION + CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
@@ -0,0 +1,96 @@
+from django.db import migrations
+
+
+# همان تریگر 0015 به همراه pg_notify روی کانال console_changes برای استریم /api/events/
+# رویداد membership فقط وقتی ارسال می‌شود که لیست عضویت ردیف (allowed_users / allowed_channels) تغییر کند
+LOG_CHANGE_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_log_change() RETURNS trigger AS $$
+DECLARE
+    member_column text := CASE TG_TABLE_NAME WHEN 'channels' THEN 'allowed_users' ELSE 'allowed_channels' END;
+    old_members jsonb := '[]';
+    new_members jsonb := '[]';
+    added jsonb;
+    removed jsonb;
+    entry_id bigint;
+    payload jsonb;
+BEGIN
+    IF TG_OP = 'UPDATE' AND to_jsonb(NEW) = to_jsonb(OLD) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' AND jsonb_typeof(to_jsonb(OLD) -> member_column) = 'array' THEN
+        old_members := to_jsonb(OLD) -> member_column;
+    END IF;
+    IF TG_OP <> 'DELETE' AND jsonb_typeof(to_jsonb(NEW) -> member_column) = 'array' THEN
+        new_members := to_jsonb(NEW) -> member_column;
+    END IF;
+
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.uid IS DISTINCT FROM OLD.uid) THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, OLD.uid::text, 'delete', txid_current(), now())
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', OLD.uid::text, 'op', 'delete', 'id', entry_id
+        )::text);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, NEW.uid::text, 'upsert', txid_current(), now())
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', NEW.uid::text, 'op', 'upsert', 'id', entry_id
+        )::text);
+    END IF;
+
+    IF old_members IS DISTINCT FROM new_members THEN
+        SELECT coalesce(jsonb_agg(m), '[]') INTO added
+        FROM jsonb_array_elements_text(new_members) m WHERE NOT old_members ? m;
+        SELECT coalesce(jsonb_agg(m), '[]') INTO removed
+        FROM jsonb_array_elements_text(old_members) m WHERE NOT new_members ? m;
+        payload := jsonb_build_object(
+            'kind', 'membership', 'table', TG_TABLE_NAME,
+            'uid', coalesce(to_jsonb(NEW) ->> 'uid', to_jsonb(OLD) ->> 'uid'),
+            'id', entry_id, 'added', added, 'removed', removed
+        );
+        -- سقف اندازه payload در NOTIFY حدود ۸۰۰۰ بایت است
+        IF octet_length(payload::text) > 7500 THEN
+            payload := (payload - 'added' - 'removed') || '{"truncated": true}';
+        END IF;
+        IF added <> '[]' OR removed <> '[]' THEN
+            PERFORM pg_notify('console_changes', payload::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# بازگشت به نسخه بدون NOTIFY
+PREVIOUS_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_log_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND to_jsonb(NEW) = to_jsonb(OLD) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.uid IS DISTINCT FROM OLD.uid) THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, OLD.uid::text, 'delete', txid_current(), now());
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, NEW.uid::text, 'upsert', txid_current(), now());
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0015_changelogentry'),
+    ]
+
+    operations = [
+        migrations.RunSQL(LOG_CHANGE_FUNCTION, PREVIOUS_FUNCTION),
+    ]
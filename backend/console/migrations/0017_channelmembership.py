@@ -0,0 +1,159 @@
+# Generated by Django 5.2 on 2026-10-19 00:56
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+# آرایه عضویت هر جدول؛ ستون‌های غیر آرایه مانند آرایه خالی خوانده می‌شوند
+MEMBERSHIP_SQL = """
+CREATE OR REPLACE FUNCTION console_member_array(row_data jsonb, column_name text) RETURNS jsonb AS $$
+    SELECT CASE WHEN jsonb_typeof(row_data -> column_name) = 'array' THEN row_data -> column_name ELSE '[]'::jsonb END;
+$$ LANGUAGE sql IMMUTABLE;
+
+-- channel_membership -> آرایه‌ها: درج و حذف یک ردیف فقط یک عنصر از هر آرایه را تغییر می‌دهد
+CREATE OR REPLACE FUNCTION console_membership_to_arrays() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE channels SET allowed_users = console_member_array(to_jsonb(channels), 'allowed_users') || to_jsonb(NEW.user_uid)
+        WHERE uid::text = NEW.channel_uid AND NOT console_member_array(to_jsonb(channels), 'allowed_users') ? NEW.user_uid;
+        UPDATE users SET allowed_channels = console_member_array(to_jsonb(users), 'allowed_channels') || to_jsonb(NEW.channel_uid)
+        WHERE uid::text = NEW.user_uid AND NOT console_member_array(to_jsonb(users), 'allowed_channels') ? NEW.channel_uid;
+    ELSE
+        UPDATE channels SET allowed_users = allowed_users - OLD.user_uid
+        WHERE uid::text = OLD.channel_uid AND console_member_array(to_jsonb(channels), 'allowed_users') ? OLD.user_uid;
+        UPDATE users SET allowed_channels = allowed_channels - OLD.channel_uid
+        WHERE uid::text = OLD.user_uid AND console_member_array(to_jsonb(users), 'allowed_channels') ? OLD.channel_uid;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- آرایه‌ها -> channel_membership: برای نویسنده‌هایی که هنوز کل آرایه را می‌نویسند
+CREATE OR REPLACE FUNCTION console_arrays_to_membership() RETURNS trigger AS $$
+DECLARE
+    member_column text := CASE TG_TABLE_NAME WHEN 'channels' THEN 'allowed_users' ELSE 'allowed_channels' END;
+    old_members jsonb := '[]';
+    new_members jsonb := '[]';
+    row_uid text;
+BEGIN
+    -- تغییری که خود تریگر channel_membership روی آرایه اعمال کرده دوباره برنمی‌گردد
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        old_members := console_member_array(to_jsonb(OLD), member_column);
+        row_uid := OLD.uid::text;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        new_members := console_member_array(to_jsonb(NEW), member_column);
+        row_uid := NEW.uid::text;
+    END IF;
+    IF TG_OP = 'DELETE' THEN
+        IF TG_TABLE_NAME = 'channels' THEN
+            DELETE FROM channel_membership WHERE channel_uid = row_uid;
+        ELSE
+            DELETE FROM channel_membership WHERE user_uid = row_uid;
+        END IF;
+        RETURN NULL;
+    END IF;
+    IF old_members = new_members THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_TABLE_NAME = 'channels' THEN
+        DELETE FROM channel_membership
+        WHERE channel_uid = row_uid
+          AND user_uid IN (SELECT m FROM jsonb_array_elements_text(old_members) m WHERE NOT new_members ? m);
+        INSERT INTO channel_membership (channel_uid, user_uid)
+        SELECT row_uid, m FROM jsonb_array_elements_text(new_members) m
+        WHERE NOT old_members ? m AND EXISTS (SELECT 1 FROM users u WHERE u.uid::text = m)
+        ON CONFLICT (channel_uid, user_uid) DO NOTHING;
+    ELSE
+        DELETE FROM channel_membership
+        WHERE user_uid = row_uid
+          AND channel_uid IN (SELECT m FROM jsonb_array_elements_text(old_members) m WHERE NOT new_members ? m);
+        INSERT INTO channel_membership (channel_uid, user_uid)
+        SELECT m, row_uid FROM jsonb_array_elements_text(new_members) m
+        WHERE NOT old_members ? m AND EXISTS (SELECT 1 FROM channels c WHERE c.uid::text = m)
+        ON CONFLICT (channel_uid, user_uid) DO NOTHING;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF (
+        SELECT count(*) FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname IN ('users', 'channels') AND c.relkind IN ('r', 'p')
+    ) < 2 THEN
+        RAISE NOTICE 'users/channels are not both base tables; channel_membership is not backfilled or synced';
+        RETURN;
+    END IF;
+
+    -- backfill: اجتماع هر دو آرایه، فقط برای جفت‌هایی که هر دو طرف وجود دارند
+    INSERT INTO channel_membership (channel_uid, user_uid)
+    SELECT c.uid::text, m FROM channels c, jsonb_array_elements_text(console_member_array(to_jsonb(c), 'allowed_users')) m
+    WHERE EXISTS (SELECT 1 FROM users u WHERE u.uid::text = m)
+    UNION
+    SELECT m, u.uid::text FROM users u, jsonb_array_elements_text(console_member_array(to_jsonb(u), 'allowed_channels')) m
+    WHERE EXISTS (SELECT 1 FROM channels c WHERE c.uid::text = m)
+    ON CONFLICT (channel_uid, user_uid) DO NOTHING;
+
+    -- هم‌ترازی آرایه‌ها با جدول (ارجاع‌های یک‌طرفه و شناسه‌های حذف شده برطرف می‌شوند)
+    UPDATE channels c SET allowed_users = coalesce(
+        (SELECT jsonb_agg(cm.user_uid ORDER BY cm.id) FROM channel_membership cm WHERE cm.channel_uid = c.uid::text), '[]'
+    ) WHERE console_member_array(to_jsonb(c), 'allowed_users') IS DISTINCT FROM coalesce(
+        (SELECT jsonb_agg(cm.user_uid ORDER BY cm.id) FROM channel_membership cm WHERE cm.channel_uid = c.uid::text), '[]'
+    );
+    UPDATE users u SET allowed_channels = coalesce(
+        (SELECT jsonb_agg(cm.channel_uid ORDER BY cm.id) FROM channel_membership cm WHERE cm.user_uid = u.uid::text), '[]'
+    ) WHERE console_member_array(to_jsonb(u), 'allowed_channels') IS DISTINCT FROM coalesce(
+        (SELECT jsonb_agg(cm.channel_uid ORDER BY cm.id) FROM channel_membership cm WHERE cm.user_uid = u.uid::text), '[]'
+    );
+
+    DROP TRIGGER IF EXISTS channel_membership_to_arrays ON channel_membership;
+    CREATE TRIGGER channel_membership_to_arrays AFTER INSERT OR DELETE ON channel_membership
+        FOR EACH ROW EXECUTE FUNCTION console_membership_to_arrays();
+    DROP TRIGGER IF EXISTS channels_membership_sync ON channels;
+    CREATE TRIGGER channels_membership_sync AFTER INSERT OR UPDATE OR DELETE ON channels
+        FOR EACH ROW EXECUTE FUNCTION console_arrays_to_membership();
+    DROP TRIGGER IF EXISTS users_membership_sync ON users;
+    CREATE TRIGGER users_membership_sync AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH ROW EXECUTE FUNCTION console_arrays_to_membership();
+END;
+$$;
+"""
+
+DROP_MEMBERSHIP_SQL = """
+DROP FUNCTION IF EXISTS console_arrays_to_membership() CASCADE;
+DROP FUNCTION IF EXISTS console_membership_to_arrays() CASCADE;
+DROP FUNCTION IF EXISTS console_member_array(jsonb, text);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0016_change_log_notify'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelMembership',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('channel_uid', models.CharField(max_length=50)),
+                ('user_uid', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+            ],
+            options={
+                'verbose_name': 'Channel Membership',
+                'verbose_name_plural': 'Channel Memberships',
+                'db_table': 'channel_membership',
+                'indexes': [models.Index(fields=['user_uid'], name='channel_membership_user')],
+                'constraints': [models.UniqueConstraint(fields=('channel_uid', 'user_uid'), name='channel_membership_pair')],
+            },
+        ),
+        migrations.RunSQL(MEMBERSHIP_SQL, DROP_MEMBERSHIP_SQL),
+    ]
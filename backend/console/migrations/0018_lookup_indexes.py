@@ -0,0 +1,70 @@
+from django.db import migrations
+
+
+# ایندکس‌های پرس‌وجوهای پرتکرار روی جداول users و channels؛ هر بخش فقط وقتی جدول و ستون وجود دارد اجرا می‌شود
+# - GIN روی آرایه‌های عضویت برای فیلتر cs. (allowed_users=cs.["uid"]) در /members/ و /channels/
+# - btree روی channels.name برای بررسی تکراری بودن نام (name=eq.X) و users.username برای ورود و جستجو
+# - یکتایی نام کانال بدون حساسیت به حروف بزرگ و کوچک و فاصله‌های ابتدا و انتها
+CREATE_INDEXES = """
+DO $$
+DECLARE
+    spec record;
+    column_type text;
+    -- channels در برخی نصب‌ها view است (0010) و ایندکس نمی‌پذیرد
+    base_tables text[] := ARRAY(
+        SELECT c.relname::text FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname IN ('users', 'channels') AND c.relkind IN ('r', 'p')
+    );
+BEGIN
+    FOR spec IN SELECT * FROM (VALUES
+        ('channels', 'allowed_users', 'channels_allowed_users_gin'),
+        ('users', 'allowed_channels', 'users_allowed_channels_gin')
+    ) AS s(table_name, column_name, index_name) LOOP
+        CONTINUE WHEN NOT spec.table_name = ANY (base_tables);
+        SELECT data_type INTO column_type FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = spec.table_name AND column_name = spec.column_name;
+        IF column_type = 'jsonb' THEN
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING gin (%I jsonb_path_ops)',
+                           spec.index_name, spec.table_name, spec.column_name);
+        ELSIF column_type = 'ARRAY' THEN
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING gin (%I)',
+                           spec.index_name, spec.table_name, spec.column_name);
+        ELSE
+            RAISE NOTICE 'skipping %: %.% is %', spec.index_name, spec.table_name, spec.column_name, column_type;
+        END IF;
+    END LOOP;
+
+    IF 'users' = ANY (base_tables) THEN
+        CREATE INDEX IF NOT EXISTS users_username_idx ON users (username);
+    END IF;
+
+    IF 'channels' = ANY (base_tables) THEN
+        CREATE INDEX IF NOT EXISTS channels_name_idx ON channels (name);
+        IF EXISTS (SELECT 1 FROM channels GROUP BY lower(btrim(name)) HAVING count(*) > 1) THEN
+            RAISE NOTICE 'duplicate channel names exist; channels_name_normalized_key not created';
+        ELSE
+            CREATE UNIQUE INDEX IF NOT EXISTS channels_name_normalized_key ON channels (lower(btrim(name)));
+        END IF;
+    END IF;
+END;
+$$;
+"""
+
+DROP_INDEXES = """
+DROP INDEX IF EXISTS channels_allowed_users_gin;
+DROP INDEX IF EXISTS users_allowed_channels_gin;
+DROP INDEX IF EXISTS users_username_idx;
+DROP INDEX IF EXISTS channels_name_idx;
+DROP INDEX IF EXISTS channels_name_normalized_key;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0017_channelmembership'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+
+# جستجوی کاربران برای /api/users/?q= از طریق PostgREST (GET /rest/v1/rpc/console_search_users)
+# - تطبیق پیشوندی و زیررشته‌ای با ILIKE و تطبیق تقریبی با عملگر % در pg_trgm
+# - ایندکس GIN با gin_trgm_ops هر سه نوع تطبیق را پوشش می‌دهد
+# - نتایج پیشوندی اول، سپس بر اساس شباهت مرتب می‌شوند؛ یک ردیف بیش از صفحه برای has_more خوانده می‌شود
+CREATE_SEARCH = """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname = 'users' AND c.relkind IN ('r', 'p')
+    ) THEN
+        RAISE NOTICE 'users is not a table in %; console_search_users not created', current_schema();
+        RETURN;
+    END IF;
+
+    CREATE INDEX IF NOT EXISTS users_username_trgm ON users USING gin (username gin_trgm_ops);
+
+    EXECUTE $ddl$
+    CREATE OR REPLACE FUNCTION console_search_users(
+        q text DEFAULT NULL,
+        user_role text DEFAULT NULL,
+        user_active boolean DEFAULT NULL,
+        page_limit integer DEFAULT 50,
+        page_offset integer DEFAULT 0
+    ) RETURNS SETOF users AS $fn$
+        WITH term AS (
+            SELECT nullif(btrim(q), '') AS raw,
+                   replace(replace(replace(btrim(q), '\\', '\\\\'), '%', '\\%'), '_', '\\_') AS escaped
+        )
+        SELECT u.* FROM users u, term t
+        WHERE (user_role IS NULL OR u.role = user_role)
+          AND (user_active IS NULL OR u.active = user_active)
+          AND (t.raw IS NULL OR u.username ILIKE '%' || t.escaped || '%' OR u.username % t.raw)
+        ORDER BY (t.raw IS NOT NULL AND u.username ILIKE t.escaped || '%') DESC,
+                 similarity(u.username, coalesce(t.raw, '')) DESC,
+                 u.username, u.uid
+        LIMIT page_limit OFFSET page_offset
+    $fn$ LANGUAGE sql STABLE;
+    $ddl$;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
+DROP_SEARCH = """
+DROP FUNCTION IF EXISTS console_search_users(text, text, boolean, integer, integer);
+DROP INDEX IF EXISTS users_username_trgm;
+NOTIFY pgrst, 'reload schema';
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0018_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
@@ -0,0 +1,97 @@
+from django.db import migrations
+
+
+# نرمال‌سازی فارسی نام کانال برای جستجو و تشخیص نام تکراری:
+# - حذف اعراب (U+064B..U+065F، U+0670)، کشیده (U+0640) و ZWJ
+# - ي و ى عربی -> ی، ك -> ک، ة و ۀ -> ه، أ إ ٱ -> ا
+# - ZWNJ و فاصله نشکن -> فاصله؛ ارقام فارسی و عربی -> ارقام لاتین
+# - حروف کوچک، حذف فاصله‌های ابتدا و انتها و یکی کردن فاصله‌های پشت سر هم
+NORMALIZE_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_normalize_name(value text) RETURNS text AS $$
+    SELECT btrim(regexp_replace(lower(translate(
+        regexp_replace(value, '[\\u064B-\\u065F\\u0670\\u0640\\u200D]', '', 'g'),
+        'يىكةۀأإٱ٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹' || chr(8204) || chr(160),
+        'ییکههااا01234567890123456789' || '  '
+    )), '\\s+', ' ', 'g'));
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+"""
+
+# ستون name_normalized یک ستون generated است و با هر نوشتن (PostgREST، تریگرها، SQL مستقیم) به‌روز می‌ماند
+# ایندکس یکتای آن جایگزین channels_name_normalized_key (مهاجرت 0018) می‌شود، مگر اینکه نام‌های تکراری وجود داشته باشد
+CREATE_SEARCH = NORMALIZE_FUNCTION + """
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname = 'channels' AND c.relkind IN ('r', 'p')
+    ) THEN
+        RAISE NOTICE 'channels is not a table in %; name_normalized not added', current_schema();
+        RETURN;
+    END IF;
+
+    ALTER TABLE channels ADD COLUMN IF NOT EXISTS name_normalized text
+        GENERATED ALWAYS AS (console_normalize_name(name)) STORED;
+    CREATE INDEX IF NOT EXISTS channels_name_normalized_trgm ON channels USING gin (name_normalized gin_trgm_ops);
+
+    IF EXISTS (SELECT 1 FROM channels GROUP BY name_normalized HAVING count(*) > 1) THEN
+        RAISE NOTICE 'channels with the same normalized name exist; channels_name_search_key not created';
+    ELSE
+        CREATE UNIQUE INDEX IF NOT EXISTS channels_name_search_key ON channels (name_normalized);
+        DROP INDEX IF EXISTS channels_name_normalized_key;
+    END IF;
+
+    EXECUTE $ddl$
+    CREATE OR REPLACE FUNCTION console_search_channels(
+        q text DEFAULT NULL,
+        page_limit integer DEFAULT 50,
+        page_offset integer DEFAULT 0
+    ) RETURNS SETOF channels AS $fn$
+        WITH term AS (
+            SELECT nullif(console_normalize_name(q), '') AS raw,
+                   replace(replace(replace(console_normalize_name(q), '\\', '\\\\'), '%', '\\%'), '_', '\\_') AS escaped
+        )
+        SELECT c.* FROM channels c, term t
+        WHERE t.raw IS NULL OR c.name_normalized LIKE '%' || t.escaped || '%' OR c.name_normalized % t.raw
+        ORDER BY (t.raw IS NOT NULL AND c.name_normalized LIKE t.escaped || '%') DESC,
+                 similarity(c.name_normalized, coalesce(t.raw, '')) DESC,
+                 c.name, c.uid
+        LIMIT page_limit OFFSET page_offset
+    $fn$ LANGUAGE sql STABLE;
+    $ddl$;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
+DROP_SEARCH = """
+DROP FUNCTION IF EXISTS console_search_channels(text, integer, integer);
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = 'channels' AND column_name = 'name_normalized'
+    ) THEN
+        ALTER TABLE channels DROP COLUMN name_normalized;
+        IF NOT EXISTS (SELECT 1 FROM channels GROUP BY lower(btrim(name)) HAVING count(*) > 1) THEN
+            CREATE UNIQUE INDEX IF NOT EXISTS channels_name_normalized_key ON channels (lower(btrim(name)));
+        END IF;
+    END IF;
+END;
+$$;
+DROP FUNCTION IF EXISTS console_normalize_name(text);
+NOTIFY pgrst, 'reload schema';
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0019_user_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SEARCH, DROP_SEARCH),
+    ]
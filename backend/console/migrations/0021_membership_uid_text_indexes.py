@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+# تریگرهای مهاجرت 0017 ردیف‌ها را با uid::text = ... پیدا می‌کنند؛ وقتی uid از نوع uuid است ایندکس کلید اصلی
+# برای این مقایسه استفاده نمی‌شود و هر درج یا حذف در channel_membership کل جدول users را می‌خواند.
+# ایندکس روی عبارت (uid::text) این جستجوها را به index scan تبدیل می‌کند (مثلاً در reconcile_memberships --repair).
+CREATE_INDEXES = """
+DO $$
+DECLARE
+    table_name text;
+BEGIN
+    FOR table_name IN
+        SELECT c.relname::text FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname IN ('users', 'channels') AND c.relkind IN ('r', 'p')
+    LOOP
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I ((uid::text))', table_name || '_uid_text_idx', table_name);
+    END LOOP;
+END;
+$$;
+"""
+
+DROP_INDEXES = """
+DROP INDEX IF EXISTS users_uid_text_idx;
+DROP INDEX IF EXISTS channels_uid_text_idx;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0020_channel_name_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_INDEXES, DROP_INDEXES),
+    ]
@@ -0,0 +1,127 @@
+import importlib
+
+from django.db import migrations
+
+
+# کلید tenant (شناسه سوپر ادمین مالک، super_admin.id) روی users و channels:
+# - ایندکس‌های ترکیبی با tenant_id در ابتدا تا لیست، جستجو و بررسی‌های هر سوپر ادمین فقط ردیف‌های خودش را بخوانند
+# - یکتایی نام کانال در هر tenant (ردیف‌های بدون tenant همه با هم یک گروه هستند)
+# - توابع جستجوی 0019 و 0020 پارامتر tenant می‌گیرند؛ نسخه قبلی حذف می‌شود تا PostgREST بین دو امضا گیر نکند
+# ردیف‌های موجود tenant ندارند و با دستور assign_tenant به یک سوپر ادمین داده می‌شوند.
+CREATE_TENANT = """
+DO $$
+DECLARE
+    base_tables text[] := ARRAY(
+        SELECT c.relname::text FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname IN ('users', 'channels') AND c.relkind IN ('r', 'p')
+    );
+BEGIN
+    IF 'users' = ANY (base_tables) THEN
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS tenant_id bigint;
+        CREATE INDEX IF NOT EXISTS users_tenant_uid_idx ON users (tenant_id, uid);
+        CREATE INDEX IF NOT EXISTS users_tenant_username_idx ON users (tenant_id, username);
+
+        DROP FUNCTION IF EXISTS console_search_users(text, text, boolean, integer, integer);
+        EXECUTE $ddl$
+        CREATE OR REPLACE FUNCTION console_search_users(
+            q text DEFAULT NULL,
+            user_role text DEFAULT NULL,
+            user_active boolean DEFAULT NULL,
+            page_limit integer DEFAULT 50,
+            page_offset integer DEFAULT 0,
+            tenant bigint DEFAULT NULL
+        ) RETURNS SETOF users AS $fn$
+            WITH term AS (
+                SELECT nullif(btrim(q), '') AS raw,
+                       replace(replace(replace(btrim(q), '\\', '\\\\'), '%', '\\%'), '_', '\\_') AS escaped
+            )
+            SELECT u.* FROM users u, term t
+            WHERE (tenant IS NULL OR u.tenant_id = tenant)
+              AND (user_role IS NULL OR u.role = user_role)
+              AND (user_active IS NULL OR u.active = user_active)
+              AND (t.raw IS NULL OR u.username ILIKE '%' || t.escaped || '%' OR u.username % t.raw)
+            ORDER BY (t.raw IS NOT NULL AND u.username ILIKE t.escaped || '%') DESC,
+                     similarity(u.username, coalesce(t.raw, '')) DESC,
+                     u.username, u.uid
+            LIMIT page_limit OFFSET page_offset
+        $fn$ LANGUAGE sql STABLE;
+        $ddl$;
+    ELSE
+        RAISE NOTICE 'users is not a table in %; tenant_id not added', current_schema();
+    END IF;
+
+    IF 'channels' = ANY (base_tables) THEN
+        ALTER TABLE channels ADD COLUMN IF NOT EXISTS tenant_id bigint;
+        CREATE INDEX IF NOT EXISTS channels_tenant_uid_idx ON channels (tenant_id, uid);
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'channels' AND column_name = 'name_normalized'
+        ) THEN
+            IF EXISTS (SELECT 1 FROM channels GROUP BY coalesce(tenant_id, 0), name_normalized HAVING count(*) > 1) THEN
+                RAISE NOTICE 'channels with the same normalized name exist; channels_tenant_name_key not created';
+            ELSE
+                CREATE UNIQUE INDEX IF NOT EXISTS channels_tenant_name_key
+                    ON channels (coalesce(tenant_id, 0), name_normalized);
+                DROP INDEX IF EXISTS channels_name_search_key;
+            END IF;
+
+            DROP FUNCTION IF EXISTS console_search_channels(text, integer, integer);
+            EXECUTE $ddl$
+            CREATE OR REPLACE FUNCTION console_search_channels(
+                q text DEFAULT NULL,
+                page_limit integer DEFAULT 50,
+                page_offset integer DEFAULT 0,
+                tenant bigint DEFAULT NULL
+            ) RETURNS SETOF channels AS $fn$
+                WITH term AS (
+                    SELECT nullif(console_normalize_name(q), '') AS raw,
+                           replace(replace(replace(console_normalize_name(q), '\\', '\\\\'), '%', '\\%'), '_', '\\_') AS escaped
+                )
+                SELECT c.* FROM channels c, term t
+                WHERE (tenant IS NULL OR c.tenant_id = tenant)
+                  AND (t.raw IS NULL OR c.name_normalized LIKE '%' || t.escaped || '%' OR c.name_normalized % t.raw)
+                ORDER BY (t.raw IS NOT NULL AND c.name_normalized LIKE t.escaped || '%') DESC,
+                         similarity(c.name_normalized, coalesce(t.raw, '')) DESC,
+                         c.name, c.uid
+                LIMIT page_limit OFFSET page_offset
+            $fn$ LANGUAGE sql STABLE;
+            $ddl$;
+        END IF;
+    ELSE
+        RAISE NOTICE 'channels is not a table in %; tenant_id not added', current_schema();
+    END IF;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
+DROP_TENANT = """
+DROP FUNCTION IF EXISTS console_search_users(text, text, boolean, integer, integer, bigint);
+DROP FUNCTION IF EXISTS console_search_channels(text, integer, integer, bigint);
+DROP INDEX IF EXISTS users_tenant_uid_idx;
+DROP INDEX IF EXISTS users_tenant_username_idx;
+DROP INDEX IF EXISTS channels_tenant_uid_idx;
+DROP INDEX IF EXISTS channels_tenant_name_key;
+ALTER TABLE IF EXISTS users DROP COLUMN IF EXISTS tenant_id;
+ALTER TABLE IF EXISTS channels DROP COLUMN IF EXISTS tenant_id;
+"""
+
+
+def _restore_search(apps, schema_editor):
+    # توابع و ایندکس‌های یکتای مهاجرت‌های 0019 و 0020 دوباره ساخته می‌شوند (هر دو تکرارپذیرند)
+    for name in ('0019_user_search', '0020_channel_name_search'):
+        schema_editor.execute(importlib.import_module(f'console.migrations.{name}').CREATE_SEARCH, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0021_membership_uid_text_indexes'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_TENANT, DROP_TENANT),
+        migrations.RunPython(migrations.RunPython.noop, _restore_search),
+    ]
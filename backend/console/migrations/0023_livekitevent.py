@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 01:57
+
+import django.db.models.functions.datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0022_tenant_scoping'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveKitEvent',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('event_id', models.CharField(max_length=64, unique=True)),
+                ('event', models.CharField(max_length=40)),
+                ('room_name', models.CharField(blank=True, default='', max_length=255)),
+                ('room_sid', models.CharField(blank=True, default='', max_length=64)),
+                ('participant_identity', models.CharField(blank=True, default='', max_length=255)),
+                ('participant_sid', models.CharField(blank=True, default='', max_length=64)),
+                ('track_sid', models.CharField(blank=True, default='', max_length=64)),
+                ('created_at', models.DateTimeField()),
+                ('received_at', models.DateTimeField(db_default=django.db.models.functions.datetime.Now())),
+                ('payload', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'LiveKit Event',
+                'verbose_name_plural': 'LiveKit Events',
+                'db_table': 'livekit_event',
+                'indexes': [models.Index(fields=['room_name', 'created_at'], name='livekit_event_room'), models.Index(fields=['participant_identity', 'created_at'], name='livekit_event_participant')],
+            },
+        ),
+    ]
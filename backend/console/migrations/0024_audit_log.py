@@ -0,0 +1,87 @@
+# Generated by Django 5.2 on 2026-10-19 02:00
+
+from django.db import migrations, models
+
+
+# جدول ممیزی بر اساس ماه partition می‌شود تا نوشتن‌ها فقط به partition ماه جاری بروند و داده قدیمی با
+# DROP TABLE یک partition پاک شود. ایندکس‌ها روی جدول والد تعریف و به همه partitionها اعمال می‌شوند.
+# console_audit_partition partition ماه یک زمان را می‌سازد (console.audit پیش از اولین نوشتن هر ماه آن را
+# صدا می‌زند)؛ partition پیش‌فرض ردیف‌هایی را می‌گیرد که partition ماهشان ساخته نشده باشد.
+CREATE_AUDIT_LOG = """
+CREATE TABLE IF NOT EXISTS audit_log (
+    id bigint GENERATED BY DEFAULT AS IDENTITY,
+    created_at timestamp with time zone NOT NULL DEFAULT now(),
+    actor varchar(150) NOT NULL DEFAULT '',
+    action varchar(10) NOT NULL,
+    entity varchar(20) NOT NULL,
+    entity_id varchar(64) NOT NULL DEFAULT '',
+    status_code smallint,
+    changes jsonb NOT NULL DEFAULT '{}'::jsonb,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS audit_log_actor ON audit_log (actor, created_at);
+CREATE INDEX IF NOT EXISTS audit_log_entity ON audit_log (entity, entity_id, created_at);
+CREATE TABLE IF NOT EXISTS audit_log_default PARTITION OF audit_log DEFAULT;
+
+CREATE OR REPLACE FUNCTION console_audit_partition(at timestamp with time zone) RETURNS text AS $$
+DECLARE
+    month_start timestamp with time zone := date_trunc('month', at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+    partition_name text := 'audit_log_' || to_char(month_start AT TIME ZONE 'UTC', 'YYYY_MM');
+BEGIN
+    IF to_regclass(partition_name) IS NULL THEN
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF audit_log FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_start + interval '1 month'
+            );
+        EXCEPTION
+            -- پروسه دیگری همزمان همین partition را ساخت
+            WHEN duplicate_table THEN NULL;
+            -- ردیف‌های این ماه پیش‌تر در partition پیش‌فرض نوشته شده‌اند
+            WHEN check_violation THEN
+                RAISE WARNING 'audit_log_default has rows for %; % not created', month_start, partition_name;
+        END;
+    END IF;
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT console_audit_partition(now());
+SELECT console_audit_partition(now() + interval '1 month');
+"""
+
+DROP_AUDIT_LOG = """
+DROP FUNCTION IF EXISTS console_audit_partition(timestamp with time zone);
+DROP TABLE IF EXISTS audit_log CASCADE;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0023_livekitevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('actor', models.CharField(blank=True, default='', max_length=150)),
+                ('action', models.CharField(choices=[('create', 'Create'), ('update', 'Update'), ('delete', 'Delete')], max_length=10)),
+                ('entity', models.CharField(max_length=20)),
+                ('entity_id', models.CharField(blank=True, default='', max_length=64)),
+                ('status_code', models.SmallIntegerField(null=True)),
+                ('changes', models.JSONField(default=dict)),
+            ],
+            options={
+                'verbose_name': 'Audit Log Entry',
+                'verbose_name_plural': 'Audit Log',
+                'db_table': 'audit_log',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_AUDIT_LOG, DROP_AUDIT_LOG),
+    ]
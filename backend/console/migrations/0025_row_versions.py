@@ -0,0 +1,61 @@
+from django.db import migrations
+
+
+# ستون version برای If-Match روی users و channels (console.versioning):
+# - ردیف‌های موجود نسخه 1 می‌گیرند (پیش‌فرض ثابت، بدون بازنویسی جدول)
+# - تریگر BEFORE UPDATE با هر تغییر واقعی ردیف (از PostgREST، تریگرهای عضویت یا SQL مستقیم) نسخه را یکی
+#   بالا می‌برد و نسخه ارسالی نویسنده را نادیده می‌گیرد؛ ستون generated name_normalized در این مرحله هنوز
+#   محاسبه نشده و در مقایسه حساب نمی‌شود
+CREATE_VERSIONS = """
+CREATE OR REPLACE FUNCTION console_bump_version() RETURNS trigger AS $$
+BEGIN
+    IF to_jsonb(NEW) - 'version' - 'name_normalized' IS DISTINCT FROM to_jsonb(OLD) - 'version' - 'name_normalized' THEN
+        NEW.version := OLD.version + 1;
+    ELSE
+        NEW.version := OLD.version;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['users', 'channels'] LOOP
+        IF EXISTS (
+            SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema() AND c.relname = t AND c.relkind IN ('r', 'p')
+        ) THEN
+            EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS version bigint NOT NULL DEFAULT 1', t);
+            EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_bump_version', t);
+            EXECUTE format(
+                'CREATE TRIGGER %I BEFORE UPDATE ON %I '
+                'FOR EACH ROW EXECUTE FUNCTION console_bump_version()', t || '_bump_version', t
+            );
+        ELSE
+            RAISE NOTICE '% is not a table in %; version not added', t, current_schema();
+        END IF;
+    END LOOP;
+END;
+$$;
+
+NOTIFY pgrst, 'reload schema';
+"""
+
+DROP_VERSIONS = """
+DROP FUNCTION IF EXISTS console_bump_version() CASCADE;
+ALTER TABLE IF EXISTS users DROP COLUMN IF EXISTS version;
+ALTER TABLE IF EXISTS channels DROP COLUMN IF EXISTS version;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0024_audit_log'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_VERSIONS, DROP_VERSIONS),
+    ]
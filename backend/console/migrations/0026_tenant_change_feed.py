@@ -0,0 +1,160 @@
+# Generated by Django 5.2 on 2026-10-19 02:26
+
+from django.db import migrations, models
+
+
+# همان تریگر 0016 به همراه tenant_id ردیف در change_log و در payload رویدادهای console_changes، تا /changes/
+# (حتی tombstoneها) و /api/events/ فقط تغییرات سوپر ادمین خود را برگردانند. ورودی‌های قبلی tenant ندارند.
+LOG_CHANGE_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_log_change() RETURNS trigger AS $$
+DECLARE
+    member_column text := CASE TG_TABLE_NAME WHEN 'channels' THEN 'allowed_users' ELSE 'allowed_channels' END;
+    old_members jsonb := '[]';
+    new_members jsonb := '[]';
+    added jsonb;
+    removed jsonb;
+    entry_id bigint;
+    payload jsonb;
+    old_tenant bigint;
+    new_tenant bigint;
+BEGIN
+    IF TG_OP = 'UPDATE' AND to_jsonb(NEW) = to_jsonb(OLD) THEN
+        RETURN NULL;
+    END IF;
+    -- tenant_id با 0022 فقط روی جدول‌های واقعی اضافه شده است؛ از jsonb خوانده می‌شود تا نبودنش خطا ندهد
+    IF TG_OP <> 'INSERT' THEN
+        old_tenant := (to_jsonb(OLD) ->> 'tenant_id')::bigint;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        new_tenant := (to_jsonb(NEW) ->> 'tenant_id')::bigint;
+    END IF;
+    IF TG_OP <> 'INSERT' AND jsonb_typeof(to_jsonb(OLD) -> member_column) = 'array' THEN
+        old_members := to_jsonb(OLD) -> member_column;
+    END IF;
+    IF TG_OP <> 'DELETE' AND jsonb_typeof(to_jsonb(NEW) -> member_column) = 'array' THEN
+        new_members := to_jsonb(NEW) -> member_column;
+    END IF;
+
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.uid IS DISTINCT FROM OLD.uid) THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at, tenant_id)
+        VALUES (TG_TABLE_NAME, OLD.uid::text, 'delete', txid_current(), now(), old_tenant)
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', OLD.uid::text, 'op', 'delete', 'id', entry_id,
+            'tenant', old_tenant
+        )::text);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at, tenant_id)
+        VALUES (TG_TABLE_NAME, NEW.uid::text, 'upsert', txid_current(), now(), new_tenant)
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', NEW.uid::text, 'op', 'upsert', 'id', entry_id,
+            'tenant', new_tenant
+        )::text);
+    END IF;
+
+    IF old_members IS DISTINCT FROM new_members THEN
+        SELECT coalesce(jsonb_agg(m), '[]') INTO added
+        FROM jsonb_array_elements_text(new_members) m WHERE NOT old_members ? m;
+        SELECT coalesce(jsonb_agg(m), '[]') INTO removed
+        FROM jsonb_array_elements_text(old_members) m WHERE NOT new_members ? m;
+        payload := jsonb_build_object(
+            'kind', 'membership', 'table', TG_TABLE_NAME,
+            'uid', coalesce(to_jsonb(NEW) ->> 'uid', to_jsonb(OLD) ->> 'uid'),
+            'id', entry_id, 'tenant', coalesce(new_tenant, old_tenant), 'added', added, 'removed', removed
+        );
+        -- سقف اندازه payload در NOTIFY حدود ۸۰۰۰ بایت است
+        IF octet_length(payload::text) > 7500 THEN
+            payload := (payload - 'added' - 'removed') || '{"truncated": true}';
+        END IF;
+        IF added <> '[]' OR removed <> '[]' THEN
+            PERFORM pg_notify('console_changes', payload::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+# بازگشت به تریگر 0016
+PREVIOUS_FUNCTION = """
+CREATE OR REPLACE FUNCTION console_log_change() RETURNS trigger AS $$
+DECLARE
+    member_column text := CASE TG_TABLE_NAME WHEN 'channels' THEN 'allowed_users' ELSE 'allowed_channels' END;
+    old_members jsonb := '[]';
+    new_members jsonb := '[]';
+    added jsonb;
+    removed jsonb;
+    entry_id bigint;
+    payload jsonb;
+BEGIN
+    IF TG_OP = 'UPDATE' AND to_jsonb(NEW) = to_jsonb(OLD) THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' AND jsonb_typeof(to_jsonb(OLD) -> member_column) = 'array' THEN
+        old_members := to_jsonb(OLD) -> member_column;
+    END IF;
+    IF TG_OP <> 'DELETE' AND jsonb_typeof(to_jsonb(NEW) -> member_column) = 'array' THEN
+        new_members := to_jsonb(NEW) -> member_column;
+    END IF;
+
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND NEW.uid IS DISTINCT FROM OLD.uid) THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, OLD.uid::text, 'delete', txid_current(), now())
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', OLD.uid::text, 'op', 'delete', 'id', entry_id
+        )::text);
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO change_log (table_name, row_uid, op, txid, changed_at)
+        VALUES (TG_TABLE_NAME, NEW.uid::text, 'upsert', txid_current(), now())
+        RETURNING id INTO entry_id;
+        PERFORM pg_notify('console_changes', jsonb_build_object(
+            'kind', 'row', 'table', TG_TABLE_NAME, 'uid', NEW.uid::text, 'op', 'upsert', 'id', entry_id
+        )::text);
+    END IF;
+
+    IF old_members IS DISTINCT FROM new_members THEN
+        SELECT coalesce(jsonb_agg(m), '[]') INTO added
+        FROM jsonb_array_elements_text(new_members) m WHERE NOT old_members ? m;
+        SELECT coalesce(jsonb_agg(m), '[]') INTO removed
+        FROM jsonb_array_elements_text(old_members) m WHERE NOT new_members ? m;
+        payload := jsonb_build_object(
+            'kind', 'membership', 'table', TG_TABLE_NAME,
+            'uid', coalesce(to_jsonb(NEW) ->> 'uid', to_jsonb(OLD) ->> 'uid'),
+            'id', entry_id, 'added', added, 'removed', removed
+        );
+        -- سقف اندازه payload در NOTIFY حدود ۸۰۰۰ بایت است
+        IF octet_length(payload::text) > 7500 THEN
+            payload := (payload - 'added' - 'removed') || '{"truncated": true}';
+        END IF;
+        IF added <> '[]' OR removed <> '[]' THEN
+            PERFORM pg_notify('console_changes', payload::text);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0025_row_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelogentry',
+            name='tenant_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['table_name', 'tenant_id', 'txid', 'id'], name='change_log_tenant_cursor'),
+        ),
+        migrations.RunSQL(LOG_CHANGE_FUNCTION, PREVIOUS_FUNCTION),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 09:12
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0026_tenant_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogPrune',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(default=1, primary_key=True, serialize=False)),
+                ('pruned_through_txid', models.BigIntegerField()),
+                ('pruned_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Change Log Prune',
+                'verbose_name_plural': 'Change Log Prunes',
+                'db_table': 'change_log_prune',
+            },
+        ),
+        # change_log فقط به انتها اضافه می‌شود، پس BRIN روی changed_at با چند صفحه ورودی‌های قدیمی را پیدا می‌کند
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['changed_at'], name='change_log_changed_at'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('console', '0027_change_log_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencyrecord',
+            name='response_headers',
+            field=models.JSONField(default=dict),
+        ),
+    ]
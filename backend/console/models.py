@@ -5,6 +5,13 @@ Defines ORM models for the console app:
 - Channel: model with auto-generated unique channel_id, name, and ManyToMany link to User.
 - User: custom user model mapping to 'users' table with credentials and role.
 - SuperAdmin: model for storing super admin credentials and user limits.
+- MembershipSyncJob: durable queue entry for deferred membership fan-out.
+- UserLifecycleOutbox: resumable record of a user create/update/delete across Auth and the users table.
+- IdempotencyRecord: stored response of a create request sent with an Idempotency-Key header.
+- ChangeLogEntry: trigger-written record of a users/channels row change, read by the delta sync endpoints.
+- ChannelMembership: one (channel, user) access pair; source of the allowed_users/allowed_channels arrays.
+- LiveKitEvent: one room, participant or track event received from the LiveKit webhook.
+- AuditLogEntry: one audited create/update/delete on channels, users or super admins.
 """
 
 from django.db import models
@@ -12,7 +19,10 @@ import uuid
 
 import random
 from django.db import models
+from django.contrib.postgres.indexes import BrinIndex
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.functions import Now
 
 MIN_ID = 1000000
 MAX_ID = 9999999
@@ -120,3 +130,286 @@ class SuperAdmin(models.Model):
 
     def __str__(self):
         return self.admin_super_user
+
+class MembershipSyncJob(models.Model):
+    """
+    Queued membership fan-out for a channel or user edit:
+    - source_type: 'channel' or 'user' (the row whose membership list was edited)
+    - source_uid: uid of the edited channel/user
+    - added: uids that must now reference source_uid on the other side
+    - removed: uids that must no longer reference source_uid
+    - status: pending, running, done or failed
+    - attempts / last_error: retry bookkeeping for the worker
+    """
+    SOURCE_CHANNEL = 'channel'
+    SOURCE_USER = 'user'
+    SOURCE_CHOICES = [(SOURCE_CHANNEL, 'Channel'), (SOURCE_USER, 'User')]
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    source_type = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    source_uid = models.CharField(max_length=50)
+    added = models.JSONField(default=list)
+    removed = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'membership_sync_job'
+        verbose_name = 'Membership Sync Job'
+        verbose_name_plural = 'Membership Sync Jobs'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='membership_sync_job_queue'),
+        ]
+
+    def __str__(self):
+        return f"{self.source_type}:{self.source_uid} ({self.status})"
+
+class UserLifecycleOutbox(models.Model):
+    """
+    Outbox entry for one user lifecycle operation:
+    - operation: create, update or delete
+    - user_uid: Supabase Auth id of the user
+    - payload: data the remaining steps need (never contains passwords)
+    - completed_steps: names of the idempotent steps that already succeeded
+    - status / attempts / last_error: worker bookkeeping, same states as MembershipSyncJob
+    """
+    OPERATION_CREATE = 'create'
+    OPERATION_UPDATE = 'update'
+    OPERATION_DELETE = 'delete'
+    OPERATION_CHOICES = [
+        (OPERATION_CREATE, 'Create'),
+        (OPERATION_UPDATE, 'Update'),
+        (OPERATION_DELETE, 'Delete'),
+    ]
+
+    STATUS_PENDING = MembershipSyncJob.STATUS_PENDING
+    STATUS_RUNNING = MembershipSyncJob.STATUS_RUNNING
+    STATUS_DONE = MembershipSyncJob.STATUS_DONE
+    STATUS_FAILED = MembershipSyncJob.STATUS_FAILED
+    STATUS_CHOICES = MembershipSyncJob.STATUS_CHOICES
+
+    id = models.BigAutoField(primary_key=True)
+    operation = models.CharField(max_length=10, choices=OPERATION_CHOICES)
+    user_uid = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    completed_steps = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'user_lifecycle_outbox'
+        verbose_name = 'User Lifecycle Outbox'
+        verbose_name_plural = 'User Lifecycle Outbox'
+        indexes = [
+            models.Index(fields=['status', 'id'], name='user_lifecycle_outbox_queue'),
+            models.Index(fields=['user_uid'], name='user_lifecycle_outbox_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.operation}:{self.user_uid} ({self.status})"
+
+class IdempotencyRecord(models.Model):
+    """
+    Response cache entry for a POST sent with an Idempotency-Key header:
+    - scope / key: endpoint name and client-supplied key (unique together)
+    - request_hash: SHA-256 of the request body, to reject key reuse with another payload
+    - state: in_progress while the first request runs, completed once its response is stored
+    - response_status / response_body: the stored response replayed to retries
+    - response_headers: headers of that response that are replayed too (ETag, Location)
+    - expires_at: end of the replay window
+    """
+    STATE_IN_PROGRESS = 'in_progress'
+    STATE_COMPLETED = 'completed'
+    STATE_CHOICES = [
+        (STATE_IN_PROGRESS, 'In progress'),
+        (STATE_COMPLETED, 'Completed'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    scope = models.CharField(max_length=50)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    state = models.CharField(max_length=12, choices=STATE_CHOICES, default=STATE_IN_PROGRESS)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    response_headers = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_record'
+        verbose_name = 'Idempotency Record'
+        verbose_name_plural = 'Idempotency Records'
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_record_scope_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key} ({self.state})"
+
+class ChangeLogEntry(models.Model):
+    """
+    One row change in users or channels, written by the console_log_change() trigger:
+    - table_name: 'users' or 'channels'
+    - row_uid: uid of the changed row
+    - op: 'upsert' for insert/update, 'delete' for a tombstone
+    - txid: id of the writing transaction; (txid, id) is the sync cursor order
+    - changed_at: time of the change
+    - tenant_id: the row's owning super admin (migration 0026), so tombstones can be scoped too
+    """
+    OP_UPSERT = 'upsert'
+    OP_DELETE = 'delete'
+    OP_CHOICES = [(OP_UPSERT, 'Upsert'), (OP_DELETE, 'Delete')]
+
+    id = models.BigAutoField(primary_key=True)
+    table_name = models.CharField(max_length=20)
+    row_uid = models.CharField(max_length=50)
+    op = models.CharField(max_length=6, choices=OP_CHOICES)
+    txid = models.BigIntegerField()
+    changed_at = models.DateTimeField()
+    tenant_id = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'change_log'
+        verbose_name = 'Change Log Entry'
+        verbose_name_plural = 'Change Log'
+        indexes = [
+            models.Index(fields=['table_name', 'txid', 'id'], name='change_log_cursor'),
+            models.Index(fields=['table_name', 'tenant_id', 'txid', 'id'], name='change_log_tenant_cursor'),
+            BrinIndex(fields=['changed_at'], name='change_log_changed_at'),
+        ]
+
+    def __str__(self):
+        return f"{self.table_name}:{self.row_uid} ({self.op})"
+
+
+class ChangeLogPrune(models.Model):
+    """
+    Watermark of change_log pruning, a single row (id=1) written by prune_change_log:
+    - pruned_through_txid: entries up to this txid may have been deleted; older cursors must resync
+    - pruned_at: time of the last prune
+    """
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    pruned_through_txid = models.BigIntegerField()
+    pruned_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'change_log_prune'
+        verbose_name = 'Change Log Prune'
+        verbose_name_plural = 'Change Log Prunes'
+
+
+class ChannelMembership(models.Model):
+    """
+    One user's access to one channel:
+    - channel_uid / user_uid: the pair, unique together
+    - created_at: when access was granted
+    Triggers from migration 0017 keep channels.allowed_users and users.allowed_channels in step with
+    this table in both directions, so readers of the arrays keep working.
+    """
+    id = models.BigAutoField(primary_key=True)
+    channel_uid = models.CharField(max_length=50)
+    user_uid = models.CharField(max_length=50)
+    # پیش‌فرض در خود دیتابیس، چون ردیف‌ها از PostgREST و تریگرها هم درج می‌شوند
+    created_at = models.DateTimeField(db_default=Now())
+
+    class Meta:
+        db_table = 'channel_membership'
+        verbose_name = 'Channel Membership'
+        verbose_name_plural = 'Channel Memberships'
+        constraints = [
+            models.UniqueConstraint(fields=['channel_uid', 'user_uid'], name='channel_membership_pair'),
+        ]
+        indexes = [
+            models.Index(fields=['user_uid'], name='channel_membership_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.channel_uid}:{self.user_uid}"
+
+class LiveKitEvent(models.Model):
+    """
+    One LiveKit webhook event (room_*, participant_*, track_*), written in batches by console.livekit_webhooks:
+    - event_id: LiveKit's event id, unique so a redelivered webhook is stored once
+    - event: event type, e.g. participant_joined
+    - room_name: room of the event (the channel uid for PTT rooms) and room_sid
+    - participant_identity / participant_sid / track_sid: set for participant and track events
+    - created_at: when LiveKit emitted the event; received_at: when the batch was written
+    - payload: the full event as received
+    """
+    id = models.BigAutoField(primary_key=True)
+    event_id = models.CharField(max_length=64, unique=True)
+    event = models.CharField(max_length=40)
+    room_name = models.CharField(max_length=255, blank=True, default='')
+    room_sid = models.CharField(max_length=64, blank=True, default='')
+    participant_identity = models.CharField(max_length=255, blank=True, default='')
+    participant_sid = models.CharField(max_length=64, blank=True, default='')
+    track_sid = models.CharField(max_length=64, blank=True, default='')
+    created_at = models.DateTimeField()
+    # پیش‌فرض در خود دیتابیس، چون ردیف‌ها با INSERT چندردیفی خام نوشته می‌شوند
+    received_at = models.DateTimeField(db_default=Now())
+    payload = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'livekit_event'
+        verbose_name = 'LiveKit Event'
+        verbose_name_plural = 'LiveKit Events'
+        indexes = [
+            models.Index(fields=['room_name', 'created_at'], name='livekit_event_room'),
+            models.Index(fields=['participant_identity', 'created_at'], name='livekit_event_participant'),
+        ]
+
+    def __str__(self):
+        return f"{self.event}:{self.room_name} ({self.event_id})"
+
+class AuditLogEntry(models.Model):
+    """
+    One create, update or delete made through the admin API, written in batches by console.audit:
+    - created_at: time of the request; the audit_log table is partitioned by month on it (migration 0024)
+    - actor: username of the acting user ('' when nobody was logged in)
+    - action: 'create', 'update' or 'delete'
+    - entity / entity_id: 'channel', 'user' or 'super_admin' and its uid or id
+    - status_code: HTTP status of the response
+    - changes: request body without passwords
+    The table is created by raw SQL because Django cannot declare partitions; its primary key is
+    (id, created_at).
+    """
+    ACTION_CREATE = 'create'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [(ACTION_CREATE, 'Create'), (ACTION_UPDATE, 'Update'), (ACTION_DELETE, 'Delete')]
+
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField()
+    actor = models.CharField(max_length=150, blank=True, default='')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    entity = models.CharField(max_length=20)
+    entity_id = models.CharField(max_length=64, blank=True, default='')
+    status_code = models.SmallIntegerField(null=True)
+    changes = models.JSONField(default=dict)
+
+    class Meta:
+        db_table = 'audit_log'
+        managed = False
+        verbose_name = 'Audit Log Entry'
+        verbose_name_plural = 'Audit Log'
+
+    def __str__(self):
+        return f"{self.actor} {self.action} {self.entity}:{self.entity_id}"
@@ -0,0 +1,246 @@
+"""
+console/reconcile.py
+Consistency check and repair of channel membership across its stores: users.allowed_channels,
+channels.allowed_users and, after migration 0017, the channel_membership table.
+- load: read every store with keyset pagination into sets of (channel_uid, user_uid) pairs, all from
+  the primary inside one REPEATABLE READ READ ONLY transaction, so the stores are compared at the same
+  moment (a replica or separate scans could show a concurrent change on one side only).
+- plan: choose the target pair set (see SOURCES) and diff every store against it.
+- apply: write a plan in batches; with dry_run only count the writes.
+
+Pairs whose channel or user no longer exists are orphans and never part of the target.
+Array repairs are deltas (remove the extra uids, append the missing ones) rather than whole-array
+writes, so members changed concurrently in the same row are not overwritten.
+"""
+
+import logging
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from . import jsoncodec, membership_sync
+from .membership_sync import DB_ALIAS
+from .models import ChannelMembership
+
+logger = logging.getLogger(__name__)
+
+# منبع درست عضویت‌ها در تعمیر:
+# - union: هر جفتی که دست کم در یکی از منابع آمده است (همان قاعده backfill مهاجرت 0017)
+# - membership / users / channels: فقط همان منبع
+SOURCES = ('union', 'membership', 'users', 'channels')
+
+ARRAY_STORES = {
+    'users': 'allowed_channels',
+    'channels': 'allowed_users',
+}
+
+
+def _batch_size():
+    return getattr(settings, 'RECONCILE_BATCH_SIZE', 5000)
+
+
+def _query(sql, params):
+    """(column names, rows) of one query on the primary supabase database, never the replica."""
+    with connections[DB_ALIAS].cursor() as cursor:
+        cursor.execute(sql, params)
+        return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def _uid_cast(table):
+    """Array type of `table`.uid (uuid, text, varchar...)."""
+    _columns, rows = _query(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute WHERE attrelid = %s::regclass AND attname = 'uid'",
+        [table]
+    )
+    return f"{rows[0][0]}[]" if rows else 'text[]'
+
+
+@contextmanager
+def _snapshot():
+    """One read-only transaction on the primary whose queries all see the same snapshot."""
+    with transaction.atomic(using=DB_ALIAS):
+        with connections[DB_ALIAS].cursor() as cursor:
+            # باید اولین دستور تراکنش باشد
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+        yield
+
+
+def membership_table_exists():
+    _columns, rows = _query("SELECT to_regclass('channel_membership') IS NOT NULL", [])
+    return bool(rows[0][0])
+
+
+def default_source(has_table):
+    # با نوشتن مستقیم در channel_membership این جدول منبع اصلی است
+    if has_table and membership_sync.table_writes_enabled():
+        return 'membership'
+    return 'union'
+
+
+def _load_array_store(table, batch_size):
+    """(uids of the table, (channel_uid, user_uid) pairs from its membership array)."""
+    column = ARRAY_STORES[table]
+    uids, pairs = set(), set()
+    last_uid = None
+    while True:
+        if last_uid is None:
+            _columns, rows = _query(f"SELECT uid, {column}::text FROM {table} ORDER BY uid LIMIT %s", [batch_size])
+        else:
+            _columns, rows = _query(
+                f"SELECT uid, {column}::text FROM {table} WHERE uid > %s ORDER BY uid LIMIT %s", [last_uid, batch_size]
+            )
+        for uid, members in rows:
+            uid = str(uid)
+            uids.add(uid)
+            # jsonb به صورت متن خوانده می‌شود تا به تنظیمات تبدیل نوع درایور وابسته نباشد
+            members = jsoncodec.loads(members) if members else None
+            if not isinstance(members, list):
+                continue
+            if table == 'users':
+                pairs.update((str(member), uid) for member in members)
+            else:
+                pairs.update((uid, str(member)) for member in members)
+        if len(rows) < batch_size:
+            return uids, pairs
+        last_uid = rows[-1][0]
+
+
+def _load_membership_table(batch_size):
+    pairs = set()
+    last_id = 0
+    while True:
+        rows = list(
+            ChannelMembership.objects.using(DB_ALIAS)
+            .filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'channel_uid', 'user_uid')[:batch_size]
+        )
+        pairs.update((channel_uid, user_uid) for _id, channel_uid, user_uid in rows)
+        if len(rows) < batch_size:
+            return pairs
+        last_id = rows[-1][0]
+
+
+def load(batch_size=None):
+    """
+    Every store as a set of pairs, plus the uids that exist:
+    {'users', 'channels', 'membership' (None without the table), 'user_uids', 'channel_uids'}
+    """
+    batch_size = batch_size or _batch_size()
+    with _snapshot():
+        user_uids, user_pairs = _load_array_store('users', batch_size)
+        channel_uids, channel_pairs = _load_array_store('channels', batch_size)
+        membership = _load_membership_table(batch_size) if membership_table_exists() else None
+    return {
+        'users': user_pairs,
+        'channels': channel_pairs,
+        'membership': membership,
+        'user_uids': user_uids,
+        'channel_uids': channel_uids,
+    }
+
+
+def plan(state, source):
+    """
+    Target pair set and, per store, the pairs it is missing and the pairs it has in excess.
+    Returns {'target', 'orphans': {store: pairs}, 'missing': {store: pairs}, 'extra': {store: pairs}}.
+    """
+    stores = {name: state[name] for name in ('users', 'channels', 'membership') if state.get(name) is not None}
+    if source not in SOURCES or (source != 'union' and source not in stores):
+        raise ValueError(source)
+
+    user_uids, channel_uids = state['user_uids'], state['channel_uids']
+    orphans = {
+        name: {pair for pair in pairs if pair[0] not in channel_uids or pair[1] not in user_uids}
+        for name, pairs in stores.items()
+    }
+    target = set().union(*stores.values()) if source == 'union' else set(stores[source])
+    target -= set().union(*orphans.values())
+    return {
+        'target': target,
+        'orphans': orphans,
+        'missing': {name: target - pairs for name, pairs in stores.items()},
+        'extra': {name: pairs - target for name, pairs in stores.items()},
+    }
+
+
+def _array_deltas(table, missing, extra):
+    """One {'uid', 'add_items', 'remove_items'} record per row of `table` that needs a change."""
+    key = 1 if table == 'users' else 0
+    deltas = defaultdict(lambda: {'add_items': [], 'remove_items': []})
+    for pair in missing:
+        deltas[pair[key]]['add_items'].append(pair[1 - key])
+    for pair in extra:
+        deltas[pair[key]]['remove_items'].append(pair[1 - key])
+    return [{'uid': uid, **items} for uid, items in sorted(deltas.items())]
+
+
+def _update_arrays(table, records, uid_type):
+    column = ARRAY_STORES[table]
+    with connections[DB_ALIAS].cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} AS t SET {column} =
+                (console_member_array(to_jsonb(t), '{column}') - ARRAY(SELECT jsonb_array_elements_text(v.remove_items)))
+                || coalesce((
+                    SELECT jsonb_agg(item) FROM jsonb_array_elements_text(v.add_items) item
+                    WHERE NOT console_member_array(to_jsonb(t), '{column}') ? item
+                ), '[]'::jsonb)
+            FROM jsonb_to_recordset(%s::jsonb) AS v(uid text, add_items jsonb, remove_items jsonb)
+            WHERE t.uid = v.uid::{uid_type}
+            """,
+            [jsoncodec.dumps(records).decode('utf-8')]
+        )
+        return cursor.rowcount
+
+
+def _delete_pairs(pairs):
+    with connections[DB_ALIAS].cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM channel_membership m USING unnest(%s::text[], %s::text[]) AS d(channel_uid, user_uid) "
+            "WHERE m.channel_uid = d.channel_uid AND m.user_uid = d.user_uid",
+            [[pair[0] for pair in pairs], [pair[1] for pair in pairs]]
+        )
+        return cursor.rowcount
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def apply(result, batch_size=None, dry_run=False):
+    """
+    Write a plan: array deltas for users and channels, then channel_membership inserts and deletes.
+    Writes are idempotent, so rows the 0017 triggers already fixed are no-ops.
+    Returns {store: number of rows written (or to be written with dry_run)}.
+    """
+    batch_size = batch_size or _batch_size()
+    written = {}
+    for table in ARRAY_STORES:
+        if table not in result['missing']:
+            continue
+        records = _array_deltas(table, result['missing'][table], result['extra'][table])
+        written[table] = len(records)
+        if dry_run or not records:
+            continue
+        uid_type = _uid_cast(table)[:-2]
+        for batch in _batches(records, batch_size):
+            _update_arrays(table, batch, uid_type)
+        logger.info(f"{len(records)} ردیف جدول {table} هم‌تراز شد")
+
+    if 'membership' in result['missing']:
+        inserts = sorted(result['missing']['membership'])
+        deletes = sorted(result['extra']['membership'])
+        written['membership'] = len(inserts) + len(deletes)
+        if not dry_run:
+            for batch in _batches(inserts, batch_size):
+                ChannelMembership.objects.using(DB_ALIAS).bulk_create(
+                    [ChannelMembership(channel_uid=channel_uid, user_uid=user_uid) for channel_uid, user_uid in batch],
+                    ignore_conflicts=True,
+                )
+            for batch in _batches(deletes, batch_size):
+                _delete_pairs(batch)
+            logger.info(f"{len(inserts)} جفت به channel_membership افزوده و {len(deletes)} جفت حذف شد")
+    return written
@@ -0,0 +1,41 @@
+"""
+console/renderers.py
+DRF renderer and parser backed by console.jsoncodec:
+- FastJSONRenderer: drop-in replacement for rest_framework.renderers.JSONRenderer.
+- FastJSONParser: drop-in replacement for rest_framework.parsers.JSONParser.
+"""
+
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import jsoncodec
+
+_encoder = JSONEncoder()
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """
+    Render compact JSON with the fast codec. Requests that ask for indentation
+    (browsable API, ?format=json with indent) fall back to DRF's renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+        # انواعی مثل UUID، Decimal و datetime با encoder خود DRF تبدیل می‌شوند
+        return jsoncodec.dumps(data, default=_encoder.default)
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return jsoncodec.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,127 @@
+"""
+console/replica.py
+Optional read replica of the supabase database (alias `supabase_replica`, set up when POSTGRES_REPLICA_HOST is set):
+- LagProbe: per-process replication lag of the replica, measured at most every REPLICA_LAG_CHECK_SECONDS.
+- read_alias: the alias a read should use: the replica, unless it is missing, lagging, unreachable
+  or the current request is pinned to the primary.
+- start_pin / stop_pin / pin / pinned: pin the current request to the primary (see
+  admin_panel.middleware.ReplicaPinMiddleware, which also pins a client for REPLICA_PIN_SECONDS after a write).
+
+Only reads that can tolerate REPLICA_MAX_LAG_SECONDS of staleness use read_alias (SupabaseRouter's
+db_for_read, exports, LiveKit grants); writes, outbox and sync queues keep using the primary explicitly.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .membership_sync import DB_ALIAS
+
+logger = logging.getLogger(__name__)
+
+REPLICA_ALIAS = 'supabase_replica'
+# کوکی کلاینتی که به تازگی چیزی نوشته است؛ تا انقضای آن خواندن‌هایش از primary انجام می‌شود
+PIN_COOKIE = 'console_primary_pin'
+
+# روی primary (بدون recovery) تأخیر صفر است؛ وقتی WAL در حال استریم است و همه WAL دریافتی اعمال شده باشد هم
+# تأخیری وجود ندارد. اگر گیرنده WAL قطع شده باشد برابری LSNها معنایی ندارد و فاصله از آخرین تراکنش اعمال شده
+# حساب می‌شود تا replica متوقف شده کم‌کم ناسالم شود (بدون دسترسی pg_read_all_stats ستون status خالی است و
+# همیشه همین حالت امن استفاده می‌شود)
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming')
+         AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_pinned = contextvars.ContextVar('console_primary_pinned', default=False)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def configured():
+    return REPLICA_ALIAS in settings.DATABASES
+
+
+class LagProbe:
+    """
+    Thread-safe, time-cached replication lag of the replica in seconds (None when it cannot be measured).
+    Only one thread measures at a time; the others use the last value meanwhile.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._lag = None
+
+    def _measure(self):
+        try:
+            with connections[REPLICA_ALIAS].cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError as e:
+            logger.warning(f"اندازه‌گیری تأخیر replica ناموفق بود: {e}")
+            return None
+        return None if lag is None else float(lag)
+
+    def lag(self):
+        now = self._clock()
+        interval = _setting('REPLICA_LAG_CHECK_SECONDS', 5)
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return self._lag
+        if not self._lock.acquire(blocking=False):
+            return self._lag
+        try:
+            self._checked_at = now
+            lag = self._measure()
+            if lag is not None and lag > _setting('REPLICA_MAX_LAG_SECONDS', 2):
+                logger.warning(f"تأخیر replica {lag:.1f} ثانیه است؛ خواندن‌ها به primary فرستاده می‌شوند")
+            self._lag = lag
+            return lag
+        finally:
+            self._lock.release()
+
+    def healthy(self):
+        lag = self.lag()
+        return lag is not None and lag <= _setting('REPLICA_MAX_LAG_SECONDS', 2)
+
+    def reset(self):
+        with self._lock:
+            self._checked_at = None
+            self._lag = None
+
+
+probe = LagProbe()
+
+
+def start_pin(pinned_to_primary):
+    """Bind the pin state of a new request; returns the token for stop_pin()."""
+    return _pinned.set(pinned_to_primary)
+
+
+def stop_pin(token):
+    _pinned.reset(token)
+
+
+def pin():
+    """Read from the primary for the rest of the current request (e.g. after it wrote)."""
+    _pinned.set(True)
+
+
+def pinned():
+    return _pinned.get()
+
+
+def read_alias():
+    if not configured() or pinned() or not probe.healthy():
+        return DB_ALIAS
+    return REPLICA_ALIAS
@@ -0,0 +1,249 @@
+"""
+console/resilience.py
+Retry and circuit-breaker helpers for upstream calls that go through Kong:
+- CircuitBreaker: per-upstream breaker (closed -> open -> half-open) shared by all threads of a worker.
+- get_breaker / upstream_for_url: map a Kong URL to its breaker (PostgREST and GoTrue are tracked separately).
+- backoff_delay: full-jitter exponential backoff between retries.
+- send: issue one HTTP request, retrying idempotent methods and failing fast while the breaker is open.
+  Attempts and backoff sleeps are cut to the request's deadline (console.deadline).
+- UpstreamUnavailable / note_unavailable: an upstream that could not answer, remembered for the current
+  request so UpstreamUnavailableMiddleware answers 503 with Retry-After instead of a misleading 404/500.
+"""
+
+import contextvars
+import logging
+import math
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from . import deadline
+
+logger = logging.getLogger(__name__)
+
+# فقط درخواست‌های بدون اثر جانبی تکرار می‌شوند
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+# خطاهای گذرای Kong/PostgREST که ارزش تلاش مجدد دارند
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+UPSTREAM_POSTGREST = 'postgrest'
+UPSTREAM_GOTRUE = 'gotrue'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class UpstreamUnavailable(requests.exceptions.RequestException):
+    """An upstream did not answer (breaker open or retries exhausted); retry_after is in seconds."""
+
+    def __init__(self, *args, retry_after=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+
+# بیشترین Retry-After upstreamهایی که در درخواست جاری در دسترس نبوده‌اند (None یعنی همه پاسخ داده‌اند)
+_unavailable = contextvars.ContextVar('console_upstream_unavailable', default=None)
+
+
+def start_request():
+    return _unavailable.set(None)
+
+
+def stop_request(token):
+    _unavailable.reset(token)
+
+
+def note_unavailable(error):
+    """Record that the current request could not reach an upstream."""
+    _unavailable.set(max(_unavailable.get() or 0, error.retry_after))
+
+
+def unavailable_retry_after():
+    """Retry-After seconds if an upstream was unavailable during the current request, else None."""
+    return _unavailable.get()
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker:
+    - closed: requests pass, consecutive failures are counted
+    - open: requests fail fast until reset_timeout has elapsed
+    - half_open: a single probe request is let through; its outcome closes or re-opens the circuit
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _current_state(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow_request(self):
+        """Return True if a request may be sent to the upstream right now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"مدار {self.name} دوباره بسته شد")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN:
+                self._trip()
+                return
+            self._failures += 1
+            if self._state == self.CLOSED and self._failures >= self.failure_threshold:
+                self._trip()
+
+    def release(self):
+        """End a request without an outcome (e.g. cut short by our own deadline)."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def retry_after(self):
+        """Whole seconds until an open circuit lets a probe through; 1 when it is not open."""
+        with self._lock:
+            if self._state != self.OPEN:
+                return 1
+            return max(1, math.ceil(self.reset_timeout - (self._clock() - self._opened_at)))
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        logger.warning(f"مدار {self.name} باز شد؛ درخواست‌ها تا {self.reset_timeout} ثانیه رد می‌شوند")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(upstream):
+    """Return the process-wide breaker for the given upstream name."""
+    with _breakers_lock:
+        breaker = _breakers.get(upstream)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                upstream,
+                failure_threshold=_setting('SUPABASE_BREAKER_FAILURE_THRESHOLD', 5),
+                reset_timeout=_setting('SUPABASE_BREAKER_RESET_TIMEOUT', 30.0),
+            )
+            _breakers[upstream] = breaker
+        return breaker
+
+
+def reset_breakers():
+    """Forget all breaker state (used by tests)."""
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def upstream_for_url(url):
+    """Kong routes /auth/v1 to GoTrue and everything else we use to PostgREST."""
+    path = urlsplit(url).path
+    if path.startswith('/auth/'):
+        return UPSTREAM_GOTRUE
+    return UPSTREAM_POSTGREST
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for the given 1-based attempt number."""
+    base = _setting('SUPABASE_RETRY_BACKOFF_BASE', 0.2)
+    cap = _setting('SUPABASE_RETRY_BACKOFF_MAX', 2.0)
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+def send(method, url, headers=None, json=None, timeout=None):
+    """
+    ارسال یک درخواست HTTP به Kong با رعایت مدارشکن و تلاش مجدد
+    Only idempotent methods are retried; RETRYABLE_STATUS_CODES and connection errors count as
+    breaker failures, while other 5xx (e.g. a PostgREST 500 for a bad query) do not. Raises
+    CircuitOpenError while the upstream's breaker is open and deadline.DeadlineExceeded once the
+    current request's budget is spent. Every attempt settles the breaker, whatever it raises.
+    """
+    method = method.upper()
+    breaker = get_breaker(upstream_for_url(url))
+    attempts = _setting('SUPABASE_RETRY_ATTEMPTS', 3) if method in IDEMPOTENT_METHODS else 1
+    if timeout is None:
+        timeout = _setting('SUPABASE_REQUEST_TIMEOUT', 10.0)
+    call = f"{method} {urlsplit(url).path}"
+
+    attempt = 0
+    while True:
+        attempt += 1
+        attempt_timeout = deadline.clamp(timeout, call)
+        if not breaker.allow_request():
+            raise CircuitOpenError(
+                f"مدار {breaker.name} باز است؛ درخواست {method} {url} ارسال نشد", retry_after=breaker.retry_after()
+            )
+
+        try:
+            response = requests.request(method, url, headers=headers, json=json, timeout=attempt_timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attempt_timeout < timeout and deadline.remaining() == 0:
+                # مهلت کوتاه‌تر درخواست خودمان تمام شده است، نه مهلت upstream؛ شکست مدار حساب نمی‌شود
+                breaker.release()
+                raise deadline.interrupted(call) from e
+            breaker.record_failure()
+            if attempt >= attempts:
+                raise
+            logger.warning(f"خطای اتصال به {breaker.name} (تلاش {attempt} از {attempts}): {e}")
+        except BaseException:
+            # خطاهای دیگر (مثلاً ChunkedEncodingError یا TooManyRedirects) درباره سلامت upstream چیزی نمی‌گویند،
+            # ولی درخواست آزمایشی نیمه‌باز باید آزاد شود وگرنه مدار برای همیشه نیمه‌باز می‌ماند
+            breaker.release()
+            raise
+        else:
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                # 500 ناشی از پرس‌وجوی نادرست یعنی upstream در دسترس است و شکست مدار حساب نمی‌شود
+                breaker.record_success()
+                deadline.completed(call)
+                return response
+            breaker.record_failure()
+            if attempt >= attempts:
+                deadline.completed(call)
+                return response
+            logger.warning(f"پاسخ {response.status_code} از {breaker.name} (تلاش {attempt} از {attempts})")
+
+        delay = backoff_delay(attempt)
+        # اگر پس از انتظار زمانی برای تلاش بعدی نماند، همین حالا متوقف می‌شویم
+        deadline.check(call, needed=delay)
+        time.sleep(delay)
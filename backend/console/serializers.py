@@ -4,10 +4,11 @@ Defines Django REST framework serializers for User and Channel:
 - UserSerializer: handles user data and channel memberships via 'allowed_channels'.
 - ChannelSerializer: handles channel data and authorized_users assignment.
 - SuperAdminSerializer: handles super admin data including credential and user limits.
+- MembershipSyncJobSerializer: read-only status of queued membership sync jobs.
 """
 
 from rest_framework import serializers
-from .models import User, Channel, SuperAdmin
+from .models import User, Channel, SuperAdmin, MembershipSyncJob
 from django.contrib.auth.hashers import make_password
 
 class UserSerializer(serializers.ModelSerializer):
@@ -73,3 +74,10 @@ class SuperAdminSerializer(serializers.ModelSerializer):
         if 'admin_super_password' in validated_data:
             validated_data['admin_super_password'] = make_password(validated_data['admin_super_password'])
         return super().update(instance, validated_data)
+
+class MembershipSyncJobSerializer(serializers.ModelSerializer):
+    """Serialize a queued membership sync job for status polling."""
+    class Meta:
+        model = MembershipSyncJob
+        fields = ['id', 'source_type', 'source_uid', 'added', 'removed', 'status', 'attempts', 'last_error', 'created_at', 'updated_at']
+        read_only_fields = fields
@@ -8,6 +8,8 @@ import traceback
 import datetime
 import uuid
 
+from . import coalescing, deadline, jsoncodec, resilience
+
 # تنظیم لاگر
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -28,20 +30,55 @@ headers = {
     "X-Client-Info": "supabase-js/1.0.0"
 }
 
-def _make_request(method: str, endpoint: str, data: Dict[str, Any] = None) -> Dict[str, Any]:
+class UniqueViolation(Exception):
+    """Raised when a write is rejected by a unique constraint (PostgREST 409 / SQLSTATE 23505, GoTrue email_exists)."""
+
+
+def raise_for_unique_violation(response) -> None:
+    """
+    تبدیل پاسخ خطای نقض یکتایی به UniqueViolation
+    Other error responses are left to the caller.
+    """
+    if response.status_code not in (409, 422):
+        return
+    try:
+        error = jsoncodec.loads(response.content)
+    except ValueError:
+        return
+    if not isinstance(error, dict):
+        return
+    # نسخه‌های قدیمی GoTrue فقط متن خطا را برمی‌گردانند
+    if (error.get("code") == "23505" or error.get("error_code") == "email_exists"
+            or "already been registered" in str(error.get("msg", ""))):
+        raise UniqueViolation(error.get("message") or error.get("msg") or error.get("details") or "")
+
+def _make_request(method: str, endpoint: str, data: Dict[str, Any] = None, prefer: str = None,
+                  coalesce: bool = True) -> Dict[str, Any]:
+    # درخواست‌های GET یکسان و هم‌زمان پاسخ یک درخواست مشترک را دریافت می‌کنند؛
+    # خواندن پیش از نوشتن (read-modify-write) با coalesce=False همیشه درخواست خودش را می‌فرستد
+    if method.upper() == "GET":
+        return coalescing.coalesce_get(
+            endpoint, lambda: _send_request(method, endpoint, data), coalescing.upstream_gets, coalesce
+        )
+    return _send_request(method, endpoint, data, prefer)
+
+def _send_request(method: str, endpoint: str, data: Dict[str, Any] = None, prefer: str = None) -> Dict[str, Any]:
     url = f"{_base_url}{endpoint}"
+    # هدر Prefer پیش‌فرض (return=representation) برای درخواست‌هایی مثل upsert قابل تغییر است
+    request_headers = headers if prefer is None else {**headers, "Prefer": prefer}
     try:
         logger.info(f"ارسال درخواست {method} به {url}")
-        logger.info(f"هدرها: {json.dumps(headers, ensure_ascii=False)}")
+        logger.info(f"هدرها: {json.dumps(request_headers, ensure_ascii=False)}")
         if data:
             logger.info(f"داده‌های ارسالی: {json.dumps(data, ensure_ascii=False)}")
         
-        response = requests.request(method, url, headers=headers, json=data)
+        response = resilience.send(method, url, headers=request_headers, json=data)
         
         logger.info(f"کد وضعیت: {response.status_code}")
         logger.info(f"پاسخ دریافتی: {response.text}")
         
         if response.status_code >= 400:
+            raise_for_unique_violation(response)
             error_data = {}
             try:
                 error_data = response.json()
@@ -59,18 +96,21 @@ def _make_request(method: str, endpoint: str, data: Dict[str, Any] = None) -> Di
             logger.info("درخواست موفق اما پاسخ خالی")
             return True
             
-        # برای درخواست‌های DELETE، اگر کد وضعیت 200 است و پاسخ خالی است، True برگردان
-        if method == "DELETE" and response.status_code == 200:
-            if not response.text.strip():
-                logger.info("درخواست DELETE با موفقیت انجام شد")
-                return True
-            else:
-                logger.error("پاسخ غیرمنتظره برای درخواست DELETE")
-                return None
+        # پاسخ DELETE به دلیل هدر Prefer: return=representation شامل ردیف‌های حذف شده است
+        if method == "DELETE":
+            logger.info("درخواست DELETE با موفقیت انجام شد")
             
-        result = response.json()
+        result = jsoncodec.loads(response.content)
         logger.info(f"پاسخ پردازش شده: {json.dumps(result, ensure_ascii=False)}")
         return result
+    except resilience.CircuitOpenError as e:
+        logger.error(f"درخواست ارسال نشد: {e}")
+        return None
+    except deadline.DeadlineExceeded:
+        raise
+    except ValueError as e:
+        logger.error(f"پاسخ JSON نامعتبر از {url}: {e}")
+        return None
     except requests.exceptions.RequestException as e:
         logger.error(f"خطا در ارسال درخواست: {e}")
         if hasattr(e, 'response') and e.response is not None:
@@ -124,7 +164,8 @@ def create_user(username: str, password: str, role: str = 'user', active: bool =
         logger.info(f"هدرها: {json.dumps(headers)}")
         logger.info(f"داده‌های ارسالی: {json.dumps(auth_data)}")
         
-        response = requests.post(
+        response = resilience.send(
+            "POST",
             f"{_base_url}/auth/v1/admin/users",
             headers=headers,
             json=auth_data
@@ -168,7 +209,8 @@ def create_user(username: str, password: str, role: str = 'user', active: bool =
         logger.info(f"هدرها: {json.dumps(headers)}")
         logger.info(f"داده‌های ارسالی: {json.dumps(user_data)}")
         
-        rest_response = requests.post(
+        rest_response = resilience.send(
+            "POST",
             f"{_base_url}/rest/v1/users",
             headers=headers,
             json=user_data
@@ -197,7 +239,8 @@ def create_user(username: str, password: str, role: str = 'user', active: bool =
             logger.error(f"خطا در ذخیره کاربر در جدول users: {rest_response.text}")
             
             # حذف کاربر از Auth
-            delete_response = requests.delete(
+            delete_response = resilience.send(
+                "DELETE",
                 f"{_base_url}/auth/v1/admin/users/{auth_response['id']}",
                 headers=headers
             )
@@ -218,7 +261,8 @@ def create_user(username: str, password: str, role: str = 'user', active: bool =
                     "Content-Type": "application/json"
                 }
                 
-                delete_response = requests.delete(
+                delete_response = resilience.send(
+                    "DELETE",
                     f"{_base_url}/auth/v1/admin/users/{auth_response['id']}",
                     headers=headers
                 )
@@ -229,10 +273,12 @@ def create_user(username: str, password: str, role: str = 'user', active: bool =
         
         return None
 
-def create_channel(name: str, allowed_users: Optional[List[str]] = None) -> Dict[str, Any]:
+def create_channel(name: str, allowed_users: Optional[List[str]] = None, tenant_id: Optional[int] = None) -> Dict[str, Any]:
     """
     ایجاد کانال جدید در Supabase
     با ساخت شناسه uid که با uuid باشد
+    The row comes back from the insert itself; a duplicate name of the same tenant raises UniqueViolation
+    (unique index channels_tenant_name_key) instead of being checked beforehand.
     """
     try:
         logger.info(f"شروع فرآیند ایجاد کانال: name={name}")
@@ -246,6 +292,8 @@ def create_channel(name: str, allowed_users: Optional[List[str]] = None) -> Dict
             "uid": unique_uid,
             "allowed_users": allowed_users or []
         }
+        if tenant_id is not None:
+            channel["tenant_id"] = tenant_id
         
         logger.info(f"داده‌های کانال ارسالی: {channel}")
         
@@ -255,27 +303,6 @@ def create_channel(name: str, allowed_users: Optional[List[str]] = None) -> Dict
             channel
         )
         
-        if response is True:
-            # اگر _make_request یک boolean برگرداند، به این معنی است که عملیات موفق بوده اما داده‌ای برگشت نداده
-            logger.info("کانال با موفقیت ایجاد شد اما داده‌ای برگشت داده نشد")
-            # دریافت اطلاعات کانال ایجاد شده
-            created_channel = _make_request(
-                "GET", 
-                f"/rest/v1/channels?uid=eq.{unique_uid}"
-            )
-            
-            if isinstance(created_channel, list) and len(created_channel) > 0:
-                return created_channel[0]
-            
-            # ساخت یک پاسخ با حاوی اطلاعات اصلی کانال
-            return {
-                "success": True, 
-                "message": "کانال با موفقیت ایجاد شد", 
-                "uid": unique_uid,
-                "name": name,
-                "allowed_users": allowed_users or []
-            }
-            
         # اگر پاسخ None یا False باشد، یک پاسخ با حداقل اطلاعات برگشت می‌دهیم
         if response is None or response is False:
             logger.error("خطا در ایجاد کانال - پاسخ خالی یا نامعتبر")
@@ -284,8 +311,14 @@ def create_channel(name: str, allowed_users: Optional[List[str]] = None) -> Dict
         # اگر پاسخ یک لیست باشد، اولین آیتم را برگشت می‌دهیم
         if isinstance(response, list) and len(response) > 0:
             return response[0]
-            
-        return response
+        if isinstance(response, dict):
+            return response
+
+        # درج موفق بود اما ردیفی برنگشت (مثلاً Prefer نادیده گرفته شد)؛ uid را خودمان ساخته‌ایم
+        logger.info("کانال با موفقیت ایجاد شد اما داده‌ای برگشت داده نشد")
+        return channel
+    except UniqueViolation:
+        raise
     except Exception as e:
         logger.error(f"خطا در ساخت کانال: {e}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
@@ -349,4 +382,113 @@ def delete_user(user_id: str) -> bool:
         return True
     except Exception as e:
         logger.error(f"خطا در حذف کاربر {user_id}: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def _auth_email(username: str) -> str:
+    # نام کاربری بدون @ به ایمیل ساختگی Auth تبدیل می‌شود
+    return username if '@' in username else f"{username}@example.com"
+
+def create_auth_user(username: str, password: str, role: str = 'user', active: bool = True, allowed_channels: list = None) -> Optional[Dict[str, Any]]:
+    """
+    ساخت کاربر فقط در Supabase Auth
+    گام همگام چرخه عمر کاربر؛ ثبت در جدول users از طریق outbox انجام می‌شود
+    """
+    auth_data = {
+        "email": _auth_email(username),
+        "password": password,
+        "email_confirm": True,
+        "user_metadata": {
+            "role": role,
+            "active": active,
+            "allowed_channels": allowed_channels or [],
+            "email_verified": True
+        }
+    }
+    try:
+        response = resilience.send("POST", f"{_base_url}/auth/v1/admin/users", headers=headers, json=auth_data)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"خطا در ساخت کاربر در Auth: {e}")
+        return None
+
+    # ایمیل تکراری (همان نام کاربری) به صورت UniqueViolation گزارش می‌شود
+    raise_for_unique_violation(response)
+    if response.status_code not in (200, 201):
+        logger.error(f"خطا در ساخت کاربر در Auth: {response.status_code} - {response.text}")
+        return None
+    try:
+        auth_user = jsoncodec.loads(response.content)
+    except ValueError:
+        logger.error(f"پاسخ نامعتبر از Auth API: {response.text}")
+        return None
+    if not isinstance(auth_user, dict) or not auth_user.get("id"):
+        logger.error("پاسخ Auth شناسه کاربر ندارد")
+        return None
+    return auth_user
+
+def update_auth_user(user_id: str, data: Dict[str, Any]) -> bool:
+    """به‌روزرسانی ایمیل یا رمز عبور کاربر در Supabase Auth"""
+    try:
+        response = resilience.send("PUT", f"{_base_url}/auth/v1/admin/users/{user_id}", headers=headers, json=data)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"خطا در به‌روزرسانی کاربر {user_id} در Auth: {e}")
+        return False
+    raise_for_unique_violation(response)
+    if response.status_code >= 400:
+        logger.error(f"خطا در به‌روزرسانی کاربر {user_id} در Auth: {response.status_code} - {response.text}")
+        return False
+    return True
+
+def delete_auth_user(user_id: str) -> bool:
+    """
+    حذف کاربر از Supabase Auth
+    کاربری که از قبل وجود ندارد حذف شده در نظر گرفته می‌شود تا تکرار این گام بی‌خطر باشد
+    """
+    try:
+        response = resilience.send("DELETE", f"{_base_url}/auth/v1/admin/users/{user_id}", headers=headers)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"خطا در حذف کاربر {user_id} از Auth: {e}")
+        return False
+    if response.status_code == 404 or response.status_code < 400:
+        return True
+    logger.error(f"خطا در حذف کاربر {user_id} از Auth: {response.status_code} - {response.text}")
+    return False
+
+def sign_in_with_password(username: str, password: str) -> Optional[str]:
+    """
+    ورود کاربر با نام کاربری و رمز عبور در Supabase Auth؛ شناسه کاربر یا None
+    The request body is not logged, unlike _send_request, because it carries the password.
+    """
+    try:
+        response = resilience.send(
+            "POST", f"{_base_url}/auth/v1/token?grant_type=password", headers=headers,
+            json={"email": _auth_email(username), "password": password}
+        )
+    except requests.exceptions.RequestException as e:
+        logger.error(f"خطا در ورود کاربر {username} در Auth: {e}")
+        return None
+    if response.status_code != 200:
+        logger.info(f"ورود کاربر {username} در Auth ناموفق بود: {response.status_code}")
+        return None
+    try:
+        session = jsoncodec.loads(response.content)
+    except ValueError:
+        return None
+    user = session.get("user") if isinstance(session, dict) else None
+    return user.get("id") if isinstance(user, dict) else None
+
+def upsert_user_row(user_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    ثبت یا به‌روزرسانی ردیف کاربر در جدول users بر اساس uid
+    One upsert request; a username taken by another uid raises UniqueViolation.
+    """
+    response = _make_request(
+        "POST",
+        "/rest/v1/users?on_conflict=uid",
+        user_data,
+        prefer="resolution=merge-duplicates,return=representation",
+    )
+    if response is None:
+        return None
+    if isinstance(response, list) and response:
+        return response[0]
+    return user_data
@@ -0,0 +1,294 @@
+"""
+console/synthetic.py
+Synthetic super admins, users, channels and memberships for capacity testing:
+- generate_channels / generate_users: rows with a realistic membership shape. Channel popularity follows
+  a Zipf (power-law) distribution and every user is in min..max channels (log-uniform, so most users
+  have a few channels and some have many).
+- split_tenants: the owning super admin of every row, a power-law split so a few tenants are large.
+- write: load a generated dataset with COPY, one batch of rows at a time. Users and channels belong to
+  the seeded super admins (tenant_id of migration 0022) and users only join channels of their own tenant.
+- clear: delete everything created with a given prefix.
+
+Rows are only written to the database tables; seeded users have no Auth account and cannot log in.
+Writes run in one transaction with the membership triggers of migration 0017 disabled, because the
+generator fills users.allowed_channels, channels.allowed_users and channel_membership itself.
+"""
+
+import io
+import logging
+import math
+import random
+import uuid
+from bisect import bisect_right
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import connections, transaction
+
+from . import jsoncodec
+from .membership_sync import DB_ALIAS
+from .models import MAX_ID, MIN_ID, SuperAdmin
+
+logger = logging.getLogger(__name__)
+
+ROLES = ('regular', 'regular', 'regular', 'senior', 'manager', 'admin')
+
+MEMBERSHIP_TRIGGERS = (
+    ('channel_membership', 'channel_membership_to_arrays'),
+    ('channels', 'channels_membership_sync'),
+    ('users', 'users_membership_sync'),
+)
+
+USER_COLUMNS = ('uid', 'username', 'role', 'active', 'allowed_channels', 'tenant_id')
+CHANNEL_COLUMNS = ('uid', 'name', 'allowed_users', 'tenant_id')
+
+# سقف تعداد عضو در یک دسته از کانال‌ها؛ آرایه کانال‌های پرعضو بسیار بزرگ است
+MEMBERS_PER_BATCH = 200000
+
+
+def _batch_size():
+    return getattr(settings, 'SEED_BATCH_SIZE', 5000)
+
+
+def _uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_channels(count, prefix, rng, alpha=1.0):
+    """[(uid, name)] and the cumulative Zipf weights used to pick channels for users."""
+    channels = [(_uuid(rng), f"{prefix} کانال {i:06d}") for i in range(1, count + 1)]
+    # رتبه محبوبیت به ترتیب تصادفی داده می‌شود تا کانال‌های بزرگ پشت سر هم نباشند
+    ranks = list(range(1, count + 1))
+    rng.shuffle(ranks)
+    cum_weights = list(accumulate(rank ** -alpha for rank in ranks))
+    return channels, cum_weights
+
+
+def _channel_count(rng, min_channels, max_channels):
+    value = math.exp(rng.uniform(math.log(min_channels), math.log(max_channels + 1)))
+    return min(max_channels, int(value))
+
+
+def _pick(rng, cum_weights, count):
+    """`count` distinct channel indexes drawn by weight."""
+    if count * 2 > len(cum_weights):
+        # با انتخاب بیشتر کانال‌ها، کشیدن وزنی برای کانال‌های کم‌وزن بسیار طول می‌کشد
+        return set(rng.sample(range(len(cum_weights)), count))
+    total = cum_weights[-1]
+    picked = set()
+    while len(picked) < count:
+        for _ in range(count - len(picked)):
+            picked.add(bisect_right(cum_weights, rng.random() * total))
+    return picked
+
+
+def split_tenants(count, tenants, rng, alpha=1.0):
+    """The tenant of each of `count` rows, drawn with Zipf weights over `tenants` (all None without tenants)."""
+    if not tenants:
+        return [None] * count
+    cum_weights = list(accumulate(rank ** -alpha for rank in range(1, len(tenants) + 1)))
+    total = cum_weights[-1]
+    return [tenants[bisect_right(cum_weights, rng.random() * total)] for _ in range(count)]
+
+
+def _tenant_pools(channels, cum_weights, channel_tenants):
+    """{tenant: (channels, cum_weights)}: each tenant's channels with their share of the popularity weights."""
+    pools = {}
+    previous = 0
+    for channel, weight, tenant in zip(channels, cum_weights, channel_tenants):
+        pool_channels, pool_weights = pools.setdefault(tenant, ([], []))
+        pool_channels.append(channel)
+        pool_weights.append((pool_weights[-1] if pool_weights else 0) + weight - previous)
+        previous = weight
+    return pools
+
+
+def generate_users(count, prefix, channels, cum_weights, rng, min_channels=1, max_channels=200, tenant=None,
+                   start=1):
+    """
+    Yields user rows of `tenant`, numbered from `start`; allowed_channels holds between min_channels and
+    max_channels uids of `channels`.
+    """
+    max_channels = min(max_channels, len(channels))
+    min_channels = min(min_channels, max_channels)
+    for i in range(start, start + count):
+        if max_channels:
+            indexes = _pick(rng, cum_weights, _channel_count(rng, max(min_channels, 1), max_channels))
+        else:
+            indexes = ()
+        yield {
+            'uid': _uuid(rng),
+            'username': f"{prefix}_user_{i:07d}",
+            'role': rng.choice(ROLES),
+            'active': rng.random() > 0.05,
+            'allowed_channels': [channels[index][0] for index in sorted(indexes)],
+            'tenant_id': tenant,
+        }
+
+
+def generate_super_admins(count, prefix, rng, password=None, user_limit=1000, existing_ids=()):
+    # هش رمز کند است؛ یک بار برای همه ساخته می‌شود
+    hashed = make_password(password)
+    taken = set(existing_ids)
+    admins = []
+    for i in range(1, count + 1):
+        super_admin_id = rng.randint(MIN_ID, MAX_ID)
+        while super_admin_id in taken:
+            super_admin_id = rng.randint(MIN_ID, MAX_ID)
+        taken.add(super_admin_id)
+        admins.append(SuperAdmin(
+            super_admin_id=super_admin_id,
+            admin_super_user=f"{prefix}_admin_{i:04d}",
+            admin_super_password=hashed,
+            user_limit=user_limit,
+            created_by=prefix,
+        ))
+    return admins
+
+
+def _set_membership_triggers(cursor, enabled):
+    action = 'ENABLE' if enabled else 'DISABLE'
+    for table, trigger in MEMBERSHIP_TRIGGERS:
+        cursor.execute(
+            "SELECT 1 FROM pg_trigger WHERE tgname = %s AND tgrelid = to_regclass(%s)", [trigger, table]
+        )
+        if cursor.fetchone():
+            cursor.execute(f"ALTER TABLE {table} {action} TRIGGER {trigger}")
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, dict)):
+        value = jsoncodec.dumps(value).decode('utf-8')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _copy(cursor, table, columns, rows):
+    """COPY rows (tuples in `columns` order) into `table` in PostgreSQL text format."""
+    data = ''.join('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    raw = cursor.cursor
+    if hasattr(raw, 'copy_expert'):
+        # psycopg2
+        raw.copy_expert(sql, io.StringIO(data))
+    else:
+        # psycopg 3
+        with raw.copy(sql) as copy:
+            copy.write(data)
+
+
+def write(users=0, channels=0, super_admins=0, prefix='seed', seed=None, alpha=1.0, min_channels=1,
+          max_channels=200, admin_password=None, batch_size=None, using=None):
+    """
+    Generate and insert a dataset; returns {'super_admins', 'users', 'channels', 'memberships'} counts.
+    Channel names and usernames start with `prefix`, so clear(prefix) removes the dataset again.
+    Without super admins the users and channels have no tenant (tenant_id NULL).
+    """
+    using = using or DB_ALIAS
+    batch_size = batch_size or _batch_size()
+    rng = random.Random(seed)
+    channel_rows, cum_weights = generate_channels(channels, prefix, rng, alpha)
+    members = {uid: [] for uid, _name in channel_rows}
+    counts = {'super_admins': super_admins, 'users': 0, 'channels': channels, 'memberships': 0}
+
+    # تقسیم بر اساس شماره سوپر ادمین انجام می‌شود و پس از درج به id آنها نگاشت می‌شود
+    ranks = list(range(super_admins))
+    channel_tenants = split_tenants(channels, ranks, rng, alpha)
+    user_tenants = split_tenants(users, ranks, rng, alpha)
+
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute("SELECT to_regclass('channel_membership') IS NOT NULL")
+        has_table = cursor.fetchone()[0]
+        _set_membership_triggers(cursor, False)
+
+        tenant_ids = {None: None}
+        if super_admins:
+            existing = SuperAdmin.objects.using(using).values_list('super_admin_id', flat=True)
+            admins = generate_super_admins(super_admins, prefix, rng, admin_password, max(users, 1), existing)
+            for admin in admins:
+                admin.user_count = 0
+            for rank in user_tenants:
+                admins[rank].user_count += 1
+            SuperAdmin.objects.using(using).bulk_create(admins, batch_size=batch_size)
+            created = dict(SuperAdmin.objects.using(using).filter(
+                admin_super_user__in=[admin.admin_super_user for admin in admins]
+            ).values_list('admin_super_user', 'id'))
+            tenant_ids = {rank: created[admin.admin_super_user] for rank, admin in enumerate(admins)}
+
+        pools = _tenant_pools(channel_rows, cum_weights, channel_tenants)
+        channel_tenant = {uid: tenant_ids[rank] for (uid, _name), rank in zip(channel_rows, channel_tenants)}
+        user_counts = {}
+        for rank in user_tenants:
+            user_counts[rank] = user_counts.get(rank, 0) + 1
+
+        batch = []
+        start = 1
+        for rank in sorted(user_counts, key=lambda rank: -1 if rank is None else rank):
+            pool_channels, pool_weights = pools.get(rank, ([], []))
+            for user in generate_users(user_counts[rank], prefix, pool_channels, pool_weights, rng, min_channels,
+                                       max_channels, tenant_ids[rank], start):
+                batch.append(user)
+                if len(batch) >= batch_size:
+                    counts['memberships'] += _flush_users(cursor, batch, members, has_table)
+                    counts['users'] += len(batch)
+                    batch = []
+            start += user_counts[rank]
+        if batch:
+            counts['memberships'] += _flush_users(cursor, batch, members, has_table)
+            counts['users'] += len(batch)
+
+        batch, batch_members = [], 0
+        for uid, name in channel_rows:
+            batch.append((uid, name, members[uid], channel_tenant[uid]))
+            batch_members += len(members[uid])
+            if len(batch) >= batch_size or batch_members >= MEMBERS_PER_BATCH:
+                _copy(cursor, 'channels', CHANNEL_COLUMNS, batch)
+                batch, batch_members = [], 0
+        if batch:
+            _copy(cursor, 'channels', CHANNEL_COLUMNS, batch)
+
+        _set_membership_triggers(cursor, True)
+
+    logger.info(f"داده آزمایشی با پیشوند {prefix} ساخته شد: {counts}")
+    return counts
+
+
+def _flush_users(cursor, batch, members, has_table):
+    _copy(cursor, 'users', USER_COLUMNS, [tuple(user[column] for column in USER_COLUMNS) for user in batch])
+    pairs = []
+    for user in batch:
+        for channel_uid in user['allowed_channels']:
+            members[channel_uid].append(user['uid'])
+            pairs.append((channel_uid, user['uid']))
+    if has_table and pairs:
+        _copy(cursor, 'channel_membership', ('channel_uid', 'user_uid'), pairs)
+    return len(pairs)
+
+
+def clear(prefix='seed', using=None):
+    """Delete the super admins, users, channels and memberships created by write() with `prefix`."""
+    using = using or DB_ALIAS
+    pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        cursor.execute("SELECT to_regclass('channel_membership') IS NOT NULL")
+        has_table = cursor.fetchone()[0]
+        _set_membership_triggers(cursor, False)
+        if has_table:
+            cursor.execute(
+                "DELETE FROM channel_membership WHERE channel_uid IN (SELECT uid::text FROM channels WHERE name LIKE %s) "
+                "OR user_uid IN (SELECT uid::text FROM users WHERE username LIKE %s)",
+                [f"{pattern} کانال %", f"{pattern}\\_user\\_%"]
+            )
+        cursor.execute("DELETE FROM users WHERE username LIKE %s", [f"{pattern}\\_user\\_%"])
+        users = cursor.rowcount
+        cursor.execute("DELETE FROM channels WHERE name LIKE %s", [f"{pattern} کانال %"])
+        channels = cursor.rowcount
+        _set_membership_triggers(cursor, True)
+    super_admins, _detail = SuperAdmin.objects.using(using).filter(
+        admin_super_user__startswith=f"{prefix}_admin_", created_by=prefix
+    ).delete()
+    return {'super_admins': super_admins, 'users': users, 'channels': channels}
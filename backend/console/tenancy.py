@@ -0,0 +1,89 @@
+"""
+console/tenancy.py
+Tenant scoping of the users and channels tables by super admin (migration 0022):
+- TENANT_COLUMN: the tenant key column, holding the owning SuperAdmin.id.
+- is_platform: whether a user operates the whole platform (Django staff) rather than one tenant.
+- tenant_for: the tenant of a request, i.e. the id of the logged-in super admin (None for platform staff).
+- TenantPermission: DRF permission admitting only super admins and platform staff.
+- PlatformWritePermission: DRF permission keeping writes to platform staff (super admin accounts).
+- scoped: a PostgREST path restricted to one tenant's rows.
+- search_params: the tenant argument of the console_search_* functions.
+
+Access fails closed: a request whose user is anonymous, or logged in but neither a super admin nor
+staff, has no tenant and is refused (PermissionDenied). Only platform staff and code running outside
+a request (background workers, management commands) are unscoped and see every tenant.
+"""
+
+from django.core.exceptions import PermissionDenied
+from django.http import HttpRequest
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+
+from .models import SuperAdmin
+
+TENANT_COLUMN = 'tenant_id'
+
+# نشانه کش شده برای درخواستی که tenant ندارد و باید رد شود
+_DENIED = object()
+
+
+def is_platform(user):
+    """Django staff manage every tenant; super admins only manage their own."""
+    return bool(user is not None and user.is_authenticated and (user.is_staff or user.is_superuser))
+
+
+def tenant_for(request):
+    """
+    SuperAdmin.id of the session user of a Django or DRF request, looked up once per request.
+    None for platform staff; raises PermissionDenied for any other user without a super admin.
+    """
+    # کاربر نشست روی HttpRequest اصلی است؛ DRF آن را پس از احراز هویت همان‌جا هم قرار می‌دهد
+    request = getattr(request, '_request', request)
+    if not isinstance(request, HttpRequest):
+        return None
+    if not hasattr(request, '_console_tenant'):
+        user = getattr(request, 'user', None)
+        tenant = _DENIED
+        if is_platform(user):
+            tenant = None
+        elif user is not None and user.is_authenticated:
+            tenant = SuperAdmin.objects.filter(admin_super_user=user.username).values_list('id', flat=True).first()
+            if tenant is None:
+                tenant = _DENIED
+        request._console_tenant = tenant
+    if request._console_tenant is _DENIED:
+        raise PermissionDenied("این کاربر به هیچ سوپر ادمینی تعلق ندارد")
+    return request._console_tenant
+
+
+class TenantPermission(BasePermission):
+    """Allows logged-in super admins (scoped to their tenant) and platform staff (unscoped)."""
+
+    def has_permission(self, request, view):
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return False
+        try:
+            tenant_for(request)
+        except PermissionDenied:
+            return False
+        return True
+
+
+
+class PlatformWritePermission(BasePermission):
+    """Only platform staff may write; super admins may read (their own row, see SuperAdminViewSet)."""
+
+    def has_permission(self, request, view):
+        return request.method in SAFE_METHODS or is_platform(getattr(request, 'user', None))
+
+
+def scoped(path, tenant):
+    """Append the tenant filter to a PostgREST path; unscoped when tenant is None (platform staff)."""
+    if tenant is None:
+        return path
+    separator = '&' if '?' in path else '?'
+    return f"{path}{separator}{TENANT_COLUMN}=eq.{int(tenant)}"
+
+
+def search_params(tenant):
+    return {} if tenant is None else {"tenant": int(tenant)}
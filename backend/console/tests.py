@@ -1,4 +1,4 @@
-from django.test import TestCase, Client
+from django.test import SimpleTestCase, TestCase, Client
 from unittest.mock import patch, MagicMock, call
 import json
 from django.urls import reverse
@@ -31,7 +31,7 @@ class ChannelTestCase(TestCase):
         
         # شبیه‌سازی پاسخ‌ها برای تابع _make_request
         # وقتی اطلاعات کاربران خوانده می‌شود
-        def mock_get_user(method, endpoint, data=None):
+        def mock_get_user(method, endpoint, data=None, **kwargs):
             if method == 'GET' and f"/rest/v1/users?uid=eq.{user1_id}" in endpoint:
                 return [{"uid": user1_id, "username": "user1", "allowed_channels": []}]
             elif method == 'GET' and f"/rest/v1/users?uid=eq.{user2_id}" in endpoint:
@@ -80,7 +80,7 @@ class ChannelTestCase(TestCase):
         channel_id = "channel-uuid"
         
         # شبیه‌سازی پاسخ‌ها برای تابع _make_request
-        def mock_api_request(method, endpoint, data=None):
+        def mock_api_request(method, endpoint, data=None, **kwargs):
             if method == 'GET' and endpoint == f"/rest/v1/channels?uid=eq.{channel_id}":
                 return [{
                     "uid": channel_id,
@@ -118,11 +118,1950 @@ class ChannelTestCase(TestCase):
         # بررسی فراخوانی‌های _make_request
         expected_calls = [
             call('GET', f"/rest/v1/channels?uid=eq.{channel_id}"),
-            call('GET', f"/rest/v1/users?uid=eq.{user1_id}"),
+            call('GET', f"/rest/v1/users?uid=eq.{user1_id}", coalesce=False),
             call('PATCH', f"/rest/v1/users?uid=eq.{user1_id}", {'allowed_channels': [channel_id]}),
-            call('GET', f"/rest/v1/users?uid=eq.{user2_id}"),
+            call('GET', f"/rest/v1/users?uid=eq.{user2_id}", coalesce=False),
             call('PATCH', f"/rest/v1/users?uid=eq.{user2_id}", {'allowed_channels': ["other-channel", channel_id]})
         ]
         
         # بررسی تمام فراخوانی‌های مورد انتظار
         self.assertEqual(mock_make_request.call_args_list, expected_calls)
+
+
+class ResilienceTestCase(TestCase):
+    """آزمون‌های مدارشکن و تلاش مجدد درخواست‌های Kong"""
+
+    def setUp(self):
+        from . import resilience
+        self.resilience = resilience
+        resilience.reset_breakers()
+        self.addCleanup(resilience.reset_breakers)
+
+    def _response(self, status_code):
+        response = MagicMock()
+        response.status_code = status_code
+        return response
+
+    def test_breaker_opens_and_probes_half_open(self):
+        now = [0.0]
+        breaker = self.resilience.CircuitBreaker('test', failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, breaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+        # پس از گذشت زمان بازنشانی فقط یک درخواست آزمایشی مجاز است
+        now[0] = 10
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, breaker.CLOSED)
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_get_is_retried_on_gateway_errors(self, mock_request, mock_sleep):
+        mock_request.side_effect = [self._response(503), self._response(200)]
+
+        response = self.resilience.send('GET', 'http://kong:8000/rest/v1/channels')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_post_is_not_retried(self, mock_request, mock_sleep):
+        mock_request.return_value = self._response(503)
+
+        response = self.resilience.send('POST', 'http://kong:8000/rest/v1/channels', json={})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(mock_request.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_open_postgrest_circuit_does_not_block_gotrue(self, mock_request, mock_sleep):
+        mock_request.return_value = self._response(503)
+        breaker = self.resilience.get_breaker(self.resilience.UPSTREAM_POSTGREST)
+        for _ in range(breaker.failure_threshold):
+            self.resilience.send('POST', 'http://kong:8000/rest/v1/users', json={})
+
+        with self.assertRaises(self.resilience.CircuitOpenError):
+            self.resilience.send('GET', 'http://kong:8000/rest/v1/users')
+
+        mock_request.return_value = self._response(200)
+        response = self.resilience.send('GET', 'http://kong:8000/auth/v1/admin/users/abc')
+        self.assertEqual(response.status_code, 200)
+
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_query_errors_and_other_exceptions_settle_the_breaker(self, mock_request, mock_sleep):
+        import requests
+
+        breaker = self.resilience.get_breaker(self.resilience.UPSTREAM_POSTGREST)
+        mock_request.return_value = self._response(500)
+        for _ in range(breaker.failure_threshold + 1):
+            self.resilience.send('GET', 'http://kong:8000/rest/v1/users?bad=filter')
+        self.assertEqual(breaker.state, breaker.CLOSED)
+        self.assertEqual(mock_request.call_count, breaker.failure_threshold + 1)
+
+        # درخواست آزمایشی نیمه‌باز که با خطای دیگری تمام شود مدار را قفل نمی‌کند
+        now = [0.0]
+        breaker = self.resilience.CircuitBreaker('test', failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        self.resilience._breakers[self.resilience.UPSTREAM_POSTGREST] = breaker
+        breaker.record_failure()
+        now[0] = 10
+        mock_request.side_effect = requests.exceptions.ChunkedEncodingError('cut')
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            self.resilience.send('GET', 'http://kong:8000/rest/v1/users')
+        self.assertTrue(breaker.allow_request())
+
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_unavailable_upstream_is_503_not_404(self, mock_request, mock_sleep):
+        from django.contrib.auth.models import User
+
+        client = Client()
+        client.force_login(User.objects.create(username='ops', is_staff=True))
+
+        # پاسخ خالی واقعی همچنان 404 است
+        empty = self._response(200)
+        empty.text, empty.content = '[]', b'[]'
+        mock_request.return_value = empty
+        self.assertEqual(client.get('/api/channels/c1/').status_code, 404)
+
+        # همه تلاش‌ها 503 گرفتند
+        mock_request.return_value = self._response(503)
+        mock_request.return_value.text = 'unavailable'
+        response = client.get('/api/users/u1/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+        # مدار باز: بدون فراخوانی upstream، با زمان باقی‌مانده تا درخواست آزمایشی
+        breaker = self.resilience.get_breaker(self.resilience.UPSTREAM_POSTGREST)
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        calls = mock_request.call_count
+        for path in ('/api/channels/c1/', '/api/users/u1/'):
+            response = client.get(path)
+            self.assertEqual(response.status_code, 503, path)
+            self.assertEqual(response['Retry-After'], str(int(breaker.reset_timeout)))
+        self.assertEqual(mock_request.call_count, calls)
+
+
+class CoalescingTestCase(TestCase):
+    """آزمون‌های ادغام درخواست‌های GET هم‌زمان"""
+
+    @patch('console.supabase_client._send_request')
+    def test_read_before_write_is_not_served_a_stale_shared_get(self, mock_send):
+        import threading
+        from . import coalescing
+        from .supabase_client import _make_request
+
+        release = threading.Event()
+        stored = {"allowed_users": ["u1"]}
+
+        def send(method, endpoint, data=None, prefer=None):
+            if method == 'PATCH':
+                stored.update(data)
+                return True
+            snapshot = [dict(stored)]
+            if mock_send.call_count == 1:
+                # GET اول پیش از PATCH خوانده شده و هنوز پاسخ نداده است
+                release.wait(5)
+            return snapshot
+
+        mock_send.side_effect = send
+        path = '/rest/v1/channels?uid=eq.c1&select=uid,allowed_users'
+        results = []
+        reader = threading.Thread(target=lambda: results.append(_make_request('GET', path)))
+        reader.start()
+        while not coalescing.upstream_gets._calls:
+            pass
+
+        _make_request('PATCH', '/rest/v1/channels?uid=eq.c1', {"allowed_users": ["u1", "u2"]})
+        fresh = _make_request('GET', path, coalesce=False)
+        release.set()
+        reader.join()
+
+        self.assertEqual(fresh, [{"allowed_users": ["u1", "u2"]}])
+        self.assertEqual(results, [[{"allowed_users": ["u1"]}]])
+        self.assertEqual([c.args[0] for c in mock_send.call_args_list], ['GET', 'PATCH', 'GET'])
+
+    def test_concurrent_calls_share_one_upstream_request(self):
+        import threading
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            release.wait(5)
+            return [{"uid": "c1", "allowed_users": []}]
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flight.do('/rest/v1/channels', fetch)))
+        leader.start()
+        while not flight._calls:
+            pass
+        followers = [
+            threading.Thread(target=lambda: results.append(flight.do('/rest/v1/channels', fetch)))
+            for _ in range(3)
+        ]
+        for thread in followers:
+            thread.start()
+        while flight._calls['/rest/v1/channels'].waiters < 3:
+            pass
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 4)
+        # هر فراخوان نسخه مستقل خود را دریافت می‌کند
+        results[0][0]["allowed_users"].append("u1")
+        self.assertEqual(results[1][0]["allowed_users"], [])
+
+    def test_errors_are_propagated_to_waiters(self):
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight()
+        with self.assertRaises(ValueError):
+            flight.do('key', lambda: (_ for _ in ()).throw(ValueError("boom")))
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+
+
+class MembershipSyncTestCase(TestCase):
+    """آزمون‌های صف همگام‌سازی عضویت"""
+
+    def _job(self, job_id, source_type, source_uid, added=(), removed=()):
+        from .models import MembershipSyncJob
+        return MembershipSyncJob(id=job_id, source_type=source_type, source_uid=source_uid,
+                                 added=list(added), removed=list(removed))
+
+    def test_repeated_edits_to_same_row_are_merged(self):
+        from .membership_sync import coalesce_jobs
+
+        jobs = [
+            self._job(1, 'channel', 'c1', added=['u1', 'u2']),
+            self._job(2, 'channel', 'c2', added=['u1']),
+            self._job(3, 'channel', 'c1', removed=['u1']),
+            self._job(4, 'user', 'u9', added=['c1']),
+        ]
+
+        changes = coalesce_jobs(jobs)
+
+        self.assertEqual(changes[('users', 'u1')]['add'], {'c2'})
+        self.assertEqual(changes[('users', 'u1')]['remove'], {'c1'})
+        self.assertEqual(changes[('users', 'u1')]['jobs'], {1, 2, 3})
+        self.assertEqual(changes[('users', 'u2')]['add'], {'c1'})
+        self.assertEqual(changes[('channels', 'c1')]['add'], {'u9'})
+        self.assertEqual(len(changes), 3)
+
+    @patch('console.membership_sync._make_request')
+    def test_row_change_is_one_read_and_one_write(self, mock_make_request):
+        from .membership_sync import apply_row_change
+
+        mock_make_request.side_effect = [
+            [{"uid": "u1", "allowed_channels": ["c1", "c3"]}],
+            True,
+        ]
+
+        self.assertTrue(apply_row_change('users', 'u1', {'c2'}, {'c1'}))
+        self.assertEqual(mock_make_request.call_args_list[1],
+                         call('PATCH', '/rest/v1/users?uid=eq.u1', {'allowed_channels': ['c3', 'c2']}))
+
+
+class UserLifecycleTestCase(TestCase):
+    """آزمون‌های outbox چرخه عمر کاربران"""
+
+    def _entry(self, operation, payload):
+        from .models import UserLifecycleOutbox
+        return UserLifecycleOutbox(id=1, operation=operation, user_uid='u1', payload=payload, completed_steps=[])
+
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    @patch('console.user_lifecycle.apply_row_change', return_value=True)
+    @patch('console.user_lifecycle._make_request', return_value=True)
+    @patch('console.user_lifecycle.delete_auth_user')
+    def test_delete_resumes_from_failed_step(self, mock_delete_auth, mock_make_request, mock_apply, mock_objects):
+        from .user_lifecycle import run_steps
+
+        entry = self._entry('delete', {'channels_removed': ['c1', 'c2']})
+        mock_delete_auth.return_value = False
+
+        self.assertFalse(run_steps(entry))
+        self.assertEqual(entry.completed_steps, ['users_row', 'channel_membership'])
+        self.assertEqual(mock_apply.call_count, 2)
+
+        # اجرای دوباره فقط گام باقی‌مانده را اجرا می‌کند
+        mock_delete_auth.return_value = True
+        self.assertTrue(run_steps(entry))
+        self.assertEqual(mock_make_request.call_count, 1)
+        self.assertEqual(mock_apply.call_count, 2)
+        self.assertEqual(entry.status, 'done')
+
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    @patch('console.user_lifecycle.apply_row_change')
+    @patch('console.user_lifecycle.upsert_user_row', return_value={'uid': 'u1'})
+    def test_inline_run_leaves_membership_to_worker(self, mock_upsert, mock_apply, mock_objects):
+        from .user_lifecycle import run_inline
+
+        entry = self._entry('create', {'row': {'uid': 'u1', 'username': 'ali'}, 'channels_added': ['c1']})
+        entry.status = 'running'
+
+        self.assertTrue(run_inline(entry))
+        self.assertEqual(entry.completed_steps, ['users_row'])
+        mock_apply.assert_not_called()
+        # گام‌های باقی‌مانده تازه پس از اجرای درخواست به کارگر سپرده می‌شوند
+        self.assertEqual(entry.status, 'pending')
+        mock_objects.using.return_value.filter.assert_called_with(id=entry.id, status='running')
+        self.assertEqual(mock_objects.using.return_value.filter.return_value.update.call_args.kwargs['status'], 'pending')
+
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    def test_recorded_entry_is_not_claimable_by_the_worker(self, mock_objects):
+        from .user_lifecycle import record
+
+        record('update', 'u1', {'row': {'role': 'admin'}})
+
+        self.assertEqual(mock_objects.using.return_value.create.call_args.kwargs['status'], 'running')
+
+
+class IdempotencyTestCase(TestCase):
+    """آزمون‌های پشتیبانی از هدر Idempotency-Key"""
+
+    def _view(self, calls):
+        from rest_framework.response import Response as DRFResponse
+        from .idempotency import idempotent
+
+        class View:
+            @idempotent('channels.create')
+            def create(self, request):
+                calls.append(request)
+                return DRFResponse({"uid": "c1"}, status=201,
+                                   headers={'ETag': '"1"', 'Location': '/api/channels/c1/', 'X-Other': 'x'})
+        return View()
+
+    def _request(self, key, data):
+        request = MagicMock()
+        request.META = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        request.data = data
+        return request
+
+    @patch('console.idempotency._claim')
+    def test_request_without_key_runs_normally(self, mock_claim):
+        calls = []
+        response = self._view(calls).create(self._request(None, {"name": "a"}))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(calls), 1)
+        mock_claim.assert_not_called()
+
+    @patch('console.idempotency._records')
+    @patch('console.idempotency._claim')
+    def test_first_response_is_stored(self, mock_claim, mock_records):
+        record = MagicMock(id=7)
+        mock_claim.return_value = (record, True)
+        calls = []
+
+        self._view(calls).create(self._request('k1', {"name": "a"}))
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(mock_claim.call_args.args[:2], ('channels.create:anonymous', 'k1'))
+        mock_records.return_value.filter.assert_called_with(id=7, created_at=record.created_at)
+        update_kwargs = mock_records.return_value.filter.return_value.update.call_args.kwargs
+        self.assertEqual(update_kwargs['response_status'], 201)
+        self.assertEqual(update_kwargs['response_body'], {"uid": "c1"})
+        self.assertEqual(update_kwargs['response_headers'], {'ETag': '"1"', 'Location': '/api/channels/c1/'})
+
+    @patch('console.idempotency._records')
+    def test_stale_in_progress_record_is_taken_over(self, mock_records):
+        import datetime
+        from django.utils import timezone
+        from .idempotency import _take_over, request_fingerprint
+        from .models import IdempotencyRecord
+
+        now = timezone.now()
+        fingerprint = request_fingerprint({"name": "a"})
+        record = IdempotencyRecord(id=7, scope='channels.create:t1', key='k1', request_hash=fingerprint,
+                                   created_at=now - datetime.timedelta(seconds=30))
+        mock_records.return_value.filter.return_value.update.return_value = 1
+
+        # صاحب رکورد هنوز در مهلت است
+        self.assertIsNone(_take_over(record, fingerprint, now, 60))
+        record.created_at = now - datetime.timedelta(hours=1)
+        self.assertIsNone(_take_over(record, request_fingerprint({"name": "b"}), now, 60))
+
+        self.assertIs(_take_over(record, fingerprint, now, 60), record)
+        self.assertEqual(record.created_at, now)
+        mock_records.return_value.filter.assert_called_once_with(
+            id=7, state=IdempotencyRecord.STATE_IN_PROGRESS, created_at=now - datetime.timedelta(hours=1)
+        )
+
+    @patch('console.idempotency.tenancy.tenant_for')
+    @patch('console.idempotency._claim')
+    def test_keys_are_scoped_per_tenant(self, mock_claim, mock_tenant):
+        mock_claim.return_value = (MagicMock(id=7), True)
+        for tenant in (1, 2):
+            mock_tenant.return_value = tenant
+            with patch('console.idempotency._records'):
+                self._view([]).create(self._request('k1', {"name": "a"}))
+        self.assertEqual([c.args[0] for c in mock_claim.call_args_list], ['channels.create:t1', 'channels.create:t2'])
+
+    @patch('console.idempotency._claim')
+    def test_retry_gets_stored_response_without_running_view(self, mock_claim):
+        from .idempotency import request_fingerprint
+        from .models import IdempotencyRecord
+
+        record = IdempotencyRecord(id=7, scope='channels.create', key='k1',
+                                   request_hash=request_fingerprint({"name": "a"}),
+                                   state=IdempotencyRecord.STATE_COMPLETED,
+                                   response_status=201, response_body={"uid": "c1"},
+                                   response_headers={'ETag': '"1"', 'Location': '/api/channels/c1/'})
+        mock_claim.return_value = (record, False)
+        calls = []
+
+        response = self._view(calls).create(self._request('k1', {"name": "a"}))
+
+        self.assertEqual(calls, [])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {"uid": "c1"})
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response['Location'], '/api/channels/c1/')
+
+        # استفاده مجدد از کلید با داده متفاوت پذیرفته نمی‌شود
+        response = self._view(calls).create(self._request('k1', {"name": "b"}))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(calls, [])
+
+    @patch('console.idempotency.time.sleep')
+    @patch('console.idempotency._records')
+    def test_wait_for_duplicate_stops_at_request_deadline(self, mock_records, mock_sleep):
+        from console import deadline
+        from .idempotency import _wait_for_completion
+        from .models import IdempotencyRecord
+
+        clock = [100.0]
+        mock_sleep.side_effect = lambda seconds: clock.__setitem__(0, clock[0] + seconds)
+        record = IdempotencyRecord(id=7, state=IdempotencyRecord.STATE_IN_PROGRESS)
+        mock_records.return_value.filter.return_value.first.return_value = record
+
+        token = deadline.start(1.5, clock=lambda: clock[0])
+        try:
+            with self.settings(IDEMPOTENCY_WAIT_SECONDS=10), \
+                    patch('console.idempotency.time.monotonic', side_effect=lambda: clock[0]):
+                self.assertIs(_wait_for_completion(record), record)
+        finally:
+            deadline.stop(token)
+        # پس از 1.5 ثانیه مهلت درخواست، نه 10 ثانیه
+        self.assertAlmostEqual(clock[0], 101.5)
+
+
+class JSONAndCompressionTestCase(TestCase):
+    """آزمون‌های رندر JSON و فشرده‌سازی پاسخ‌ها"""
+
+    def test_fast_renderer_matches_drf_output(self):
+        import datetime
+        import decimal
+        import uuid
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONParser, FastJSONRenderer
+        import io
+
+        data = {
+            "uid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+            "name": "کانال تست",
+            "created_at": datetime.datetime(2025, 1, 1, 12, 0, tzinfo=datetime.timezone.utc),
+            "score": decimal.Decimal("1.5"),
+            "allowed_users": ["u1", "u2"],
+        }
+        fast = FastJSONRenderer().render(data)
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(data)))
+        # کاراکترهای فارسی بدون escape نوشته می‌شوند
+        self.assertIn("کانال تست".encode('utf-8'), fast)
+        self.assertEqual(FastJSONParser().parse(io.BytesIO(fast))["name"], "کانال تست")
+
+    def test_compression_middleware_negotiates_encoding(self):
+        import gzip
+        from django.http import HttpResponse, StreamingHttpResponse
+        from django.test import RequestFactory
+        from admin_panel.middleware import CompressionMiddleware
+
+        body = json.dumps([{"uid": str(i), "username": f"user{i}"} for i in range(200)]).encode()
+        middleware = CompressionMiddleware(lambda request: HttpResponse(body))
+        factory = RequestFactory()
+
+        response = middleware(factory.get('/api/users/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), body)
+
+        response = middleware(factory.get('/api/users/'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content, body)
+
+        # پاسخ‌های کوچک فشرده نمی‌شوند
+        small = CompressionMiddleware(lambda request: HttpResponse(b'{}'))
+        response = small(factory.get('/api/users/', HTTP_ACCEPT_ENCODING='gzip, br'))
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+        streaming = CompressionMiddleware(lambda request: StreamingHttpResponse(iter([body[:500], body[500:]])))
+        response = streaming(factory.get('/api/users/', HTTP_ACCEPT_ENCODING='gzip'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), body)
+
+
+class ChangeLogTestCase(TestCase):
+    """آزمون‌های همگام‌سازی تغییرات (/changes/)"""
+
+    @patch('console.change_log._pruned_through', return_value=None)
+    @patch('console.change_log._make_request')
+    @patch('console.change_log._read_entries')
+    @patch('console.change_log._visible_horizon', return_value=900)
+    def test_changes_collapse_per_uid_and_advance_cursor(self, mock_horizon, mock_entries, mock_make_request,
+                                                         mock_pruned):
+        from .change_log import changes_since
+
+        mock_entries.return_value = [
+            (850, 10, 'c1', 'upsert'),
+            (851, 11, 'c2', 'upsert'),
+            (852, 12, 'c1', 'upsert'),
+            (853, 13, 'c2', 'delete'),
+        ]
+        mock_make_request.return_value = [{"uid": "c1", "name": "کانال"}]
+
+        result = changes_since('channels', '800-0', limit=10)
+
+        mock_entries.assert_called_once_with('channels', 800, 0, 900, 11, None)
+        # یک درخواست برای همه ردیف‌های تغییر یافته
+        mock_make_request.assert_called_once_with("GET", '/rest/v1/channels?uid=in.("c1")')
+        self.assertEqual(result['upserts'], [{"uid": "c1", "name": "کانال"}])
+        self.assertEqual(result['deletes'], ['c2'])
+        self.assertFalse(result['has_more'])
+        self.assertEqual(result['cursor'], '900-0')
+
+        # صفحه پر: cursor روی آخرین ورودی صفحه می‌ایستد
+        result = changes_since('channels', '800-0', limit=3)
+        self.assertTrue(result['has_more'])
+        self.assertEqual(result['cursor'], '852-12')
+
+    @patch('console.change_log._pruned_through', return_value=None)
+    @patch('console.change_log._make_request', return_value=None)
+    @patch('console.change_log._read_entries', return_value=[(850, 10, 'u1', 'upsert')])
+    @patch('console.change_log._visible_horizon', return_value=900)
+    def test_changes_endpoint_errors(self, mock_horizon, mock_entries, mock_make_request, mock_pruned):
+        from .views import UserViewSet
+
+        request = MagicMock()
+        request.query_params = {'since': 'not-a-cursor'}
+        self.assertEqual(UserViewSet().changes(request).status_code, 400)
+
+        # اگر ردیف‌ها دریافت نشوند cursor جدید داده نمی‌شود
+        request.query_params = {'since': '800-0'}
+        self.assertEqual(UserViewSet().changes(request).status_code, 503)
+
+        request.query_params = {}
+        response = UserViewSet().changes(request)
+        self.assertEqual(response.data, {"cursor": "900-0"})
+
+    @patch('console.change_log._pruned_through', return_value=850)
+    @patch('console.change_log._make_request', return_value=[])
+    @patch('console.change_log._read_entries', return_value=[])
+    @patch('console.change_log._visible_horizon', return_value=900)
+    def test_cursor_older_than_pruned_entries_requires_resync(self, mock_horizon, mock_entries,
+                                                             mock_make_request, mock_pruned):
+        from .change_log import CursorExpired, changes_since
+        from .views import UserViewSet
+
+        with self.assertRaises(CursorExpired):
+            changes_since('users', '850-12', limit=10)
+        self.assertEqual(changes_since('users', '851-0', limit=10)['cursor'], '900-0')
+
+        request = MagicMock()
+        request.query_params = {'since': '800-0'}
+        response = UserViewSet().changes(request)
+        self.assertEqual(response.status_code, 410)
+        self.assertEqual(response.data['cursor'], '900-0')
+        self.assertTrue(response.data['resync'])
+
+    @patch('console.change_log.prune', return_value=3)
+    def test_prune_command_uses_retention_days(self, mock_prune):
+        import io
+        from datetime import timedelta
+        from django.core.management import CommandError, call_command
+        from django.utils import timezone
+
+        with self.settings(CHANGES_RETENTION_DAYS=30):
+            call_command('prune_change_log', stdout=io.StringIO())
+        older_than, batch_size = mock_prune.call_args.args
+        self.assertAlmostEqual((timezone.now() - older_than).total_seconds(), timedelta(days=30).total_seconds(), delta=60)
+        self.assertEqual(batch_size, 5000)
+
+        with self.assertRaises(CommandError):
+            call_command('prune_change_log', '--days', '0', stdout=io.StringIO())
+
+
+class EventStreamTestCase(TestCase):
+    """آزمون‌های استریم رویدادها (/api/events/)"""
+
+    def test_trigger_payload_and_filters(self):
+        from .events import EventFilter, to_event
+
+        channel_row = to_event(json.dumps({"kind": "row", "table": "channels", "uid": "c1", "op": "upsert", "id": 5}))
+        self.assertEqual(channel_row, {"type": "channel", "table": "channels", "uid": "c1", "id": 5, "op": "upsert"})
+        membership = to_event(json.dumps({"kind": "membership", "table": "users", "uid": "u1", "id": 6,
+                                          "added": ["c1"], "removed": []}))
+        self.assertEqual(membership['type'], 'membership')
+        self.assertIsNone(to_event('not json'))
+
+        self.assertTrue(EventFilter().matches(channel_row))
+        self.assertFalse(EventFilter(types={'user'}).matches(channel_row))
+        only_c1 = EventFilter(channels={'c1'})
+        self.assertTrue(only_c1.matches(channel_row))
+        # عضویت کاربر در c1 برای مشترک کانال c1 ارسال می‌شود
+        self.assertTrue(only_c1.matches(membership))
+        self.assertFalse(EventFilter(channels={'c2'}).matches(membership))
+        self.assertTrue(EventFilter(channels={'c2'}).matches(dict(membership, truncated=True)))
+        self.assertTrue(EventFilter(users={'u1'}).matches(membership))
+
+    @patch('console.events.Broker._listen')
+    def test_stream_delivers_matching_events(self, mock_listen):
+        import asyncio
+        from .events import EventFilter, broker, stream
+
+        async def collect():
+            frames = stream(EventFilter(channels={'c1'}))
+            first = await frames.__anext__()
+            pending = asyncio.ensure_future(frames.__anext__())
+            await asyncio.sleep(0)
+            broker.publish({"type": "channel", "table": "channels", "uid": "c2", "id": 1, "op": "upsert"})
+            broker.publish({"type": "channel", "table": "channels", "uid": "c1", "id": 2, "op": "delete"})
+            frame = await asyncio.wait_for(pending, timeout=1)
+            await frames.aclose()
+            return first, frame
+
+        first, frame = asyncio.run(collect())
+        self.assertTrue(first.startswith(b'retry:'))
+        self.assertTrue(frame.startswith(b'id: 2\nevent: channel\ndata: '))
+        self.assertEqual(broker._subscribers, set())
+
+
+class MembershipListTestCase(TestCase):
+    """آزمون‌های /api/users/{id}/channels/ و /api/channels/{id}/members/"""
+
+    @patch('console.views._make_request')
+    def test_user_channels_single_request_with_pagination(self, mock_make_request):
+        from .views import UserViewSet
+
+        mock_make_request.return_value = [{"uid": "c1"}, {"uid": "c2"}, {"uid": "c3"}]
+        request = MagicMock()
+        request.query_params = {'limit': '2', 'offset': '4'}
+
+        response = UserViewSet().channels(request, pk='u1')
+
+        mock_make_request.assert_called_once_with(
+            'GET', '/rest/v1/channels?allowed_users=cs.%5B%22u1%22%5D&order=uid&limit=3&offset=4'
+        )
+        self.assertEqual(response.data, {
+            "results": [{"uid": "c1"}, {"uid": "c2"}], "limit": 2, "offset": 4, "has_more": True
+        })
+
+    @patch('console.views._make_request')
+    def test_channel_members_errors(self, mock_make_request):
+        from .views import ChannelViewSet
+
+        request = MagicMock()
+        request.query_params = {'limit': '-1'}
+        self.assertEqual(ChannelViewSet().members(request, pk='c1').status_code, 400)
+        mock_make_request.assert_not_called()
+
+        mock_make_request.return_value = None
+        request.query_params = {}
+        self.assertEqual(ChannelViewSet().members(request, pk='c1').status_code, 503)
+        self.assertIn('/rest/v1/users?allowed_channels=cs.', mock_make_request.call_args.args[1])
+
+
+class UserSearchTestCase(TestCase):
+    """آزمون‌های جستجوی سمت سرور کاربران (/api/users/?q=)"""
+
+    @patch('console.views._make_request')
+    def test_search_is_one_paginated_rpc_request(self, mock_make_request):
+        from .views import UserViewSet
+
+        mock_make_request.return_value = [{"uid": "u1", "username": "ali"}, {"uid": "u2", "username": "alireza"}]
+        request = MagicMock()
+        request.query_params = {'q': ' ali ', 'role': 'admin', 'active': 'True', 'limit': '1'}
+
+        response = UserViewSet().list(request)
+
+        mock_make_request.assert_called_once_with(
+            'GET', '/rest/v1/rpc/console_search_users?page_limit=2&page_offset=0&q=ali&user_role=admin&user_active=true'
+        )
+        self.assertEqual(response.data, {
+            "results": [{"uid": "u1", "username": "ali"}], "limit": 1, "offset": 0, "has_more": True
+        })
+
+    @patch('console.views._make_request')
+    def test_plain_list_and_invalid_filters(self, mock_make_request):
+        from .views import UserViewSet
+
+        mock_make_request.return_value = [{"uid": "u1"}]
+        request = MagicMock()
+        request.query_params = {}
+        self.assertEqual(UserViewSet().list(request).data, [{"uid": "u1"}])
+        mock_make_request.assert_called_once_with('GET', '/rest/v1/users', None)
+
+        mock_make_request.reset_mock()
+        request.query_params = {'active': 'maybe'}
+        self.assertEqual(UserViewSet().list(request).status_code, 400)
+        mock_make_request.assert_not_called()
+
+
+class ChannelSearchTestCase(TestCase):
+    """آزمون‌های جستجوی کانال‌ها با نام نرمال شده (/api/channels/?q=)"""
+
+    @patch('console.views._make_request')
+    def test_search_calls_normalizing_rpc(self, mock_make_request):
+        mock_make_request.return_value = [{"uid": "c1", "name": "كانال يك"}]
+        request = MagicMock()
+        request.query_params = {'q': 'کانال یک', 'offset': '50'}
+
+        response = ChannelViewSet().list(request)
+
+        mock_make_request.assert_called_once_with(
+            'GET', '/rest/v1/rpc/console_search_channels?page_limit=51&page_offset=50&'
+                   'q=%DA%A9%D8%A7%D9%86%D8%A7%D9%84+%DB%8C%DA%A9'
+        )
+        self.assertEqual(response.data["results"], [{"uid": "c1", "name": "كانال يك"}])
+        self.assertFalse(response.data["has_more"])
+
+    @patch('console.views._make_request')
+    def test_update_does_not_write_generated_column(self, mock_make_request):
+        mock_make_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [{"uid": "c1", "name": "قدیم", "allowed_users": []}] if method == 'GET' else [{"uid": "c1", **data}]
+        )
+        request = MagicMock()
+        request.data = {"name": "جدید", "name_normalized": "جدید"}
+
+        self.assertEqual(ChannelViewSet().update(request, pk='c1').status_code, 200)
+        self.assertEqual(mock_make_request.call_args_list[-1],
+                         call('PATCH', '/rest/v1/channels?uid=eq.c1', {"name": "جدید"}))
+
+
+class ExportTestCase(TestCase):
+    """آزمون‌های خروجی استریم شده (/api/export/)"""
+
+    @patch('console.export._query')
+    def test_keyset_pages_encode_to_csv_and_jsonl(self, mock_query):
+        from . import export
+
+        columns = ['uid', 'username', 'active', 'allowed_channels']
+        pages = {
+            None: [('u1', 'علی', True, ['c1']), ('u2', 'sara', False, [])],
+            'u2': [('u3', None, True, [])],
+        }
+        mock_query.side_effect = lambda sql, params: (columns, pages[params[0] if len(params) == 2 else None])
+
+        body = b''.join(export.stream('users', 'csv', batch_size=2)).decode('utf-8')
+        self.assertEqual(body, '\ufeffuid,username,active\r\nu1,علی,true\r\nu2,sara,false\r\nu3,,true\r\n')
+        # صفحه دوم از آخرین کلید صفحه اول ادامه می‌یابد
+        self.assertEqual(mock_query.call_args_list[1].args[1], ['u2', 2])
+
+        lines = b''.join(export.stream('users', 'jsonl', batch_size=2)).splitlines()
+        self.assertEqual(json.loads(lines[0]), {"uid": "u1", "username": "علی", "active": True})
+        self.assertEqual(len(lines), 3)
+
+    def test_export_view_requires_login_and_known_dataset(self):
+        from django.contrib.auth.models import AnonymousUser
+        from .views import export_view
+
+        request = MagicMock()
+        request.user = AnonymousUser()
+        self.assertEqual(export_view(request, 'users', 'csv').status_code, 403)
+
+        request.user = MagicMock(is_authenticated=True)
+        self.assertEqual(export_view(request, 'passwords', 'csv').status_code, 404)
+        self.assertEqual(export_view(request, 'users', 'xlsx').status_code, 404)
+        response = export_view(request, 'memberships', 'jsonl')
+        self.assertTrue(response.streaming)
+        self.assertIn('memberships-', response['Content-Disposition'])
+
+
+class MembershipReconcileTestCase(TestCase):
+    """آزمون‌های گزارش و تعمیر اختلاف عضویت‌ها (reconcile_memberships)"""
+
+    def _state(self):
+        return {
+            'users': {('c1', 'u1'), ('c2', 'u2'), ('gone', 'u1')},
+            'channels': {('c1', 'u1'), ('c1', 'u2'), ('c2', 'ghost')},
+            'membership': {('c1', 'u1')},
+            'user_uids': {'u1', 'u2'},
+            'channel_uids': {'c1', 'c2'},
+        }
+
+    def test_plan_diffs_every_store_against_target(self):
+        from . import reconcile
+
+        result = reconcile.plan(self._state(), 'union')
+        # جفت‌های یتیم (کانال یا کاربر حذف شده) هرگز در هدف نیستند
+        self.assertEqual(result['target'], {('c1', 'u1'), ('c2', 'u2'), ('c1', 'u2')})
+        self.assertEqual(result['orphans']['users'], {('gone', 'u1')})
+        self.assertEqual(result['missing']['users'], {('c1', 'u2')})
+        self.assertEqual(result['extra']['channels'], {('c2', 'ghost')})
+        self.assertEqual(result['missing']['membership'], {('c2', 'u2'), ('c1', 'u2')})
+
+        result = reconcile.plan(self._state(), 'membership')
+        self.assertEqual(result['extra']['users'], {('c2', 'u2'), ('gone', 'u1')})
+        with self.assertRaises(ValueError):
+            reconcile.plan({**self._state(), 'membership': None}, 'membership')
+
+    @patch('console.reconcile._snapshot')
+    @patch('console.reconcile._query')
+    def test_load_reads_keyset_pages(self, mock_query, mock_snapshot):
+        from . import reconcile
+
+        pages = {
+            ('users', None): [('u1', '["c1"]'), ('u2', None)],
+            ('users', 'u2'): [('u3', '["c1", "c2"]')],
+            ('channels', None): [('c1', '["u1", "u3"]')],
+        }
+
+        def query(sql, params):
+            if 'to_regclass' in sql:
+                return ['exists'], [(False,)]
+            table = 'users' if 'FROM users' in sql else 'channels'
+            return ['uid', 'members'], pages[(table, params[0] if len(params) == 2 else None)]
+        mock_query.side_effect = query
+
+        state = reconcile.load(batch_size=2)
+        # همه منابع در یک snapshot خوانده می‌شوند
+        mock_snapshot.return_value.__enter__.assert_called_once()
+        self.assertEqual(state['user_uids'], {'u1', 'u2', 'u3'})
+        self.assertEqual(state['users'], {('c1', 'u1'), ('c1', 'u3'), ('c2', 'u3')})
+        self.assertEqual(state['channels'], {('c1', 'u1'), ('c1', 'u3')})
+        self.assertIsNone(state['membership'])
+
+    @patch('console.reconcile.transaction.atomic')
+    @patch('console.reconcile.connections')
+    def test_snapshot_reads_the_primary_in_one_read_only_transaction(self, mock_connections, mock_atomic):
+        from . import reconcile
+        from .membership_sync import DB_ALIAS
+
+        cursor = mock_connections.__getitem__.return_value.cursor.return_value.__enter__.return_value
+        with reconcile._snapshot():
+            reconcile._query("SELECT 1", [])
+
+        mock_atomic.assert_called_once_with(using=DB_ALIAS)
+        self.assertEqual({c.args[0] for c in mock_connections.__getitem__.call_args_list}, {DB_ALIAS})
+        self.assertEqual(cursor.execute.call_args_list[0].args[0],
+                         "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+
+    @patch('console.reconcile._delete_pairs')
+    @patch('console.reconcile._update_arrays')
+    @patch('console.reconcile._uid_cast', return_value='uuid[]')
+    def test_apply_writes_array_deltas_in_batches(self, mock_cast, mock_update, mock_delete):
+        from . import reconcile
+
+        result = reconcile.plan({**self._state(), 'membership': None}, 'union')
+        self.assertEqual(reconcile.apply(result, batch_size=1, dry_run=True), {'users': 2, 'channels': 1})
+        mock_update.assert_not_called()
+
+        reconcile.apply(result, batch_size=1)
+        records = [c.args[1][0] for c in mock_update.call_args_list if c.args[0] == 'users']
+        self.assertEqual(records, [
+            {'uid': 'u1', 'add_items': [], 'remove_items': ['gone']},
+            {'uid': 'u2', 'add_items': ['c1'], 'remove_items': []},
+        ])
+        self.assertEqual(mock_update.call_args_list[0].args[2], 'uuid')
+        mock_delete.assert_not_called()
+
+
+class SyntheticDatasetTestCase(SimpleTestCase):
+    """آزمون‌های داده آزمایشی دستور seed_data"""
+
+    def test_membership_distribution(self):
+        import random
+        from . import synthetic
+
+        rng = random.Random(7)
+        channels, cum_weights = synthetic.generate_channels(300, 'seed', rng)
+        users = list(synthetic.generate_users(2000, 'seed', channels, cum_weights, rng, 1, 200))
+        sizes = {uid: 0 for uid, _name in channels}
+        for user in users:
+            self.assertTrue(1 <= len(user['allowed_channels']) <= 200)
+            self.assertEqual(len(set(user['allowed_channels'])), len(user['allowed_channels']))
+            for channel_uid in user['allowed_channels']:
+                sizes[channel_uid] += 1
+        # اندازه کانال‌ها توزیع توانی دارد: بزرگ‌ترین کانال چند برابر میانه است
+        ordered = sorted(sizes.values(), reverse=True)
+        self.assertGreater(ordered[0], 5 * ordered[len(ordered) // 2])
+        self.assertTrue(users[0]['username'].startswith('seed_user_'))
+
+        # با seed یکسان همان داده ساخته می‌شود
+        again = random.Random(7)
+        channels_again, _weights = synthetic.generate_channels(300, 'seed', again)
+        self.assertEqual(channels_again, channels)
+
+    def test_rows_are_split_over_tenants(self):
+        import random
+        from . import synthetic
+
+        rng = random.Random(3)
+        channels, cum_weights = synthetic.generate_channels(200, 'seed', rng)
+        channel_tenants = synthetic.split_tenants(len(channels), [11, 12, 13, 14], rng)
+        self.assertEqual(synthetic.split_tenants(5, [], rng), [None] * 5)
+        # سهم سوپر ادمین‌ها توزیع توانی دارد ولی همه صاحب ردیف هستند
+        shares = [channel_tenants.count(tenant) for tenant in (11, 12, 13, 14)]
+        self.assertGreater(shares[0], shares[3])
+        self.assertTrue(all(shares))
+
+        pools = synthetic._tenant_pools(channels, cum_weights, channel_tenants)
+        own = {uid for (uid, _name), tenant in zip(channels, channel_tenants) if tenant == 12}
+        pool_channels, pool_weights = pools[12]
+        self.assertEqual({uid for uid, _name in pool_channels}, own)
+        users = list(synthetic.generate_users(50, 'seed', pool_channels, pool_weights, rng, tenant=12, start=101))
+        self.assertEqual(users[0]['username'], 'seed_user_0000101')
+        for user in users:
+            self.assertEqual(user['tenant_id'], 12)
+            self.assertTrue(set(user['allowed_channels']) <= own)
+
+    def test_copy_writes_text_format(self):
+        from . import synthetic
+
+        cursor = MagicMock()
+        synthetic._copy(cursor, 'users', ('uid', 'username', 'active', 'allowed_channels'), [
+            ('u1', 'a\tb', True, ['c1']),
+            ('u2', None, False, []),
+        ])
+        sql, data = cursor.cursor.copy_expert.call_args.args
+        self.assertEqual(sql, "COPY users (uid, username, active, allowed_channels) FROM STDIN")
+        self.assertEqual(data.getvalue(), 'u1\ta\\tb\tt\t["c1"]\nu2\t\\N\tf\t[]\n')
+
+
+class LiveKitTokenTestCase(TestCase):
+    """آزمون‌های صدور توکن LiveKit (/api/livekit-token/)"""
+
+    def setUp(self):
+        from django.test import override_settings
+        from . import livekit
+
+        livekit.cache.clear()
+        settings_override = override_settings(
+            LIVEKIT_API_KEY='lk-key', LIVEKIT_API_SECRET='lk-secret', SUPABASE_JWT_SECRET='supabase-secret',
+            LIVEKIT_TOKEN_TTL=3600, LIVEKIT_TOKEN_REUSE_MARGIN=600,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        broker = patch('console.livekit.events.broker', MagicMock(connected=True))
+        broker.start()
+        self.addCleanup(broker.stop)
+
+    def _bearer(self, user_uid):
+        import jwt
+        token = jwt.encode({'sub': user_uid, 'aud': 'authenticated'}, 'supabase-secret', algorithm='HS256')
+        return {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    @patch('console.livekit.load_grants')
+    def test_grants_and_tokens_are_cached_until_invalidated(self, mock_load):
+        import jwt
+        from . import livekit
+
+        mock_load.side_effect = lambda uid, using=None: livekit.Grants('ali', True, {'c1': 'کانال یک', 'c2': 'کانال دو'})
+        client = Client()
+        first = client.post('/api/livekit-token/', **self._bearer('u1')).json()
+        second = client.post('/api/livekit-token/', {'channel': 'c1'}, **self._bearer('u1')).json()
+        self.assertEqual(mock_load.call_count, 1)
+        self.assertEqual(len(first['channels']), 2)
+        self.assertEqual([c['channelUid'] for c in second['channels']], ['c1'])
+        # توکن ساخته شده تا نزدیک انقضا دوباره استفاده می‌شود
+        self.assertEqual(second['channels'][0]['token'], first['channels'][0]['token'])
+        claims = jwt.decode(first['channels'][0]['token'], 'lk-secret', algorithms=['HS256'])
+        self.assertEqual(claims['sub'], 'ali')
+        self.assertEqual(claims['iss'], 'lk-key')
+        self.assertEqual(claims['video'], {'room': 'c1', 'roomJoin': True, 'canPublish': True, 'canSubscribe': True})
+
+        livekit.cache.on_event({'type': 'membership', 'table': 'channels', 'uid': 'c1',
+                                'added': [], 'removed': ['u1'], 'truncated': False})
+        client.post('/api/livekit-token/', **self._bearer('u1'))
+        self.assertEqual(mock_load.call_count, 2)
+
+        # تغییر نام کانال کاربرانی را که آن کانال را دارند باطل می‌کند
+        livekit.cache.on_event({'type': 'channel', 'table': 'channels', 'uid': 'c2', 'op': 'UPDATE', 'id': 9})
+        self.assertIsNone(livekit.cache.get('u1'))
+
+    def test_expiring_token_is_reminted(self):
+        from . import livekit
+
+        grants = livekit.Grants('ali', True, {'c1': 'کانال یک'})
+        token = livekit.issue_tokens(grants, now=1000)[0]['token']
+        self.assertEqual(livekit.issue_tokens(grants, now=3000)[0]['token'], token)
+        self.assertNotEqual(livekit.issue_tokens(grants, now=4100)[0]['token'], token)
+
+    def test_load_racing_with_invalidation_is_not_cached(self):
+        from . import livekit
+
+        version = livekit.cache.version
+        livekit.cache.on_event({'type': 'user', 'table': 'users', 'uid': 'u1', 'op': 'UPDATE', 'id': 1})
+        self.assertFalse(livekit.cache.put('u1', livekit.Grants('ali', True, {}), version))
+
+    @patch('console.views.sign_in_with_password', return_value=None)
+    @patch('console.livekit.load_grants')
+    def test_rejected_requests(self, mock_load, mock_sign_in):
+        from . import livekit
+
+        client = Client()
+        self.assertEqual(client.post('/api/livekit-token/').status_code, 400)
+        self.assertEqual(client.post('/api/livekit-token/', {'username': 'ali', 'password': 'x'}).status_code, 401)
+        self.assertEqual(
+            client.post('/api/livekit-token/', HTTP_AUTHORIZATION='Bearer not-a-token').status_code, 401
+        )
+        mock_load.return_value = livekit.Grants('ali', True, {'c1': 'کانال یک'})
+        self.assertEqual(client.post('/api/livekit-token/', {'channel': 'c9'}, **self._bearer('u1')).status_code, 403)
+        livekit.cache.clear()
+        mock_load.return_value = livekit.Grants('ali', False, {'c1': 'کانال یک'})
+        self.assertEqual(client.post('/api/livekit-token/', **self._bearer('u2')).status_code, 403)
+
+
+class LiveKitWebhookTestCase(TestCase):
+    """آزمون‌های دریافت و ذخیره دسته‌ای webhookهای LiveKit (/api/livekit-webhook/)"""
+
+    def setUp(self):
+        from django.test import override_settings
+
+        settings_override = override_settings(
+            LIVEKIT_API_KEY='lk-key', LIVEKIT_API_SECRET='lk-secret',
+            LIVEKIT_WEBHOOK_BATCH_SIZE=100, LIVEKIT_WEBHOOK_FLUSH_SECONDS=60, LIVEKIT_WEBHOOK_MAX_BUFFER=3,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _post(self, event, secret='lk-secret', body=None):
+        import base64
+        import hashlib
+        import jwt
+
+        signed = json.dumps(event).encode('utf-8')
+        token = jwt.encode(
+            {'iss': 'lk-key', 'sha256': base64.b64encode(hashlib.sha256(signed).digest()).decode('ascii')},
+            secret, algorithm='HS256'
+        )
+        return Client().post(
+            '/api/livekit-webhook/', body if body is not None else signed,
+            content_type='application/webhook+json', HTTP_AUTHORIZATION=token
+        )
+
+    def test_signed_events_are_buffered(self):
+        from . import livekit_webhooks
+
+        writer = MagicMock(return_value=1)
+        buffer = livekit_webhooks.EventBuffer(writer)
+        event = {
+            'event': 'participant_joined', 'id': 'EV_1', 'createdAt': '1700000000',
+            'room': {'sid': 'RM_1', 'name': 'c1'}, 'participant': {'sid': 'PA_1', 'identity': 'ali'},
+        }
+        with patch.object(livekit_webhooks, 'buffer', buffer):
+            self.assertEqual(self._post(event).status_code, 204)
+            self.assertEqual(self._post(event, secret='other').status_code, 401)
+            self.assertEqual(self._post(event, body=json.dumps({**event, 'id': 'EV_2'})).status_code, 401)
+            # رویدادهای egress و ingress ذخیره نمی‌شوند
+            self.assertEqual(self._post({'event': 'egress_started', 'id': 'EV_3'}).status_code, 204)
+            self.assertEqual(len(buffer), 1)
+
+            self.assertEqual(buffer.flush(), 1)
+        row = writer.call_args[0][0][0]
+        self.assertEqual(row[:7], ('EV_1', 'participant_joined', 'c1', 'RM_1', 'ali', 'PA_1', ''))
+        self.assertEqual(row[7].timestamp(), 1700000000)
+        self.assertEqual(len(buffer), 0)
+
+    def test_failed_writes_are_retried_and_a_full_buffer_refuses_events(self):
+        from django.db import OperationalError
+        from . import livekit_webhooks
+
+        writer = MagicMock(side_effect=[OperationalError('down'), 2])
+        buffer = livekit_webhooks.EventBuffer(writer)
+        with patch.object(livekit_webhooks, 'buffer', buffer), patch('console.batching.connections'):
+            for i in range(3):
+                event = {'event': 'track_published', 'id': f'EV_{i}', 'room': {'name': 'c1'}, 'track': {'sid': 'TR'}}
+                self.assertEqual(self._post(event).status_code, 204)
+            response = self._post({'event': 'room_finished', 'id': 'EV_9', 'room': {'name': 'c1'}})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(buffer.dropped, 1)
+
+            self.assertEqual(buffer.flush(), 0)
+            self.assertEqual(len(buffer), 3)
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual([row[0] for row in writer.call_args[0][0]], ['EV_0', 'EV_1', 'EV_2'])
+
+
+    def test_bad_rows_are_isolated_and_dropped(self):
+        from django.db import DataError
+        from . import livekit_webhooks
+
+        written = []
+
+        def writer(rows):
+            if any('\x00' in row[0] for row in rows):
+                raise DataError('unsupported Unicode escape sequence')
+            if any(row[0] == 'bad-type' for row in rows):
+                raise ValueError('A string literal cannot contain NUL (0x00) characters.')
+            written.extend(row[0] for row in rows)
+            return len(rows)
+
+        buffer = livekit_webhooks.EventBuffer(writer)
+        # setUp بافر را به سه ردیف محدود می‌کند
+        for event_id in ['EV_\x00', 'EV_1', 'bad-type']:
+            self.assertTrue(buffer.add((event_id,)))
+
+        with patch('console.batching.connections') as mock_connections:
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(written, ['EV_1'])
+        self.assertEqual(buffer.rejected, 2)
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer._failures, 0)
+        mock_connections.__getitem__.return_value.close.assert_not_called()
+
+class AuditLogTestCase(TestCase):
+    """آزمون‌های ثبت دسته‌ای ممیزی تغییرات"""
+
+    def setUp(self):
+        from django.test import override_settings
+
+        settings_override = override_settings(
+            AUDIT_LOG_BATCH_SIZE=100, AUDIT_LOG_FLUSH_SECONDS=60, AUDIT_LOG_MAX_BUFFER=2,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    @patch('console.views._tenant', return_value=None)
+    @patch('console.views.membership_sync.table_writes_enabled', return_value=True)
+    @patch('console.views._make_request')
+    def test_mutations_are_buffered_with_actor_and_full_buffer_sheds(self, mock_make_request, *_):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from . import audit
+
+        mock_make_request.side_effect = lambda method, path, data=None, **kwargs: [{"uid": "c1"}] if method == 'GET' else True
+        admin = User(username='admin1', is_staff=True)
+        writer = MagicMock(return_value=2)
+        buffer = audit.AuditBuffer(writer)
+        factory = APIRequestFactory()
+        with patch.object(audit, 'buffer', buffer):
+            for pk in ('c1', 'c2', 'c3'):
+                request = factory.delete(f'/api/channels/{pk}/')
+                force_authenticate(request, user=admin)
+                response = ChannelViewSet.as_view({'delete': 'destroy'})(request, pk=pk)
+                self.assertEqual(response.status_code, 200)
+            # خواندن ثبت نمی‌شود
+            request = factory.get('/api/channels/c1/')
+            force_authenticate(request, user=admin)
+            ChannelViewSet.as_view({'get': 'retrieve'})(request, pk='c1')
+
+            self.assertEqual(buffer.dropped, 1)
+            self.assertEqual(buffer.flush(), 2)
+        rows = writer.call_args[0][0]
+        self.assertEqual([row[1:6] for row in rows], [
+            ('admin1', 'delete', 'channel', 'c1', 200),
+            ('admin1', 'delete', 'channel', 'c2', 200),
+        ])
+
+    def test_passwords_are_not_recorded(self):
+        from . import audit
+
+        request = MagicMock(user=MagicMock(is_authenticated=True, username='admin1'))
+        request.data = {'username': 'ali', 'password': 'secret'}
+        writer = MagicMock(return_value=1)
+        with patch.object(audit, 'buffer', audit.AuditBuffer(writer)):
+            self.assertTrue(audit.record(request, 'user', 'create', 'u1', 201))
+            audit.buffer.flush()
+        self.assertEqual(json.loads(writer.call_args[0][0][0][6]), {'username': 'ali'})
+
+    @patch('console.audit.batching.insert_rows', return_value=1)
+    @patch('console.audit.connections')
+    def test_month_partition_is_ensured_once_per_process(self, mock_connections, _):
+        import datetime
+        from . import audit
+
+        cursor = mock_connections.__getitem__.return_value.cursor.return_value.__enter__.return_value
+        moment = datetime.datetime(2030, 5, 1, tzinfo=datetime.timezone.utc)
+        row = (moment, 'admin1', 'create', 'channel', 'c1', 201, '{}')
+        with patch.object(audit, '_partitions', set()):
+            audit.write_rows([row])
+            audit.write_rows([row, row])
+        cursor.execute.assert_called_once_with("SELECT console_audit_partition(%s)", [moment])
+
+
+class RequestDeadlineTestCase(TestCase):
+    """آزمون‌های بودجه زمانی درخواست برای فراخوانی‌های Supabase"""
+
+    def setUp(self):
+        from . import deadline, resilience
+        self.deadline = deadline
+        self.resilience = resilience
+        resilience.reset_breakers()
+        self.addCleanup(resilience.reset_breakers)
+
+    def _start(self, seconds, now):
+        token = self.deadline.start(seconds, clock=lambda: now[0])
+        self.addCleanup(self.deadline.stop, token)
+        return self.deadline.current()
+
+    def _response(self, status_code, body=b''):
+        response = MagicMock()
+        response.status_code = status_code
+        response.content = body
+        response.text = body.decode()
+        return response
+
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_send_is_clamped_and_skipped_by_the_budget(self, mock_request, mock_sleep):
+        now = [0.0]
+        current = self._start(4, now)
+        mock_request.return_value = self._response(200)
+
+        self.resilience.send('GET', 'http://kong:8000/rest/v1/users')
+        self.assertEqual(mock_request.call_args.kwargs['timeout'], 4)
+
+        # پس از تمام شدن مهلت، درخواست ارسال نمی‌شود و مدارشکن شکستی ثبت نمی‌کند
+        now[0] = 4
+        with self.assertRaises(self.deadline.DeadlineExceeded):
+            self.resilience.send('PATCH', 'http://kong:8000/rest/v1/users?uid=eq.u1', json={})
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(current.completed, ['GET /rest/v1/users'])
+        self.assertEqual(current.skipped, ['PATCH /rest/v1/users'])
+        self.assertEqual(self.resilience.get_breaker(self.resilience.UPSTREAM_POSTGREST).state, 'closed')
+
+    @patch('console.resilience.backoff_delay', return_value=1.5)
+    @patch('console.resilience.time.sleep')
+    @patch('console.resilience.requests.request')
+    def test_no_retry_without_budget_for_the_backoff(self, mock_request, mock_sleep, mock_delay):
+        self._start(1, [0.0])
+        mock_request.return_value = self._response(503)
+
+        with self.assertRaises(self.deadline.DeadlineExceeded):
+            self.resilience.send('GET', 'http://kong:8000/rest/v1/channels')
+        self.assertEqual(mock_request.call_count, 1)
+        mock_sleep.assert_not_called()
+
+    def test_budget_per_route(self):
+        from django.test import override_settings
+
+        with override_settings(REQUEST_DEADLINE_SECONDS=30, REQUEST_DEADLINES={'/api/': 10, '/api/export/': 0}):
+            self.assertEqual(self.deadline.budget_for('/api/users/u1/'), 10)
+            self.assertEqual(self.deadline.budget_for('/api/export/users.csv'), 0)
+            self.assertEqual(self.deadline.budget_for('/admin/'), 30)
+        self.assertIsNone(self.deadline.remaining())
+
+    @patch('console.views.user_lifecycle.record')
+    @patch('console.resilience.requests.request')
+    def test_user_update_reports_partial_failure(self, mock_request, mock_record):
+        from django.contrib.auth.models import User
+
+        def expire_after_user_get(method, url, **kwargs):
+            # بودجه در حین اولین فراخوانی تمام می‌شود
+            self.deadline.current().expires_at = 0
+            return self._response(200, b'[{"uid": "u1", "username": "ali", "allowed_channels": []}]')
+
+        mock_request.side_effect = expire_after_user_get
+        client = Client()
+        client.force_login(User.objects.create(username='ops', is_staff=True))
+
+        response = client.put(
+            '/api/users/u1/', data=json.dumps({"allowed_channels": ["c1", "c2"]}), content_type='application/json'
+        )
+
+        self.assertEqual(response.status_code, 504)
+        body = response.json()
+        self.assertEqual(body['completed_calls'], ['GET /rest/v1/users'])
+        self.assertEqual(body['skipped_calls'], ['GET /rest/v1/channels'])
+        self.assertEqual(mock_request.call_count, 1)
+        mock_record.assert_not_called()
+
+    @patch('console.views.membership_sync.enqueue')
+    @patch('console.views._make_request')
+    def test_channel_fan_out_is_queued_when_budget_runs_out(self, mock_make_request, mock_enqueue):
+        current = self._start(10, [0.0])
+
+        def fake_request(method, path, data=None, **kwargs):
+            if path.startswith('/rest/v1/users'):
+                raise current.skip(f"{method} /rest/v1/users")
+            if method == 'PATCH':
+                return [{"uid": "c1", "name": "n", "allowed_users": ["u1", "u2"]}]
+            return [{"uid": "c1", "name": "n", "allowed_users": ["u1"]}]
+
+        mock_make_request.side_effect = fake_request
+        mock_enqueue.return_value = MagicMock(id=7)
+        request = MagicMock()
+        request.data = {"allowed_users": ["u2"]}
+        request.query_params = {}
+
+        response = ChannelViewSet().update(request, pk='c1')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['membership_sync_job'], 7)
+        self.assertEqual(response.data['skipped_calls'], ['GET /rest/v1/users'])
+        mock_enqueue.assert_called_once_with('channel', 'c1', added=['u2'], removed=['u1'])
+
+
+class ReadReplicaTestCase(TestCase):
+    """آزمون‌های مسیریابی خواندن به replica با توجه به تأخیر و نوشتن‌های اخیر"""
+
+    def setUp(self):
+        from . import replica
+        self.replica = replica
+        replica.probe.reset()
+        self.addCleanup(replica.probe.reset)
+        configured = patch('console.replica.configured', return_value=True)
+        configured.start()
+        self.addCleanup(configured.stop)
+
+    def test_replica_alias_survives_local_settings(self):
+        import importlib.util
+        import os
+        import sys
+        from pathlib import Path
+
+        def load_settings(env):
+            # نسخه جداگانه‌ای از admin_panel.settings تا تنظیمات در حال اجرا دست نخورد
+            # local_settings هم دوباره اجرا می‌شود تا DATABASES آن با تنظیمات در حال اجرا مشترک نباشد
+            name = 'admin_panel._settings_check'
+            path = Path(__file__).resolve().parent.parent / 'admin_panel' / 'settings.py'
+            spec = importlib.util.spec_from_file_location(name, path)
+            module = importlib.util.module_from_spec(spec)
+            with patch.dict(os.environ, env), patch.dict(sys.modules):
+                sys.modules.pop('admin_panel.local_settings', None)
+                spec.loader.exec_module(module)
+            return module.DATABASES
+
+        databases = load_settings({'POSTGRES_REPLICA_HOST': 'replica-db', 'POSTGRES_REPLICA_PORT': '6543'})
+        self.assertEqual(databases['supabase_replica']['HOST'], 'replica-db')
+        self.assertEqual(databases['supabase_replica']['PORT'], '6543')
+        self.assertEqual(databases['supabase_replica']['NAME'], databases['supabase']['NAME'])
+
+        os.environ.pop('POSTGRES_REPLICA_HOST', None)
+        self.assertNotIn('supabase_replica', load_settings({}))
+
+    @patch('console.replica.LagProbe._measure')
+    def test_reads_skip_lagging_replica_and_pinned_requests(self, mock_measure):
+        from django.test import override_settings
+        from admin_panel.db_routers import SupabaseRouter
+        from .models import SuperAdmin
+
+        now = [0.0]
+        probe = self.replica.LagProbe(clock=lambda: now[0])
+        with patch.object(self.replica, 'probe', probe), \
+                override_settings(REPLICA_MAX_LAG_SECONDS=2, REPLICA_LAG_CHECK_SECONDS=5):
+            mock_measure.return_value = 0.5
+            self.assertEqual(SupabaseRouter().db_for_read(SuperAdmin), 'supabase_replica')
+
+            # مقدار اندازه‌گیری شده تا پایان فاصله بررسی استفاده می‌شود
+            mock_measure.return_value = 30.0
+            self.assertEqual(self.replica.read_alias(), 'supabase_replica')
+            now[0] = 5
+            self.assertEqual(self.replica.read_alias(), 'supabase')
+            now[0] = 10
+            mock_measure.return_value = None
+            self.assertEqual(self.replica.read_alias(), 'supabase')
+            self.assertEqual(mock_measure.call_count, 3)
+
+            now[0] = 15
+            mock_measure.return_value = 0.0
+            token = self.replica.start_pin(False)
+            try:
+                self.assertEqual(SupabaseRouter().db_for_write(SuperAdmin), 'supabase')
+                self.assertEqual(SupabaseRouter().db_for_read(SuperAdmin), 'supabase')
+            finally:
+                self.replica.stop_pin(token)
+            self.assertEqual(self.replica.read_alias(), 'supabase_replica')
+
+    def test_writes_pin_the_client_to_primary(self):
+        from django.http import JsonResponse
+        from django.test import RequestFactory
+        from admin_panel.middleware import ReplicaPinMiddleware
+
+        seen = []
+
+        def view(request):
+            seen.append(self.replica.pinned())
+            return JsonResponse({})
+
+        middleware = ReplicaPinMiddleware(view)
+        factory = RequestFactory()
+
+        response = middleware(factory.post('/api/users/'))
+        self.assertIn(self.replica.PIN_COOKIE, response.cookies)
+        middleware(factory.get('/api/auth/user/'))
+        request = factory.get('/api/auth/user/')
+        request.COOKIES[self.replica.PIN_COOKIE] = '1'
+        response = middleware(request)
+
+        self.assertEqual(seen, [True, False, True])
+        self.assertNotIn(self.replica.PIN_COOKIE, response.cookies)
+        self.assertFalse(self.replica.pinned())
+
+    @patch('console.replica.read_alias', return_value='supabase_replica')
+    @patch('console.livekit.load_grants')
+    def test_grants_are_read_from_primary_right_after_a_change(self, mock_load, mock_read_alias):
+        from . import livekit
+
+        livekit.cache.clear()
+        self.addCleanup(livekit.cache.clear)
+        mock_load.return_value = livekit.Grants('ali', True, {})
+
+        livekit.grants_for('u1')
+        self.assertEqual(mock_load.call_args, call('u1', 'supabase'))
+
+        livekit.cache.invalidated_at -= 60
+        livekit.grants_for('u2')
+        self.assertEqual(mock_load.call_args, call('u2', 'supabase_replica'))
+
+
+class TenantScopingTestCase(TestCase):
+    """آزمون‌های محدود شدن کاربران و کانال‌ها به سوپر ادمین وارد شده"""
+
+    def test_tenant_is_the_logged_in_super_admin(self):
+        from django.contrib.auth.models import AnonymousUser, User
+        from django.core.exceptions import PermissionDenied
+        from django.test import RequestFactory
+        from . import tenancy
+
+        request = RequestFactory().get('/api/channels/')
+        request.user = AnonymousUser()
+        with self.assertRaises(PermissionDenied):
+            tenancy.tenant_for(request)
+        self.assertIsNone(tenancy.tenant_for(MagicMock()))
+
+        # کارکنان پلتفرم همه tenantها را می‌بینند؛ کاربر دیگری بدون سوپر ادمین رد می‌شود
+        request = RequestFactory().get('/api/channels/')
+        request.user = User(username='ops', is_staff=True)
+        self.assertIsNone(tenancy.tenant_for(request))
+        request = RequestFactory().get('/api/channels/')
+        request.user = User(username='stranger')
+        with patch('console.tenancy.SuperAdmin.objects.filter') as mock_filter:
+            mock_filter.return_value.values_list.return_value.first.return_value = None
+            with self.assertRaises(PermissionDenied):
+                tenancy.tenant_for(request)
+
+        request = RequestFactory().get('/api/channels/')
+        request.user = User(username='admin1')
+        with patch('console.tenancy.SuperAdmin.objects.filter') as mock_filter:
+            mock_filter.return_value.values_list.return_value.first.return_value = 7
+            self.assertEqual(tenancy.tenant_for(request), 7)
+            self.assertEqual(tenancy.tenant_for(request), 7)
+        mock_filter.assert_called_once_with(admin_super_user='admin1')
+
+        self.assertEqual(tenancy.scoped('/rest/v1/channels', 7), '/rest/v1/channels?tenant_id=eq.7')
+        self.assertEqual(tenancy.scoped('/rest/v1/users?uid=eq.u1', 7), '/rest/v1/users?uid=eq.u1&tenant_id=eq.7')
+        self.assertEqual(tenancy.scoped('/rest/v1/users', None), '/rest/v1/users')
+
+    @patch('console.views._make_request')
+    def test_anonymous_and_tenantless_users_are_refused(self, mock_make_request):
+        from django.contrib.auth.models import User
+
+        client = Client()
+        for method, path in (
+            ('get', '/api/users/'), ('get', '/api/users/?q=ali'), ('put', '/api/users/u1/'),
+            ('delete', '/api/users/u1/'), ('get', '/api/channels/'), ('get', '/api/membership-jobs/'),
+            ('get', '/api/export/users.csv'),
+        ):
+            response = getattr(client, method)(path, content_type='application/json')
+            self.assertEqual(response.status_code, 403, path)
+
+        # کاربر وارد شده‌ای که سوپر ادمین یا کارمند پلتفرم نیست هم چیزی نمی‌بیند
+        client.force_login(User.objects.create(username='stranger'))
+        with patch('console.tenancy.SuperAdmin.objects.filter') as mock_filter:
+            mock_filter.return_value.values_list.return_value.first.return_value = None
+            for path in ('/api/users/', '/api/channels/', '/api/export/memberships.jsonl'):
+                self.assertEqual(client.get(path).status_code, 403, path)
+        mock_make_request.assert_not_called()
+
+    def test_super_admins_are_managed_by_platform_staff_only(self):
+        from django.contrib.auth.models import User
+        from django.test import RequestFactory
+        from rest_framework.request import Request
+        from .views import SuperAdminViewSet
+
+        def queryset_for(user, tenant):
+            http_request = RequestFactory().get('/api/superadmins/')
+            http_request.user = user
+            http_request._console_tenant = tenant
+            request = Request(http_request)
+            request.user = user
+            view = SuperAdminViewSet(action='list', request=request, format_kwarg=None)
+            return str(view.get_queryset().query)
+
+        # کارمند پلتفرم همه را می‌بیند و سوپر ادمین فقط ردیف خودش را
+        self.assertNotIn('WHERE', queryset_for(User(username='ops', is_staff=True), None))
+        self.assertIn('"super_admin"."id" = 7', queryset_for(User(username='admin1'), 7))
+
+        client = Client()
+        client.force_login(User.objects.create(username='admin1'))
+        with patch('console.tenancy.SuperAdmin.objects.filter') as mock_filter:
+            mock_filter.return_value.values_list.return_value.first.return_value = 7
+            for method, path in (
+                ('post', '/api/superadmins/'), ('patch', '/api/superadmins/8/'), ('put', '/api/superadmins/7/'),
+                ('delete', '/api/superadmins/8/'),
+            ):
+                response = getattr(client, method)(path, data='{"user_limit": 100000}', content_type='application/json')
+                self.assertEqual(response.status_code, 403, (method, path))
+
+    @patch('console.views._make_request', return_value=[])
+    def test_super_admin_only_sees_own_users(self, mock_make_request):
+        from django.contrib.auth.models import User
+
+        client = Client()
+        client.force_login(User.objects.create(username='admin1'))
+        with patch('console.tenancy.SuperAdmin.objects.filter') as mock_filter:
+            mock_filter.return_value.values_list.return_value.first.return_value = 7
+            response = client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        mock_make_request.assert_called_once_with('GET', '/rest/v1/users?tenant_id=eq.7', None)
+
+    @patch('console.change_log._pruned_through', return_value=None)
+    @patch('console.change_log._make_request', return_value=[])
+    @patch('console.change_log._visible_horizon', return_value=900)
+    @patch('console.change_log._read_entries', return_value=[(850, 1, 'u9', 'delete')])
+    @patch('console.export._query')
+    def test_exports_feeds_and_jobs_are_scoped(self, mock_query, mock_entries, *_):
+        from . import change_log, events, export, membership_sync
+        from .models import MembershipSyncJob
+
+        mock_query.side_effect = lambda sql, params: (['uid', 'username'], [])
+        list(export.iter_rows('users', 10, tenant=7))
+        self.assertEqual(mock_query.call_args.args, ("SELECT * FROM users WHERE tenant_id = %s ORDER BY uid LIMIT %s", [7, 10]))
+        list(export.iter_rows('memberships', 10, tenant=7))
+        sql, params = mock_query.call_args.args
+        self.assertIn("channel_uid IN (SELECT uid::text FROM channels WHERE tenant_id = %s)", sql)
+        self.assertEqual(params, [7, 10])
+
+        # tombstoneها هم فقط از ورودی‌های همان سوپر ادمین خوانده می‌شوند
+        result = change_log.changes_since('users', '800-0', limit=10, tenant=7)
+        mock_entries.assert_called_once_with('users', 800, 0, 900, 11, 7)
+        self.assertEqual(result['deletes'], ['u9'])
+
+        sql = str(membership_sync.jobs_of_tenant(MembershipSyncJob.objects.all(), 7).query)
+        self.assertIn("SELECT uid::text FROM channels WHERE tenant_id = 7", sql)
+        self.assertIn("SELECT uid::text FROM users WHERE tenant_id = 7", sql)
+
+        event_filter = events.EventFilter.from_query({}, 7)
+        own = events.to_event('{"kind": "row", "table": "users", "uid": "u1", "op": "upsert", "id": 1, "tenant": 7}')
+        other = events.to_event('{"kind": "row", "table": "users", "uid": "u2", "op": "delete", "id": 2, "tenant": 8}')
+        self.assertTrue(event_filter.matches(own))
+        self.assertFalse(event_filter.matches(other))
+        self.assertTrue(event_filter.matches({'type': 'reset'}))
+        self.assertTrue(events.EventFilter.from_query({}).matches(other))
+
+    @patch('console.views._tenant', return_value=7)
+    @patch('console.views._make_request')
+    def test_list_and_retrieve_are_scoped(self, mock_make_request, _):
+        mock_make_request.return_value = []
+        view = ChannelViewSet()
+        request = MagicMock()
+        request.query_params = {}
+        view.request = request
+
+        view.list(request)
+        view.retrieve(request, pk='c1')
+        self.assertEqual(
+            [c.args[1] for c in mock_make_request.call_args_list],
+            ['/rest/v1/channels?tenant_id=eq.7', '/rest/v1/channels?uid=eq.c1&tenant_id=eq.7'],
+        )
+
+    @patch('console.views.membership_sync.table_writes_enabled', return_value=True)
+    @patch('console.views._tenant', return_value=7)
+    @patch('console.views.create_channel')
+    @patch('console.views._make_request')
+    def test_create_keeps_only_own_users(self, mock_make_request, mock_create_channel, *_):
+        mock_make_request.return_value = [{"uid": "u1"}]
+        mock_create_channel.return_value = {"uid": "c1", "name": "کانال", "version": 1}
+        view = ChannelViewSet()
+        request = MagicMock()
+        request.data = {"name": "کانال", "allowed_users": ["u1", "u2"]}
+        request.headers = {}
+        view.request = request
+
+        response = view.create(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response['ETag'], '"1"')
+        self.assertEqual(response['Location'], '/api/channels/c1/')
+        mock_make_request.assert_called_once_with(
+            'GET', '/rest/v1/users?uid=in.("u1","u2")&select=uid&tenant_id=eq.7'
+        )
+        mock_create_channel.assert_called_once_with(name="کانال", allowed_users=["u1"], tenant_id=7)
+
+
+class ChannelMembershipTableTestCase(TestCase):
+    """آزمون‌های نوشتن عضویت‌ها در جدول channel_membership"""
+
+    @patch('console.membership_sync._make_request', return_value=True)
+    @patch('console.views._make_request')
+    def test_channel_update_writes_only_changed_pairs(self, mock_view_request, mock_sync_request):
+        from django.test import override_settings
+
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [{"uid": "c1", "name": "کانال", "allowed_users": ["u1", "u2"]}] if method == 'GET' else True
+        )
+        request = MagicMock()
+        request.data = {"allowed_users": ["u2", "u3"]}
+
+        with override_settings(MEMBERSHIP_TABLE_WRITES=True):
+            response = ChannelViewSet().update(request, pk='c1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_sync_request.call_args_list, [
+            call("DELETE", '/rest/v1/channel_membership?channel_uid=eq.c1&user_uid=in.("u1")', prefer="return=minimal"),
+            call("POST", "/rest/v1/channel_membership?on_conflict=channel_uid,user_uid",
+                 [{"channel_uid": "c1", "user_uid": "u3"}], prefer="resolution=ignore-duplicates,return=minimal"),
+        ])
+        # آرایه allowed_users کانال و کاربران مستقیماً نوشته نمی‌شود
+        self.assertNotIn('PATCH', [c.args[0] for c in mock_view_request.call_args_list])
+
+    @patch('console.membership_sync._make_request', return_value=True)
+    def test_user_update_membership_step_runs_inline(self, mock_sync_request):
+        from django.test import override_settings
+        from .models import UserLifecycleOutbox
+        from . import user_lifecycle
+
+        entry = UserLifecycleOutbox(id=1, operation=UserLifecycleOutbox.OPERATION_UPDATE, user_uid='u1',
+                                    payload={"row": {"allowed_channels": ["c2"]}, "email": None,
+                                             "channels_added": ["c2"], "channels_removed": ["c1"]},
+                                    completed_steps=[])
+        with override_settings(MEMBERSHIP_TABLE_WRITES=True), \
+                patch('console.user_lifecycle.UserLifecycleOutbox.objects'), \
+                patch('console.user_lifecycle._make_request') as mock_row_request:
+            self.assertTrue(user_lifecycle.run_inline(entry))
+
+        # ستون allowed_channels از PATCH ردیف کاربر حذف می‌شود
+        mock_row_request.assert_not_called()
+        self.assertEqual(entry.completed_steps, ['users_row', 'channel_membership'])
+        self.assertEqual(mock_sync_request.call_count, 2)
+
+
+class UniqueConflictTestCase(TestCase):
+    """آزمون‌های درج تک‌مرحله‌ای با تکیه بر قید یکتایی"""
+
+    def _response(self, status_code, body):
+        response = MagicMock()
+        response.status_code = status_code
+        response.content = json.dumps(body).encode('utf-8')
+        response.text = response.content.decode('utf-8')
+        return response
+
+    @patch('console.views._make_request')
+    @patch('console.supabase_client.resilience.send')
+    def test_duplicate_channel_name_is_one_post_and_400(self, mock_send, mock_view_request):
+        mock_send.return_value = self._response(409, {
+            "code": "23505", "message": 'duplicate key value violates unique constraint "channels_name_normalized_key"'
+        })
+        request = MagicMock()
+        request.data = {"name": "کانال", "allowed_users": []}
+        request.META = {}
+
+        response = ChannelViewSet().create(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(mock_send.call_count, 1)
+        self.assertEqual(mock_send.call_args.args[:2], ("POST", "http://kong:8000/rest/v1/channels"))
+        mock_view_request.assert_not_called()
+
+    @patch('console.views._make_request')
+    def test_channel_rename_conflict_and_returned_row(self, mock_view_request):
+        from .supabase_client import UniqueViolation
+
+        current = [{"uid": "c1", "name": "قدیم", "allowed_users": []}]
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: current if method == 'GET' else [
+            {**current[0], **data}
+        ]
+        request = MagicMock()
+        request.data = {"name": "جدید"}
+
+        response = ChannelViewSet().update(request, pk='c1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["name"], "جدید")
+        # بدون GET جداگانه برای بررسی نام یا خواندن ردیف به‌روز شده
+        self.assertEqual([c.args[0] for c in mock_view_request.call_args_list], ['GET', 'PATCH'])
+
+        def conflict(method, endpoint, data=None, **kwargs):
+            if method == 'PATCH':
+                raise UniqueViolation("channels_name_normalized_key")
+            return current
+        mock_view_request.side_effect = conflict
+
+        response = ChannelViewSet().update(request, pk='c1')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    @patch('console.supabase_client.resilience.send')
+    def test_duplicate_username_fails_entry_without_retry(self, mock_send, mock_objects):
+        from .models import UserLifecycleOutbox
+        from . import user_lifecycle
+
+        mock_send.return_value = self._response(409, {"code": "23505", "message": "users_username_key"})
+        entry = UserLifecycleOutbox(id=1, operation=UserLifecycleOutbox.OPERATION_UPDATE, user_uid='u1',
+                                    payload={"row": {"username": "ali"}, "email": "ali@example.com",
+                                             "channels_added": [], "channels_removed": []},
+                                    completed_steps=[])
+
+        self.assertFalse(user_lifecycle.run_inline(entry))
+        self.assertTrue(user_lifecycle.rejected(entry))
+        self.assertEqual(entry.status, UserLifecycleOutbox.STATUS_FAILED)
+        self.assertEqual(mock_send.call_count, 1)
+
+
+class OptimisticConcurrencyTestCase(TestCase):
+    """آزمون‌های به‌روزرسانی شرطی کانال‌ها و کاربران با If-Match"""
+
+    def _request(self, data, if_match):
+        request = MagicMock()
+        request.data = data
+        request.META = {'HTTP_IF_MATCH': if_match}
+        return request
+
+    @patch('console.views._make_request')
+    def test_channel_update_is_one_conditional_patch(self, mock_view_request):
+        mock_view_request.return_value = [{"uid": "c1", "name": "جدید", "version": 4}]
+
+        response = ChannelViewSet().update(self._request({"name": "جدید", "version": 99}, '"3"'), pk='c1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"4"')
+        mock_view_request.assert_called_once_with('PATCH', '/rest/v1/channels?uid=eq.c1&version=eq.3', {"name": "جدید"})
+
+    @patch('console.views._make_request')
+    def test_stale_channel_version_is_412(self, mock_view_request):
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [] if method == 'PATCH' else [{"uid": "c1", "name": "دیگر", "version": 5}]
+        )
+
+        response = ChannelViewSet().update(self._request({"name": "جدید"}, 'W/"3"'), pk='c1')
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.data["version"], 5)
+        self.assertEqual(response['ETag'], '"5"')
+
+        # با ویرایش اعضا کانال خوانده می‌شود و نسخه قدیمی پیش از هر نوشتنی رد می‌شود
+        response = ChannelViewSet().update(self._request({"allowed_users": []}, '"3"'), pk='c1')
+        self.assertEqual(response.status_code, 412)
+        self.assertNotIn('PATCH', [c.args[0] for c in mock_view_request.call_args_list[2:]])
+
+        response = ChannelViewSet().update(self._request({"name": "جدید"}, 'abc'), pk='c1')
+        self.assertEqual(response.status_code, 400)
+
+    @patch('console.membership_sync._make_request')
+    @patch('console.views._make_request')
+    def test_member_edit_with_if_match_is_one_conditional_write(self, mock_view_request, mock_sync_request):
+        from django.test import override_settings
+
+        mock_view_request.return_value = [{"uid": "c1", "allowed_users": ["u1"], "version": 8}]
+        with override_settings(MEMBERSHIP_TABLE_WRITES=True):
+            response = ChannelViewSet().update(self._request({"allowed_users": ["u1"]}, '"7"'), pk='c1')
+
+        # بررسی نسخه و تغییر اعضا در یک PATCH؛ تریگرهای 0017 جدول channel_membership را هم‌تراز می‌کنند
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"8"')
+        mock_view_request.assert_called_once_with(
+            'PATCH', '/rest/v1/channels?uid=eq.c1&version=eq.7', {"allowed_users": ["u1"]}
+        )
+        mock_sync_request.assert_not_called()
+
+        # ادمین دوم با همان ETag
+        mock_view_request.reset_mock()
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [] if method == 'PATCH' else [{"uid": "c1", "allowed_users": ["u1"], "version": 8}]
+        )
+        with override_settings(MEMBERSHIP_TABLE_WRITES=True):
+            response = ChannelViewSet().update(self._request({"allowed_users": ["u2"]}, '"7"'), pk='c1')
+        self.assertEqual(response.status_code, 412)
+        mock_sync_request.assert_not_called()
+
+    @patch('console.views._tenant', return_value=7)
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    @patch('console.views.user_lifecycle.record')
+    @patch('console.user_lifecycle._make_request')
+    @patch('console.views._make_request')
+    def test_if_match_update_of_another_tenants_user_is_not_found(self, mock_view_request, mock_request, mock_record, *_):
+        from .models import UserLifecycleOutbox
+        from .views import UserViewSet
+
+        mock_record.side_effect = lambda operation, uid, payload: UserLifecycleOutbox(
+            id=1, operation=operation, user_uid=uid, payload=payload, completed_steps=[],
+            status=UserLifecycleOutbox.STATUS_RUNNING,
+        )
+        # کاربر u9 مال سوپر ادمین دیگری است و فقط بدون فیلتر tenant پیدا می‌شود
+        mock_request.side_effect = lambda method, path, data=None, **kwargs: (
+            [] if 'tenant_id=eq.7' in path else [{"uid": "u9", "active": False, "version": 4}]
+        )
+        view = UserViewSet()
+        view.request = self._request({"active": False}, '"3"')
+
+        response = view.update(view.request, pk='u9')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual([c.args[:2] for c in mock_request.call_args_list], [
+            ('PATCH', '/rest/v1/users?uid=eq.u9&tenant_id=eq.7&version=eq.3'),
+            ('GET', '/rest/v1/users?uid=eq.u9&tenant_id=eq.7'),
+        ])
+        mock_view_request.assert_not_called()
+
+    @patch('console.user_lifecycle.UserLifecycleOutbox.objects')
+    @patch('console.user_lifecycle._make_request')
+    def test_users_row_step_detects_conflicts_and_retries(self, mock_request, mock_objects):
+        from .models import UserLifecycleOutbox
+        from . import user_lifecycle
+
+        def entry():
+            return UserLifecycleOutbox(id=1, operation=UserLifecycleOutbox.OPERATION_UPDATE, user_uid='u1',
+                                       payload={"row": {"role": "admin"}, "email": None, "channels_added": [],
+                                                "channels_removed": [], "version": 3},
+                                       completed_steps=[user_lifecycle.STEP_CHANNEL_MEMBERSHIP,
+                                                        user_lifecycle.STEP_AUTH_USER])
+
+        mock_request.side_effect = lambda method, path, data=None, **kwargs: (
+            [] if method == 'PATCH' else [{"uid": "u1", "role": "regular", "version": 4}]
+        )
+        conflicting = entry()
+        self.assertFalse(user_lifecycle.run_inline(conflicting))
+        self.assertTrue(user_lifecycle.conflicted(conflicting))
+        self.assertEqual(mock_request.call_args_list[0].args[:2], ('PATCH', '/rest/v1/users?uid=eq.u1&version=eq.3'))
+
+        # تلاش دوباره کارگر پس از PATCH اعمال شده‌ای که پاسخش گم شده بود تعارض نیست
+        mock_request.side_effect = lambda method, path, data=None, **kwargs: (
+            [] if method == 'PATCH' else [{"uid": "u1", "role": "admin", "version": 4}]
+        )
+        retried = entry()
+        self.assertTrue(user_lifecycle.run_inline(retried))
+        self.assertFalse(user_lifecycle.conflicted(retried))
+
+
+class MembershipDeltaTestCase(TestCase):
+    """آزمون‌های POST /api/channels/{id}/members/ و /api/users/{id}/channels/ با add و remove"""
+
+    def _request(self, data):
+        request = MagicMock()
+        request.method = 'POST'
+        request.data = data
+        request.query_params = {}
+        return request
+
+    @patch('console.membership_sync._make_request')
+    @patch('console.views._make_request')
+    def test_channel_delta_writes_only_changed_pairs(self, mock_view_request, mock_sync_request):
+        from django.test import override_settings
+
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [{"uid": "c1"}] if endpoint.startswith('/rest/v1/channels') else [{"uid": "u1"}]
+        )
+        mock_sync_request.return_value = True
+
+        with override_settings(MEMBERSHIP_TABLE_WRITES=True):
+            response = ChannelViewSet().members(self._request({"add": ["u1", "u2"], "remove": ["u3"]}), pk='c1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {"uid": "c1", "added": ["u1"], "removed": ["u3"], "ignored": ["u2"]})
+        self.assertEqual(mock_view_request.call_args_list, [
+            call('GET', '/rest/v1/channels?uid=eq.c1&select=uid'),
+            call('GET', '/rest/v1/users?uid=in.("u1","u2")&select=uid'),
+        ])
+        self.assertEqual([c.args[:3] for c in mock_sync_request.call_args_list], [
+            ('POST', '/rest/v1/channel_membership?on_conflict=channel_uid,user_uid', [{'channel_uid': 'c1', 'user_uid': 'u1'}]),
+            ('DELETE', '/rest/v1/channel_membership?channel_uid=eq.c1&user_uid=in.("u3")'),
+        ])
+
+    @patch('console.membership_sync.enqueue')
+    @patch('console.membership_sync.apply_row_change')
+    @patch('console.views._make_request')
+    def test_user_delta_queues_failed_fan_out(self, mock_view_request, mock_apply, mock_enqueue):
+        from django.test import override_settings
+        from .views import UserViewSet
+
+        mock_view_request.side_effect = lambda method, endpoint, data=None, **kwargs: (
+            [{"uid": "u1"}] if endpoint.startswith('/rest/v1/users') else [{"uid": "c1"}, {"uid": "c2"}]
+        )
+        mock_apply.side_effect = lambda table, uid, add, remove: uid != 'c2'
+        mock_enqueue.return_value = MagicMock(id=7)
+
+        with override_settings(MEMBERSHIP_TABLE_WRITES=False, MEMBERSHIP_SYNC_DEFERRED=False):
+            response = UserViewSet().channels(self._request({"add": ["c1", "c2"], "remove": ["c3"]}), pk='u1')
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data["membership_sync_job"], 7)
+        self.assertEqual(mock_apply.call_args_list, [
+            call('users', 'u1', {'c1', 'c2'}, {'c3'}),
+            call('channels', 'c1', {'u1'}, set()),
+            call('channels', 'c2', {'u1'}, set()),
+            call('channels', 'c3', set(), {'u1'}),
+        ])
+        mock_enqueue.assert_called_once_with('user', 'u1', added=['c2'], removed=[])
+
+    @patch('console.views._make_request')
+    def test_invalid_delta(self, mock_view_request):
+        response = ChannelViewSet().members(self._request({"add": "u1"}), pk='c1')
+        self.assertEqual(response.status_code, 400)
+        response = ChannelViewSet().members(self._request({"add": ["u1"], "remove": ["u1"]}), pk='c1')
+        self.assertEqual(response.status_code, 400)
+        mock_view_request.assert_not_called()
+
+        mock_view_request.return_value = []
+        response = ChannelViewSet().members(self._request({"add": ["u1"]}), pk='c1')
+        self.assertEqual(response.status_code, 404)
+
+
+class LookupIndexTestCase(SimpleTestCase):
+    """
+    بررسی EXPLAIN: پرس‌وجوهای پرتکرار از ایندکس‌های مهاجرت 0018 استفاده می‌کنند
+    Runs in a throwaway schema on the configured supabase database inside a rolled-back transaction;
+    skipped when that database is not reachable.
+    """
+
+    HOT_QUERIES = [
+        ("SELECT * FROM channels WHERE allowed_users @> '[\"u1\"]'", 'channels_allowed_users_gin'),
+        ("SELECT * FROM users WHERE allowed_channels @> '[\"c1\"]'", 'users_allowed_channels_gin'),
+        ("SELECT * FROM channels WHERE name = 'x'", 'channels_name_idx'),
+        ("SELECT * FROM users WHERE username = 'x'", 'users_username_idx'),
+    ]
+
+    def _connect(self):
+        import psycopg2
+        from django.conf import settings
+
+        db = settings.DATABASES['supabase']
+        try:
+            return psycopg2.connect(dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+                                    host=db['HOST'], port=db['PORT'], connect_timeout=2)
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"supabase database not reachable: {e}")
+
+    def _plan_indexes(self, plan):
+        found = {plan['Index Name']} if 'Index Name' in plan else set()
+        for child in plan.get('Plans', []):
+            found |= self._plan_indexes(child)
+        return found
+
+    def test_hot_queries_use_indexes(self):
+        import importlib
+
+        migration = importlib.import_module('console.migrations.0018_lookup_indexes')
+        connection = self._connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE SCHEMA console_index_check")
+                cursor.execute("SET LOCAL search_path TO console_index_check")
+                cursor.execute("CREATE TABLE users (uid uuid PRIMARY KEY, username text, allowed_channels jsonb)")
+                cursor.execute("CREATE TABLE channels (uid text PRIMARY KEY, name text, allowed_users jsonb)")
+                cursor.execute(migration.CREATE_INDEXES)
+                cursor.execute("ANALYZE users; ANALYZE channels")
+                # جداول آزمون کوچک‌اند؛ بدون این تنظیم برنامه‌ریز اسکن ترتیبی را انتخاب می‌کند
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                for query, index_name in self.HOT_QUERIES:
+                    cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+                    plan = cursor.fetchone()[0][0]['Plan']
+                    self.assertIn(index_name, self._plan_indexes(plan), query)
+        finally:
+            connection.rollback()
+            connection.close()
@@ -4,11 +4,16 @@ Defines API routes for console app:
 - login_view and logout_view for session auth
 - ChannelViewSet and UserViewSet for channel/user CRUD operations
 - SuperAdminViewSet for managing superadmin credentials and user limits
+- MembershipSyncJobViewSet for polling deferred membership sync jobs
+- events_view: server-sent events stream of channel, user and membership changes (ASGI)
+- export_view: streamed CSV/JSONL export of users, channels and memberships
+- livekit_token_view: LiveKit room tokens for the channels a user may join
+- livekit_webhook_view: LiveKit room/participant/track webhooks, stored in batches
 """
 from django.urls import path, include  # URL helpers
 from rest_framework.routers import DefaultRouter
 from . import views
-from .views import login_view, logout_view, user_view
+from .views import login_view, logout_view, user_view, events_view, export_view, livekit_token_view, livekit_webhook_view
 from .views import UserViewSet
 
 
@@ -16,12 +21,21 @@ router = DefaultRouter()
 router.register(r'channels', views.ChannelViewSet)  # Channel CRUD endpoints
 router.register(r'users', UserViewSet, basename='user')        # User CRUD endpoints
 router.register(r'superadmins', views.SuperAdminViewSet)  # SuperAdmin CRUD endpoints
+router.register(r'membership-jobs', views.MembershipSyncJobViewSet)  # Deferred membership sync status
 
 urlpatterns = [
     # Authentication endpoints (no CSRF/session requirement)
     path('auth/login/', login_view, name='login'),
     path('auth/logout/', logout_view, name='logout'),
     path('auth/user/', user_view, name='user'),
+    # Server-sent events (served by the ASGI process)
+    path('events/', events_view, name='events'),
+    # Streamed exports for audits
+    path('export/<str:dataset>.<str:fmt>', export_view, name='export'),
+    # LiveKit tokens for PTT clients (Supabase access token or username/password)
+    path('livekit-token/', livekit_token_view, name='livekit-token'),
+    # Webhooks from the LiveKit server (signed with the LiveKit API secret)
+    path('livekit-webhook/', livekit_webhook_view, name='livekit-webhook'),
     # ViewSet-generated routes for channels and users
     path('', include(router.urls)),
 ]
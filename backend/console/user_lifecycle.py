@@ -0,0 +1,241 @@
+"""
+console/user_lifecycle.py
+Outbox-driven user lifecycle (create/update/delete) across Supabase Auth and the users table:
+- STEPS: the ordered, idempotent steps of each operation.
+- record: store an outbox entry for an operation, already claimed (running) by the request.
+- run_steps: execute the entry's remaining steps in order, persisting progress after each one.
+- run_inline: run only the request-path steps of a new entry, then hand what is left to the worker.
+- rejected: whether the entry failed on a unique constraint or a version conflict (not retried).
+- conflicted: whether it failed because the users row changed since If-Match (reported as 412).
+- pending_steps: the steps left to the background worker (reported to the client with 202).
+- drain: resume a batch of pending entries (used by the process_user_outbox command).
+
+Passwords never enter the outbox: creating the Auth user and changing a password happen in the
+request path before the entry is recorded; everything after that can be replayed safely. Update and
+delete payloads carry the requesting super admin's tenant, and the users row is only written within it.
+"""
+
+import logging
+import traceback
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import UserLifecycleOutbox
+from . import membership_sync
+from .membership_sync import DB_ALIAS, apply_row_change, claim_batch
+from .supabase_client import UniqueViolation, _make_request, delete_auth_user, update_auth_user, upsert_user_row
+from .tenancy import scoped
+from .versioning import VersionConflict, conditional
+
+logger = logging.getLogger(__name__)
+
+STEP_USERS_ROW = 'users_row'
+STEP_AUTH_USER = 'auth_user'
+STEP_CHANNEL_MEMBERSHIP = 'channel_membership'
+
+STEPS = {
+    UserLifecycleOutbox.OPERATION_CREATE: [STEP_USERS_ROW, STEP_CHANNEL_MEMBERSHIP],
+    UserLifecycleOutbox.OPERATION_UPDATE: [STEP_USERS_ROW, STEP_CHANNEL_MEMBERSHIP, STEP_AUTH_USER],
+    UserLifecycleOutbox.OPERATION_DELETE: [STEP_USERS_ROW, STEP_CHANNEL_MEMBERSHIP, STEP_AUTH_USER],
+}
+
+# last_error گامی که به خاطر If-Match قدیمی رد شده است
+VERSION_CONFLICT = 'version conflict'
+
+# گام‌هایی که در مسیر درخواست اجرا می‌شوند؛ بقیه به کارگر پس‌زمینه سپرده می‌شوند
+INLINE_STEPS = {STEP_USERS_ROW}
+
+
+def _inline_steps():
+    # نوشتن در channel_membership یک درخواست است و در مسیر درخواست هم انجام می‌شود
+    if membership_sync.table_writes_enabled():
+        return INLINE_STEPS | {STEP_CHANNEL_MEMBERSHIP}
+    return INLINE_STEPS
+
+
+class StepFailed(Exception):
+    """Raised by a step that did not complete; the entry stays pending for a retry."""
+
+
+def record(operation, user_uid, payload):
+    """
+    The entry starts as running so process_user_outbox does not claim it while the request runs its
+    inline steps; updated_at is the lease (MEMBERSHIP_SYNC_LEASE_SECONDS) if the request process dies.
+    """
+    entry = UserLifecycleOutbox.objects.using(DB_ALIAS).create(
+        operation=operation,
+        user_uid=str(user_uid),
+        payload=payload,
+        status=UserLifecycleOutbox.STATUS_RUNNING,
+    )
+    logger.info(f"عملیات {operation} کاربر {user_uid} در outbox ثبت شد (entry={entry.id})")
+    return entry
+
+
+def _users_row(entry):
+    payload = entry.payload
+    if entry.operation == UserLifecycleOutbox.OPERATION_CREATE:
+        ok = upsert_user_row(payload['row']) is not None
+    elif entry.operation == UserLifecycleOutbox.OPERATION_UPDATE:
+        row = payload.get('row') or {}
+        version = payload.get('version')
+        if membership_sync.table_writes_enabled() and version is None:
+            # آرایه allowed_channels را تریگر channel_membership به‌روز می‌کند؛ با If-Match آرایه در همین PATCH شرطی
+            # می‌ماند تا بررسی نسخه و تغییر عضویت‌ها یک دستور باشند (تریگرهای 0017 جدول را هم‌تراز می‌کنند)
+            row = {key: value for key, value in row.items() if key != 'allowed_channels'}
+        if not row:
+            return
+        # بدون خواندن اولیه هم فقط ردیف همان سوپر ادمین نوشته می‌شود
+        path = scoped(f"/rest/v1/users?uid=eq.{entry.user_uid}", payload.get('tenant'))
+        response = _make_request("PATCH", conditional(path, version), row)
+        ok = response is not None
+        if isinstance(response, list) and response:
+            # ردیف به‌روز شده (با نسخه جدید) برای پاسخ همان درخواست
+            entry.updated_row = response[0]
+        elif ok and version is not None and isinstance(response, list):
+            _check_applied(entry, row)
+    else:
+        # حذف ردیفی که وجود ندارد هم موفق است
+        ok = _make_request("DELETE", scoped(f"/rest/v1/users?uid=eq.{entry.user_uid}", payload.get('tenant'))) is not None
+    if not ok:
+        raise StepFailed(f"خطا در اعمال تغییرات جدول users برای کاربر {entry.user_uid}")
+
+
+def _check_applied(entry, row):
+    """
+    PATCH شرطی هیچ ردیفی را تغییر نداد: یا کاربر حذف شده (یا مال سوپر ادمین دیگری است)، یا همین گام قبلاً
+    اعمال شده (تلاش دوباره کارگر) و نسخه بالا رفته، یا ادمین دیگری ردیف را تغییر داده است که فقط حالت آخر تعارض است.
+    """
+    current = _make_request(
+        "GET", scoped(f"/rest/v1/users?uid=eq.{entry.user_uid}", entry.payload.get('tenant')), coalesce=False
+    )
+    if current is None:
+        raise StepFailed(f"خطا در خواندن کاربر {entry.user_uid} پس از PATCH شرطی")
+    if isinstance(current, list) and current:
+        current = current[0]
+        if any(current.get(key) != value for key, value in row.items()):
+            raise VersionConflict(VERSION_CONFLICT)
+        # ردیف همان مقادیر را دارد؛ پاسخ درخواست از آن ساخته می‌شود نه 404
+        entry.updated_row = current
+
+
+def _auth_user(entry):
+    if entry.operation == UserLifecycleOutbox.OPERATION_DELETE:
+        ok = delete_auth_user(entry.user_uid)
+    else:
+        email = entry.payload.get('email')
+        ok = not email or update_auth_user(entry.user_uid, {'email': email})
+    if not ok:
+        raise StepFailed(f"خطا در اعمال تغییرات Auth برای کاربر {entry.user_uid}")
+
+
+def _channel_membership(entry):
+    if membership_sync.table_writes_enabled():
+        added = entry.payload.get('channels_added', [])
+        removed = entry.payload.get('channels_removed', [])
+        if not (membership_sync.add_memberships((channel_id, entry.user_uid) for channel_id in added)
+                and membership_sync.remove_memberships(user_uid=entry.user_uid, others=removed)):
+            raise StepFailed(f"خطا در به‌روزرسانی channel_membership برای کاربر {entry.user_uid}")
+        return
+
+    failed = []
+    for channel_id in entry.payload.get('channels_added', []):
+        if not apply_row_change('channels', channel_id, {entry.user_uid}, set()):
+            failed.append(channel_id)
+    for channel_id in entry.payload.get('channels_removed', []):
+        if not apply_row_change('channels', channel_id, set(), {entry.user_uid}):
+            failed.append(channel_id)
+    if failed:
+        raise StepFailed(f"خطا در به‌روزرسانی کاربران مجاز کانال‌ها: {failed}")
+
+
+STEP_HANDLERS = {
+    STEP_USERS_ROW: _users_row,
+    STEP_AUTH_USER: _auth_user,
+    STEP_CHANNEL_MEMBERSHIP: _channel_membership,
+}
+
+
+def run_steps(entry, only=None):
+    """
+    اجرای گام‌های باقی‌مانده به ترتیب
+    With `only`, stop before the first step outside that set. Returns True once every step is done.
+    """
+    queryset = UserLifecycleOutbox.objects.using(DB_ALIAS).filter(id=entry.id)
+    for step in STEPS[entry.operation]:
+        if step in entry.completed_steps:
+            continue
+        if only is not None and step not in only:
+            return False
+        try:
+            STEP_HANDLERS[step](entry)
+        except (UniqueViolation, VersionConflict) as e:
+            # تکرار گام نقض یکتایی (مثلاً نام کاربری تکراری) یا تعارض نسخه را برطرف نمی‌کند
+            entry.status = UserLifecycleOutbox.STATUS_FAILED
+            entry.last_error = f"{step}: {e}"
+            queryset.update(status=entry.status, last_error=entry.last_error, updated_at=timezone.now())
+            logger.error(f"گام {step} از entry {entry.id} به دلیل نقض یکتایی یا تعارض نسخه رد شد: {e}")
+            return False
+        except Exception as e:
+            if not isinstance(e, StepFailed):
+                logger.error(traceback.format_exc())
+            entry.last_error = f"{step}: {e}"
+            queryset.update(last_error=entry.last_error, updated_at=timezone.now())
+            logger.error(f"گام {step} از entry {entry.id} ناموفق بود: {e}")
+            return False
+        entry.completed_steps = entry.completed_steps + [step]
+        queryset.update(completed_steps=entry.completed_steps, updated_at=timezone.now())
+
+    entry.status = UserLifecycleOutbox.STATUS_DONE
+    queryset.update(status=entry.status, last_error='', updated_at=timezone.now())
+    return True
+
+
+def rejected(entry):
+    """True when a step of the entry hit a unique constraint and will not be retried."""
+    return entry.status == UserLifecycleOutbox.STATUS_FAILED
+
+
+def conflicted(entry):
+    """True when the users row had another version than the update's If-Match."""
+    return rejected(entry) and entry.last_error.endswith(VERSION_CONFLICT)
+
+
+def pending_steps(entry):
+    return [step for step in STEPS[entry.operation] if step not in entry.completed_steps]
+
+
+def run_inline(entry):
+    """
+    Run the request-path steps of a freshly recorded entry; True if all of them succeeded.
+    An entry that is neither done nor rejected afterwards goes back to pending for the worker.
+    """
+    inline_steps = _inline_steps()
+    try:
+        run_steps(entry, only=inline_steps)
+    finally:
+        if entry.status == UserLifecycleOutbox.STATUS_RUNNING:
+            entry.status = UserLifecycleOutbox.STATUS_PENDING
+            UserLifecycleOutbox.objects.using(DB_ALIAS).filter(
+                id=entry.id, status=UserLifecycleOutbox.STATUS_RUNNING
+            ).update(status=entry.status, updated_at=timezone.now())
+    return all(step in entry.completed_steps for step in STEPS[entry.operation] if step in inline_steps)
+
+
+def drain(batch_size=100):
+    """Resume one batch of outbox entries. Returns (done, failed) entry counts."""
+    entries = claim_batch(UserLifecycleOutbox, batch_size)
+    max_attempts = getattr(settings, 'USER_OUTBOX_MAX_ATTEMPTS', 10)
+    done = failed = 0
+    for entry in entries:
+        if run_steps(entry):
+            done += 1
+            continue
+        failed += 1
+        exhausted = entry.status == UserLifecycleOutbox.STATUS_FAILED or entry.attempts + 1 >= max_attempts
+        UserLifecycleOutbox.objects.using(DB_ALIAS).filter(id=entry.id).update(
+            status=UserLifecycleOutbox.STATUS_FAILED if exhausted else UserLifecycleOutbox.STATUS_PENDING,
+            updated_at=timezone.now(),
+        )
+    return done, failed
@@ -0,0 +1,69 @@
+"""
+console/versioning.py
+Optimistic concurrency for users and channels rows (version column, migration 0025):
+- VERSION_COLUMN: row version, bumped by the console_bump_version() trigger on every real change.
+- expected_version: the version a request's If-Match header asks for (None when there is no condition).
+- conditional: a PostgREST path that only matches the row while it still has that version.
+- etag / tagged: the ETag of a row and a Response carrying it.
+- precondition_failed: the 412 response for a row that changed since the client read it.
+
+Clients send back the ETag of GET /api/channels/<uid>/ or /api/users/<uid>/ as If-Match; an update
+whose version no longer matches is refused with 412 instead of overwriting the other admin's edit.
+"""
+
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_COLUMN = 'version'
+
+
+class VersionConflict(Exception):
+    """The row exists but no longer has the version the update was conditioned on."""
+
+
+def expected_version(request):
+    """
+    Version in the If-Match header ("3", W/"3" or 3); None without a header or for `*`.
+    Raises ValueError for a header that is not a single version.
+    """
+    value = request.META.get('HTTP_IF_MATCH')
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value or value == '*':
+        return None
+    if value.startswith('W/'):
+        value = value[2:]
+    return int(value.strip('"'))
+
+
+def conditional(path, version):
+    """Append the version filter to a PostgREST path; unchanged when version is None."""
+    if version is None:
+        return path
+    separator = '&' if '?' in path else '?'
+    return f"{path}{separator}{VERSION_COLUMN}=eq.{int(version)}"
+
+
+def etag(version):
+    return f'"{version}"'
+
+
+def tagged(response):
+    """Set the ETag header of a Response whose data is a row with a version."""
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict) and data.get(VERSION_COLUMN) is not None:
+        response['ETag'] = etag(data[VERSION_COLUMN])
+    return response
+
+
+def precondition_failed(current):
+    """412 with the current version, so the client can re-read and retry."""
+    version = current.get(VERSION_COLUMN) if isinstance(current, dict) else None
+    response = Response(
+        {"detail": "این ردیف پس از خواندن شما تغییر کرده است", VERSION_COLUMN: version},
+        status=status.HTTP_412_PRECONDITION_FAILED
+    )
+    if version is not None:
+        response['ETag'] = etag(version)
+    return response
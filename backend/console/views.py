@@ -1,29 +1,35 @@
 """
 console/views.py
 Defines REST API views for Channel and User management using Django REST framework.
-ChannelViewSet and UserViewSet provide CRUD operations secured by session authentication and CSRF protection.
+ChannelViewSet and UserViewSet provide CRUD operations secured by session authentication and CSRF protection,
+open only to super admins (scoped to their own rows) and platform staff (console.tenancy).
 login_view and logout_view handle session login/logout without CSRF enforcement.
 """
 
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, status
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from django.utils.decorators import method_decorator
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Channel, SuperAdmin
-from .serializers import ChannelSerializer, SuperAdminSerializer, UserSerializer
+from .models import Channel, SuperAdmin, MembershipSyncJob, UserLifecycleOutbox
+from .serializers import ChannelSerializer, SuperAdminSerializer, UserSerializer, MembershipSyncJobSerializer
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import User as DjangoUser
 from django.contrib.auth import authenticate, login, logout
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 import random
 import traceback
 import requests
 import os
 import uuid
 from typing import Dict, Any, Optional
+from urllib.parse import quote, urlencode
 import logging
 import jwt
 import os
@@ -32,12 +38,32 @@ import time
 
 logger = logging.getLogger(__name__)
 
-from .supabase_client import create_user, get_user_by_email, update_user, delete_user, create_channel
+from .supabase_client import create_user, get_user_by_email, update_user, delete_user, create_channel, create_auth_user, update_auth_user, delete_auth_user
+from .supabase_client import UniqueViolation, raise_for_unique_violation, sign_in_with_password
+from . import audit, change_log, coalescing, deadline, events, export, jsoncodec, livekit, livekit_webhooks, membership_sync, resilience, tenancy, user_lifecycle, versioning
+from .idempotency import idempotent
 
-def _make_request(method: str, path: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+def _make_request(method: str, path: str, data: Optional[Dict[str, Any]] = None,
+                  coalesce: bool = True) -> Optional[Dict[str, Any]]:
     """
     ارسال درخواست به Supabase API
+    درخواست‌های GET یکسان و هم‌زمان در این پروسه یک درخواست مشترک به Kong می‌فرستند؛
+    خواندن‌هایی که نتیجه‌شان دوباره نوشته می‌شود coalesce=False می‌دهند
+    Raises resilience.UpstreamUnavailable when Supabase did not answer (circuit open or retries exhausted);
+    the request then ends with 503 and Retry-After, even if the view turns the error into a 404.
     """
+    try:
+        if method.upper() == 'GET':
+            return coalescing.coalesce_get(
+                path, lambda: _send_request(method, path, data), coalescing.view_gets, coalesce
+            )
+        return _send_request(method, path, data)
+    except resilience.UpstreamUnavailable as e:
+        # درخواست‌های هم‌زمانی که نتیجه GET مشترک را گرفته‌اند هم باید 503 بدهند
+        resilience.note_unavailable(e)
+        raise
+
+def _send_request(method: str, path: str, data: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
     try:
         base_url = "http://kong:8000"
         url = f"{base_url}{path}"
@@ -49,7 +75,9 @@ def _make_request(method: str, path: str, data: Optional[Dict[str, Any]] = None)
         headers = {
             'apikey': service_role_key,
             'Authorization': f"Bearer {service_role_key}",
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            # ردیف درج یا به‌روزرسانی شده در همان پاسخ برمی‌گردد و GET دوباره لازم نیست
+            'Prefer': 'return=representation'
         }
 
         logger.info(f"ارسال درخواست {method} به {url}")
@@ -57,18 +85,20 @@ def _make_request(method: str, path: str, data: Optional[Dict[str, Any]] = None)
         if data:
             logger.info(f"داده‌های ارسالی: {data}")
 
-        response = requests.request(
-            method=method,
-            url=url,
-            headers=headers,
-            json=data
-        )
+        response = resilience.send(method, url, headers=headers, json=data)
 
         logger.info(f"کد وضعیت: {response.status_code}")
         logger.info(f"پاسخ دریافتی: {response.text}")
 
+        if response.status_code in resilience.RETRYABLE_STATUS_CODES:
+            # همه تلاش‌ها پاسخ گذرا گرفتند؛ «یافت نشد» نیست
+            raise resilience.UpstreamUnavailable(
+                f"Supabase پس از تلاش مجدد پاسخ {response.status_code} داد",
+                retry_after=resilience.get_breaker(resilience.upstream_for_url(url)).retry_after(),
+            )
         if response.status_code >= 400:
             logger.error(f"خطا در درخواست به Supabase: {response.status_code} - {response.text}")
+            raise_for_unique_violation(response)
             return None
 
         # اگر درخواست موفق بود و پاسخ خالی است، True برگردان
@@ -76,20 +106,198 @@ def _make_request(method: str, path: str, data: Optional[Dict[str, Any]] = None)
             return True
 
         try:
-            json_response = response.json()
+            json_response = jsoncodec.loads(response.content)
             # لیست خالی را به عنوان لیست خالی برگردان نه True
             return json_response
         except ValueError:
             # اگر پاسخ JSON نباشد، True برگردان
             return True
+    except (UniqueViolation, deadline.DeadlineExceeded):
+        raise
+    except resilience.UpstreamUnavailable as e:
+        logger.error(f"درخواست به Supabase ارسال نشد: {e}")
+        raise
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+        logger.error(f"Supabase پس از تلاش مجدد در دسترس نبود: {e}")
+        raise resilience.UpstreamUnavailable(
+            str(e), retry_after=resilience.get_breaker(resilience.upstream_for_url(url)).retry_after()
+        ) from e
     except Exception as e:
         logger.error(f"خطا در ارسال درخواست به Supabase: {e}")
         logger.error(f"جزئیات خطا: {traceback.format_exc()}")
         return None
 
-class ChannelViewSet(viewsets.ModelViewSet):
+def _created(data, location: str, status_code=status.HTTP_201_CREATED) -> Response:
+    """پاسخ ایجاد با Location ردیف جدید و ETag آن (در صورت وجود version)، که با Idempotency-Key هم بازپخش می‌شوند"""
+    response = versioning.tagged(Response(data, status=status_code))
+    response['Location'] = location
+    return response
+
+def _changes_response(table: str, request, tenant=None) -> Response:
+    """
+    پاسخ مشترک /changes/ برای کانال‌ها و کاربران
+    Without `since` only the current cursor is returned: take it before downloading the full list,
+    then poll with ?since=<cursor> and apply upserts/deletes until has_more is false.
+    """
+    since = request.query_params.get('since')
+    if not since:
+        return Response({"cursor": change_log.current_cursor()}, status=status.HTTP_200_OK)
+    try:
+        limit = int(request.query_params.get('limit', 0))
+        if limit < 0:
+            raise ValueError(limit)
+    except ValueError:
+        return Response({"detail": "limit باید عدد صحیح مثبت باشد"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(change_log.changes_since(table, since, limit or None, tenant), status=status.HTTP_200_OK)
+    except change_log.InvalidCursor:
+        return Response({"detail": "مقدار since نامعتبر است"}, status=status.HTTP_400_BAD_REQUEST)
+    except change_log.CursorExpired:
+        # ورودی‌های پس از این cursor حذف شده‌اند؛ کلاینت لیست کامل را دوباره می‌گیرد و از cursor جدید ادامه می‌دهد
+        return Response(
+            {"detail": "cursor منقضی شده است؛ همگام‌سازی کامل لازم است", "resync": True,
+             "cursor": change_log.current_cursor()},
+            status=status.HTTP_410_GONE
+        )
+    except change_log.UpstreamUnavailable as e:
+        logger.error(str(e))
+        return Response(
+            {"detail": "Error fetching changed rows from Supabase API"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+
+def _page_params(request) -> tuple:
+    """
+    خواندن limit و offset صفحه‌بندی از query string
+    Raises ValueError for non-integer or negative values; limit is capped at PAGE_MAX_SIZE.
+    """
+    limit = int(request.query_params.get('limit', getattr(settings, 'PAGE_DEFAULT_SIZE', 50)))
+    offset = int(request.query_params.get('offset', 0))
+    if limit < 1 or offset < 0:
+        raise ValueError((limit, offset))
+    return min(limit, getattr(settings, 'PAGE_MAX_SIZE', 500)), offset
+
+def _contains_page(request, table: str, column: str, member_uid: str, tenant=None) -> Response:
+    """
+    یک صفحه از ردیف‌های table که member_uid در آرایه column آن‌ها است، با یک درخواست PostgREST
+    One row past the page is requested so has_more needs no separate count query.
+    """
+    try:
+        limit, offset = _page_params(request)
+    except ValueError:
+        return Response({"detail": "limit و offset باید اعداد صحیح مثبت باشند"}, status=status.HTTP_400_BAD_REQUEST)
+
+    member = quote(jsoncodec.dumps([str(member_uid)]).decode('utf-8'), safe='')
+    response = _make_request(
+        'GET',
+        tenancy.scoped(f"/rest/v1/{table}?{column}=cs.{member}&order=uid&limit={limit + 1}&offset={offset}", tenant)
+    )
+    if response is None:
+        return Response(
+            {"detail": f"Error fetching {table} from Supabase API"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    rows = response if isinstance(response, list) else []
+    return Response({
+        "results": rows[:limit],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    }, status=status.HTTP_200_OK)
+
+def _rpc_page(request, function: str, params: dict) -> Response:
+    """
+    یک صفحه از نتایج تابع جستجوی PostgREST (GET /rest/v1/rpc/<function>)
+    The function takes page_limit/page_offset; one row past the page is requested for has_more.
+    """
+    try:
+        limit, offset = _page_params(request)
+    except ValueError:
+        return Response({"detail": "limit و offset باید اعداد صحیح مثبت باشند"}, status=status.HTTP_400_BAD_REQUEST)
+
+    query = urlencode({"page_limit": limit + 1, "page_offset": offset, **params})
+    response = _make_request('GET', f"/rest/v1/rpc/{function}?{query}")
+    if response is None:
+        return Response(
+            {"detail": "Error searching in Supabase API"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    rows = response if isinstance(response, list) else []
+    return Response({
+        "results": rows[:limit],
+        "limit": limit,
+        "offset": offset,
+        "has_more": len(rows) > limit,
+    }, status=status.HTTP_200_OK)
+
+def _search_term(request) -> dict:
+    q = request.query_params.get('q')
+    return {"q": q.strip()} if isinstance(q, str) and q.strip() else {}
+
+def _tenant(view):
+    """شناسه سوپر ادمین وارد شده برای محدود کردن پرس‌وجوهای viewset (None فقط برای کارکنان پلتفرم)"""
+    request = getattr(view, 'request', None)
+    return tenancy.tenant_for(request) if request is not None else None
+
+def _own_rows(table: str, uids: list, tenant, must_exist: bool = False) -> list:
+    """
+    uidهایی از table که متعلق به tenant هستند، به همان ترتیب
+    Unscoped requests get the list back unchanged unless must_exist is set; rows are looked up
+    FETCH_CHUNK_SIZE uids at a time.
+    """
+    if (tenant is None and not must_exist) or not uids:
+        return list(uids or [])
+    owned = set()
+    for start in range(0, len(uids), change_log.FETCH_CHUNK_SIZE):
+        in_list = ','.join(f'"{uid}"' for uid in uids[start:start + change_log.FETCH_CHUNK_SIZE])
+        rows = _make_request('GET', tenancy.scoped(f"/rest/v1/{table}?uid=in.({in_list})&select=uid", tenant))
+        if isinstance(rows, list):
+            owned.update(row.get('uid') for row in rows)
+    return [uid for uid in uids if uid in owned]
+
+def _membership_delta(request, source_type: str, pk: str, tenant) -> Response:
+    """
+    اعمال {"add": [...], "remove": [...]} روی عضویت‌های یک کانال یا کاربر
+    Only the listed uids are written (membership_sync.apply_delta); uids to add that do not exist or belong
+    to another super admin are returned in "ignored". Responds 202 when part of the fan-out was queued.
+    """
+    add, remove = request.data.get('add', []), request.data.get('remove', [])
+    if not all(isinstance(uids, list) and all(isinstance(uid, str) for uid in uids) for uids in (add, remove)):
+        return Response({"detail": "add و remove باید لیست شناسه‌ها باشند"}, status=status.HTTP_400_BAD_REQUEST)
+    if set(add) & set(remove):
+        return Response({"detail": "یک شناسه نمی‌تواند هم در add و هم در remove باشد"}, status=status.HTTP_400_BAD_REQUEST)
+
+    channel_side = source_type == MembershipSyncJob.SOURCE_CHANNEL
+    table, other = ('channels', 'users') if channel_side else ('users', 'channels')
+    # فقط وجود ردیف خوانده می‌شود، نه آرایه عضویت آن
+    row = _make_request('GET', tenancy.scoped(f"/rest/v1/{table}?uid=eq.{pk}&select=uid", tenant))
+    if row is None:
+        return Response({"detail": f"Error fetching {table} from Supabase API"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if not isinstance(row, list) or len(row) == 0:
+        return Response({"detail": "Channel not found" if channel_side else "User not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    added = _own_rows(other, list(dict.fromkeys(add)), tenant, must_exist=True)
+    removed = list(dict.fromkeys(remove))
+    ok, job = membership_sync.apply_delta(source_type, pk, added, removed, deferred=membership_sync.is_deferred(request))
+    if not ok:
+        return Response({"detail": f"Failed to update {table} memberships in Supabase"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    data = {"uid": pk, "added": added, "removed": removed, "ignored": [uid for uid in add if uid not in added]}
+    if job:
+        data['membership_sync_job'] = job.id
+    return Response(data, status=status.HTTP_202_ACCEPTED if job else status.HTTP_200_OK)
+
+# ستون‌هایی که پایگاه داده محاسبه می‌کند و در نوشتن ارسال نمی‌شوند (مهاجرت 0020)
+CHANNEL_GENERATED_FIELDS = ('name_normalized',)
+
+# پارامترهایی که لیست کانال‌ها را به جستجوی صفحه‌بندی شده تبدیل می‌کنند
+CHANNEL_SEARCH_PARAMS = ('q', 'limit', 'offset')
+
+class ChannelViewSet(audit.AuditedViewSetMixin, viewsets.ModelViewSet):
+    audit_entity = 'channel'
+    audit_actions = {'members': 'update'}
     authentication_classes = [SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    permission_classes = [tenancy.TenantPermission]
     queryset = Channel.objects.using('supabase').none()  # تغییر به none() برای جلوگیری از دسترسی مستقیم
     serializer_class = ChannelSerializer
 
@@ -103,7 +311,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
             logger.info(f"شروع به‌روزرسانی کانال‌های کاربران: channel_id={channel_id}, user_ids={user_ids}")
             
             # دریافت اطلاعات کانال فقط با استفاده از uid
-            channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
+            channel = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{channel_id}", _tenant(self)))
             if channel is True or channel is None or (isinstance(channel, list) and len(channel) == 0):
                 logger.error(f"کانال با uid {channel_id} یافت نشد")
                 return False
@@ -119,7 +327,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
             # برای هر کاربر، لیست کانال‌ها را به‌روزرسانی کن
             for user_id in user_ids:
                 # دریافت اطلاعات کاربر
-                user = _make_request('GET', f"/rest/v1/users?uid=eq.{user_id}")
+                user = _make_request('GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{user_id}", _tenant(self)), coalesce=False)
                 if user is True or user is None or (isinstance(user, list) and len(user) == 0):
                     logger.error(f"کاربر با شناسه {user_id} یافت نشد")
                     continue
@@ -146,6 +354,8 @@ class ChannelViewSet(viewsets.ModelViewSet):
 
             logger.info(f"نتیجه به‌روزرسانی کانال‌های کاربران: {success_count} از {len(user_ids)} کاربر با موفقیت به‌روزرسانی شدند")
             return success_count > 0
+        except (deadline.DeadlineExceeded, resilience.UpstreamUnavailable):
+            raise
         except Exception as e:
             logger.error(f"خطا در به‌روزرسانی کانال‌های کاربران: {e}")
             logger.error(traceback.format_exc())
@@ -159,7 +369,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
             
         try:
             # دریافت اطلاعات کانال فقط با استفاده از uid
-            channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
+            channel = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{channel_id}", _tenant(self)))
             if channel is True or channel is None or (isinstance(channel, list) and len(channel) == 0):
                 logger.error(f"کانال با uid {channel_id} یافت نشد")
                 return False
@@ -171,7 +381,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
             # برای هر کاربر، کانال را از لیست کانال‌ها حذف کن
             for user_id in user_ids:
                 # دریافت اطلاعات کاربر
-                user = _make_request('GET', f"/rest/v1/users?uid=eq.{user_id}")
+                user = _make_request('GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{user_id}", _tenant(self)), coalesce=False)
                 if user is True or user is None or (isinstance(user, list) and len(user) == 0):
                     logger.error(f"کاربر با شناسه {user_id} یافت نشد")
                     continue
@@ -188,17 +398,39 @@ class ChannelViewSet(viewsets.ModelViewSet):
                     _make_request('PATCH', f"/rest/v1/users?uid=eq.{user_id}", {'allowed_channels': channels})
 
             return True
+        except (deadline.DeadlineExceeded, resilience.UpstreamUnavailable):
+            raise
         except Exception as e:
             logger.error(f"خطا در حذف کانال از لیست کانال‌های کاربران: {e}")
             return False
 
+    def _defer_membership(self, channel_id: str, added: list, removed: list, response_data) -> Response:
+        """
+        سپردن همگام‌سازی عضویت به صف پس از تمام شدن مهلت درخواست یا در دسترس نبودن Supabase
+        Jobs are idempotent, so users the inline fan-out already updated are simply applied again.
+        """
+        job = membership_sync.enqueue(MembershipSyncJob.SOURCE_CHANNEL, channel_id, added=added, removed=removed)
+        current = deadline.current()
+        return Response(
+            {
+                **(response_data if isinstance(response_data, dict) else {}),
+                'membership_sync_job': job.id if job else None,
+                'detail': "مهلت درخواست تمام شد یا Supabase در دسترس نبود؛ به‌روزرسانی کاربران مجاز در صف همگام‌سازی قرار گرفت",
+                'skipped_calls': current.skipped if current else [],
+            },
+            status=status.HTTP_202_ACCEPTED
+        )
+
     def list(self, request):
         """
         دریافت لیست کانال‌ها از Supabase REST API به جای دسترسی مستقیم به دیتابیس
+        With q, limit or offset one page of search results is returned instead (see _search).
         """
+        if any(name in request.query_params for name in CHANNEL_SEARCH_PARAMS):
+            return self._search(request)
         try:
             # استفاده از _make_request برای دریافت کانال‌ها از Supabase REST API
-            response = _make_request('GET', '/rest/v1/channels', None)
+            response = _make_request('GET', tenancy.scoped('/rest/v1/channels', _tenant(self)), None)
             logger.info(f"دریافت کانال‌ها از Supabase REST API: {response}")
             
             # اگر پاسخ وجود ندارد یا خطا دارد، آرایه خالی برگردان
@@ -224,6 +456,17 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _search(self, request):
+        """
+        جستجوی کانال‌ها در سمت سرور (?q=&limit=&offset=)
+        q and the stored name_normalized column are compared after Persian normalization (yeh/kaf variants,
+        ZWNJ, diacritics, digits); prefix matches come first, then trigram similarity (console_search_channels).
+        """
+        return _rpc_page(
+            request, 'console_search_channels', {**_search_term(request), **tenancy.search_params(_tenant(self))}
+        )
+
+    @idempotent('channels.create')
     def create(self, request, *args, **kwargs):
         """
         ایجاد کانال جدید با استفاده از Supabase REST API
@@ -234,51 +477,40 @@ class ChannelViewSet(viewsets.ModelViewSet):
             data = request.data.copy()
             name = data.get('name', '')
             allowed_users = data.get('allowed_users', [])
+            tenant = _tenant(self)
+            if isinstance(allowed_users, list):
+                # کاربران سوپر ادمین‌های دیگر به کانال اضافه نمی‌شوند
+                allowed_users = _own_rows('users', allowed_users, tenant)
             
-            # بررسی تکراری بودن نام کانال
-            if name:
-                # دریافت تمام کانال‌ها با این نام
-                existing_channels = _make_request('GET', f"/rest/v1/channels?name=eq.{name}")
-                
-                # اگر کانالی با این نام وجود داشت، خطا بده
-                if existing_channels and (isinstance(existing_channels, list) and len(existing_channels) > 0):
-                    return Response(
-                        {"detail": f"کانالی با نام '{name}' از قبل وجود دارد"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            # استفاده از تابع create_channel
+            # تکراری بودن نام را ایندکس یکتای channels_name_normalized_key بررسی می‌کند و کانال ساخته شده
+            # در پاسخ همان درخواست POST برمی‌گردد
             logger.info(f"ایجاد کانال جدید با نام '{name}'")
-            channel_data = create_channel(name=name, allowed_users=allowed_users)
+            try:
+                channel_data = create_channel(name=name, allowed_users=allowed_users, tenant_id=tenant)
+            except UniqueViolation:
+                return Response(
+                    {"detail": f"کانالی با نام '{name}' از قبل وجود دارد"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             if not channel_data:
                 return Response(
                     {"detail": "Failed to create channel in Supabase"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
-                
-            # اگر channel_data یک boolean است (مثل True)، باید اطلاعات کانال را با یک درخواست GET دریافت کنیم
-            if isinstance(channel_data, bool):
-                logger.info("پاسخ create_channel بولین بود. دریافت اطلاعات کانال با GET...")
-                # در این حالت نیاز به uid داریم که باید از جای دیگری دریافت شود
-                # باید کانال‌ها را بر اساس نام جستجو کنیم
-                
-                channels = _make_request('GET', f"/rest/v1/channels?name=eq.{name}")
-                if isinstance(channels, list) and len(channels) > 0:
-                    channel_data = channels[0]
-                    logger.info(f"کانال با نام {name} یافت شد: {channel_data}")
-                else:
-                    logger.warning(f"کانال با نام {name} پس از ایجاد یافت نشد")
-                    # تولید شناسه جدید برای جلوگیری از خطا
-                    uid = str(uuid.uuid4())
-                    channel_data = {
-                        "id": None,  # ID واقعی در دسترس نیست
-                        "name": name,
-                        "allowed_users": allowed_users,
-                        "uid": uid,
-                        "created_at": datetime.datetime.now().isoformat()
-                    }
             
+            # با جدول channel_membership، تریگر درج کانال عضویت‌ها و کانال‌های کاربران را ثبت کرده است
+            location = f"/api/channels/{channel_data.get('uid')}/"
+            if membership_sync.table_writes_enabled():
+                return _created(channel_data, location)
+
+            # در حالت تعویقی، همگام‌سازی عضویت در صف قرار می‌گیرد و پاسخ فوراً برگردانده می‌شود
+            if channel_data and allowed_users and isinstance(allowed_users, list) and membership_sync.is_deferred(request):
+                job = membership_sync.enqueue(MembershipSyncJob.SOURCE_CHANNEL, channel_data.get('uid'), added=allowed_users)
+                if job:
+                    channel_data = {**channel_data, 'membership_sync_job': job.id}
+                return _created(channel_data, location)
+
             # به‌روزرسانی کانال‌های کاربران
             if channel_data and allowed_users and isinstance(allowed_users, list) and len(allowed_users) > 0:
                 try:
@@ -287,7 +519,10 @@ class ChannelViewSet(viewsets.ModelViewSet):
                     logger.info(f"شناسه کانال برای به‌روزرسانی کاربران: {channel_id}")
                     if channel_id:
                         logger.info(f"به‌روزرسانی {len(allowed_users)} کاربر با شناسه‌های: {allowed_users}")
-                        result = self._update_user_channels(channel_id, allowed_users)
+                        try:
+                            result = self._update_user_channels(channel_id, allowed_users)
+                        except (deadline.DeadlineExceeded, resilience.UpstreamUnavailable):
+                            return self._defer_membership(channel_id, allowed_users, [], channel_data)
                         logger.info(f"نتیجه به‌روزرسانی کانال‌های کاربران: {'موفق' if result else 'ناموفق'}")
                     else:
                         logger.error("شناسه کانال (uid) در داده‌های کانال یافت نشد")
@@ -298,7 +533,7 @@ class ChannelViewSet(viewsets.ModelViewSet):
                     logger.error(f"جزئیات خطا: {traceback.format_exc()}")
                     # این خطا نباید باعث شکست کل عملیات شود
                 
-            return Response(channel_data, status=status.HTTP_201_CREATED)
+            return _created(channel_data, location)
         except Exception as e:
             logger.error(f"خطا در ایجاد کانال در Supabase: {e}")
             return Response(
@@ -306,12 +541,29 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        تغییرات کانال‌ها پس از cursor داده شده (?since=)
+        """
+        return _changes_response('channels', request, _tenant(self))
+
+    @action(detail=True, methods=['get', 'post'])
+    def members(self, request, pk=None):
+        """
+        کاربران مجاز یک کانال به صورت صفحه‌بندی شده (?limit=&offset=)
+        POST {"add": [...], "remove": [...]} changes only the listed members.
+        """
+        if request.method == 'POST':
+            return _membership_delta(request, MembershipSyncJob.SOURCE_CHANNEL, pk, _tenant(self))
+        return _contains_page(request, 'users', 'allowed_channels', pk, _tenant(self))
+
     def retrieve(self, request, pk=None):
         """
         دریافت اطلاعات یک کانال خاص با استفاده از Supabase REST API
         """
         try:
-            response = _make_request('GET', f"/rest/v1/channels?uid=eq.{pk}")
+            response = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", _tenant(self)))
             
             if response is True or response is None or (isinstance(response, list) and len(response) == 0):
                 return Response(
@@ -321,10 +573,10 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 
             # اگر پاسخ یک لیست است، اولین آیتم را برگردان
             if isinstance(response, list) and len(response) > 0:
-                return Response(response[0], status=status.HTTP_200_OK)
+                return versioning.tagged(Response(response[0], status=status.HTTP_200_OK))
             
             # اگر پاسخ یک آبجکت است
-            return Response(response, status=status.HTTP_200_OK)
+            return versioning.tagged(Response(response, status=status.HTTP_200_OK))
         except Exception as e:
             logger.error(f"خطا در دریافت کانال از Supabase: {e}")
             return Response(
@@ -332,73 +584,135 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    def _version_conflict(self, pk, tenant) -> Response:
+        """پاسخ PATCH شرطی بدون ردیف: 404 اگر کانال حذف شده، وگرنه 412 با نسخه فعلی"""
+        current = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", tenant), coalesce=False)
+        if not isinstance(current, list) or len(current) == 0:
+            return Response({"detail": "Channel not found"}, status=status.HTTP_404_NOT_FOUND)
+        return versioning.precondition_failed(current[0])
+
     def update(self, request, pk=None, *args, **kwargs):
         """
         بروزرسانی یک کانال با استفاده از Supabase REST API
+        With If-Match (the ETag of GET /api/channels/<uid>/) the PATCH only applies to that version and a
+        changed channel gets 412. With MEMBERSHIP_TABLE_WRITES that PATCH also carries allowed_users (the 0017
+        triggers sync channel_membership and the users rows in the same statement), so no read is needed;
+        otherwise the channel is read first when allowed_users is being edited.
         """
         try:
             data = request.data.copy()
+            try:
+                expected = versioning.expected_version(request)
+            except ValueError:
+                return Response({"detail": "If-Match باید نسخه کانال باشد"}, status=status.HTTP_400_BAD_REQUEST)
             
             # برای اطمینان از اینکه channel_id تغییر نمی‌کند
             if 'channel_id' in data:
                 del data['channel_id']
+            for field in CHANNEL_GENERATED_FIELDS:
+                data.pop(field, None)
+            # کانال به سوپر ادمین دیگری منتقل نمی‌شود و نسخه را فقط تریگر تغییر می‌دهد
+            data.pop(tenancy.TENANT_COLUMN, None)
+            data.pop(versioning.VERSION_COLUMN, None)
+            tenant = _tenant(self)
+            if isinstance(data.get('allowed_users'), list):
+                data['allowed_users'] = _own_rows('users', data['allowed_users'], tenant)
                 
-            # دریافت اطلاعات کانال فعلی
-            current_channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{pk}")
-            if current_channel is True or current_channel is None or (isinstance(current_channel, list) and len(current_channel) == 0):
-                return Response(
-                    {"detail": "Channel not found"},
-                    status=status.HTTP_404_NOT_FOUND
+            # دریافت اطلاعات کانال فعلی؛ با If-Match فقط برای محاسبه تغییرات اعضا در حالت آرایه‌ای لازم است
+            table_writes = membership_sync.table_writes_enabled()
+            current_channel = None
+            if expected is None or ('allowed_users' in data and not table_writes):
+                current_channel = _make_request(
+                    'GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", tenant), coalesce=False
                 )
-            
-            # اگر پاسخ یک لیست است، اولین آیتم را استفاده کن
-            if isinstance(current_channel, list) and len(current_channel) > 0:
-                current_channel = current_channel[0]
-            
-            # بررسی تکراری بودن نام جدید کانال
-            if 'name' in data and data['name'] and data['name'] != current_channel.get('name'):
-                # دریافت تمام کانال‌ها با این نام
-                existing_channels = _make_request('GET', f"/rest/v1/channels?name=eq.{data['name']}")
+                if current_channel is True or current_channel is None or (isinstance(current_channel, list) and len(current_channel) == 0):
+                    return Response(
+                        {"detail": "Channel not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
                 
-                # اگر کانالی با این نام وجود داشت، خطا بده
-                if existing_channels and (isinstance(existing_channels, list) and len(existing_channels) > 0):
+                # اگر پاسخ یک لیست است، اولین آیتم را استفاده کن
+                if isinstance(current_channel, list) and len(current_channel) > 0:
+                    current_channel = current_channel[0]
+                if expected is not None and current_channel.get(versioning.VERSION_COLUMN) != expected:
+                    return versioning.precondition_failed(current_channel)
+            
+            # با جدول channel_membership فقط جفت‌های اضافه و حذف شده نوشته می‌شوند، نه کل آرایه؛ با If-Match آرایه
+            # در همان PATCH شرطی می‌رود تا بررسی نسخه و تغییر اعضا یک دستور باشند (دو ادمین با یک ETag هر دو رد نشوند)
+            table_members = 'allowed_users' in data and table_writes and expected is None
+            if table_members:
+                allowed_users = data.pop('allowed_users') or []
+
+            # به‌روزرسانی کانال؛ نام تکراری را ایندکس یکتای نام رد می‌کند و ردیف جدید در پاسخ PATCH برمی‌گردد
+            response = current_channel
+            if data or not table_members:
+                try:
+                    response = _make_request(
+                        'PATCH', versioning.conditional(tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", tenant), expected), data
+                    )
+                except UniqueViolation:
                     return Response(
-                        {"detail": f"کانالی با نام '{data['name']}' از قبل وجود دارد"},
+                        {"detail": f"کانالی با نام '{data.get('name')}' از قبل وجود دارد"},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-            
-            # به‌روزرسانی کانال
-            response = _make_request('PATCH', f"/rest/v1/channels?uid=eq.{pk}", data)
-            
-            if not response:
-                return Response(
-                    {"detail": "Failed to update channel in Supabase"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-                
-            # اگر پاسخ True است، داده‌های به‌روزرسانی شده را برگردان
-            if response is True:
-                # دریافت اطلاعات کانال به‌روزرسانی شده
-                updated_channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{pk}")
-                if isinstance(updated_channel, list) and len(updated_channel) > 0:
-                    response = updated_channel[0]
-                else:
-                    # اگر نمی‌توانیم داده‌های به‌روزرسانی شده را دریافت کنیم، از داده‌های ورودی استفاده می‌کنیم
-                    response = {**current_channel, **data}
+
+                if response is None or response is False:
+                    return Response(
+                        {"detail": "Failed to update channel in Supabase"},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    )
+
+                # کانال بین GET و PATCH حذف شده یا (با If-Match) نسخه آن تغییر کرده است
+                if isinstance(response, list) and len(response) == 0:
+                    if expected is not None:
+                        return self._version_conflict(pk, tenant)
+                    return Response(
+                        {"detail": "Channel not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                if isinstance(response, list):
+                    response = response[0]
+
+                # اگر پاسخ True است، داده‌های به‌روزرسانی شده را برگردان
+                if response is True:
+                    response = {**(current_channel or {'uid': pk}), **data}
+
+            if table_members:
+                current_users = current_channel.get('allowed_users', []) or []
+                removed_users = [uid for uid in current_users if uid not in allowed_users]
+                new_users = [uid for uid in allowed_users if uid not in current_users]
+                if not (membership_sync.remove_memberships(channel_uid=pk, others=removed_users)
+                        and membership_sync.add_memberships((pk, uid) for uid in new_users)):
+                    return Response(
+                        {"detail": "Failed to update channel members in Supabase"},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                    )
+                # آرایه allowed_users را تریگر channel_membership به‌روز کرده و با آن نسخه کانال هم بالا رفته است؛
+                # نسخه قدیمی برگردانده نمی‌شود و کلاینت برای If-Match بعدی کانال را دوباره می‌خواند
+                response = {key: value for key, value in response.items() if key != versioning.VERSION_COLUMN}
+                return Response({**response, 'allowed_users': allowed_users}, status=status.HTTP_200_OK)
                 
-            # به‌روزرسانی کانال‌های کاربران
-            if 'allowed_users' in data:
+            # به‌روزرسانی کانال‌های کاربران (با جدول channel_membership کار تریگرها است)
+            if 'allowed_users' in data and not table_writes:
                 # حذف کانال از لیست کانال‌های کاربرانی که دیگر مجاز نیستند
                 removed_users = list(set(current_channel.get('allowed_users', [])) - set(data['allowed_users']))
-                if removed_users:
-                    self._remove_user_channels(pk, removed_users)
-
                 # اضافه کردن کانال به لیست کانال‌های کاربران جدید
                 new_users = list(set(data['allowed_users']) - set(current_channel.get('allowed_users', [])))
-                if new_users:
-                    self._update_user_channels(pk, new_users)
+
+                if membership_sync.is_deferred(request):
+                    job = membership_sync.enqueue(MembershipSyncJob.SOURCE_CHANNEL, pk, added=new_users, removed=removed_users)
+                    if job and isinstance(response, dict):
+                        response = {**response, 'membership_sync_job': job.id}
+                else:
+                    try:
+                        if removed_users:
+                            self._remove_user_channels(pk, removed_users)
+                        if new_users:
+                            self._update_user_channels(pk, new_users)
+                    except (deadline.DeadlineExceeded, resilience.UpstreamUnavailable):
+                        return self._defer_membership(pk, new_users, removed_users, response)
                 
-            return Response(response, status=status.HTTP_200_OK)
+            return versioning.tagged(Response(response, status=status.HTTP_200_OK))
         except Exception as e:
             logger.error(f"خطا در به‌روزرسانی کانال در Supabase: {e}")
             return Response(
@@ -423,7 +737,8 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 )
                 
             # ابتدا اطلاعات کانال را دریافت می‌کنیم - از uid استفاده می‌کنیم
-            channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{pk}")
+            tenant = _tenant(self)
+            channel = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", tenant))
             
             if not channel or (isinstance(channel, list) and len(channel) == 0):
                 logger.error(f"کانال با شناسه uid={pk} یافت نشد")
@@ -437,26 +752,31 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 channel = channel[0]
             
             # گام 1: حذف کانال از لیست کانال‌های مجاز تمام کاربرانی که به این کانال دسترسی داشته‌اند
-            try:
-                # دریافت تمامی کاربران
-                users = _make_request('GET', f"/rest/v1/users")
+            # (با جدول channel_membership این کار را تریگر حذف کانال انجام می‌دهد)
+            if not membership_sync.table_writes_enabled():
+                try:
+                    # فقط کاربران همین سوپر ادمین که کانال در allowed_channels آن‌ها است (ایندکس GIN مهاجرت 0018)
+                    member = quote(jsoncodec.dumps([str(pk)]).decode('utf-8'), safe='')
+                    users = _make_request('GET', tenancy.scoped(
+                        f"/rest/v1/users?allowed_channels=cs.{member}&select=uid,allowed_channels", tenant
+                    ), coalesce=False)
                 
-                if users and isinstance(users, list):
-                    for user in users:
-                        user_id = user.get('uid')
-                        allowed_channels = user.get('allowed_channels', [])
+                    if users and isinstance(users, list):
+                        for user in users:
+                            user_id = user.get('uid')
+                            allowed_channels = user.get('allowed_channels', [])
                         
-                        # اگر کانال در لیست کانال‌های مجاز کاربر وجود دارد، آن را حذف کن
-                        if pk in allowed_channels:
-                            allowed_channels.remove(pk)
-                            _make_request('PATCH', f"/rest/v1/users?uid=eq.{user_id}", {'allowed_channels': allowed_channels})
-                            logger.info(f"کانال {pk} از لیست کانال‌های مجاز کاربر {user_id} حذف شد")
-            except Exception as e:
-                logger.error(f"خطا در حذف کانال از لیست کانال‌های مجاز کاربران: {e}")
-                # ادامه اجرا، زیرا این مرحله نباید کل فرآیند را متوقف کند
+                            # اگر کانال در لیست کانال‌های مجاز کاربر وجود دارد، آن را حذف کن
+                            if pk in allowed_channels:
+                                allowed_channels.remove(pk)
+                                _make_request('PATCH', f"/rest/v1/users?uid=eq.{user_id}", {'allowed_channels': allowed_channels})
+                                logger.info(f"کانال {pk} از لیست کانال‌های مجاز کاربر {user_id} حذف شد")
+                except Exception as e:
+                    logger.error(f"خطا در حذف کانال از لیست کانال‌های مجاز کاربران: {e}")
+                    # ادامه اجرا، زیرا این مرحله نباید کل فرآیند را متوقف کند
                 
             # گام 2: حذف کانال از جدول channels با استفاده از uid
-            delete_response = _make_request('DELETE', f"/rest/v1/channels?uid=eq.{pk}")
+            delete_response = _make_request('DELETE', tenancy.scoped(f"/rest/v1/channels?uid=eq.{pk}", tenant))
             
             if delete_response is None:
                 logger.error(f"خطا در حذف کانال با uid={pk} از جدول channels")
@@ -479,107 +799,45 @@ class ChannelViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class UserViewSet(viewsets.ModelViewSet):
-    authentication_classes = []  # برداشتن نیاز به احراز هویت
-    permission_classes = [AllowAny]  # اجازه دسترسی به همه
+# پارامترهایی که لیست کاربران را به جستجوی صفحه‌بندی شده تبدیل می‌کنند
+USER_SEARCH_PARAMS = ('q', 'role', 'active', 'limit', 'offset')
+
+class UserViewSet(audit.AuditedViewSetMixin, viewsets.ModelViewSet):
+    audit_entity = 'user'
+    audit_actions = {'channels': 'update'}
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [tenancy.TenantPermission]
     queryset = DjangoUser.objects.using('supabase').none()  # تغییر به none() برای جلوگیری از دسترسی مستقیم
     serializer_class = UserSerializer
 
-    def _update_channel_users(self, user_id: str, channel_ids: list):
-        """به‌روزرسانی کاربران مجاز کانال‌ها"""
-        if not channel_ids or not isinstance(channel_ids, list) or not user_id:
-            logger.warning(f"لیست کانال‌ها یا شناسه کاربر نامعتبر است: channels={channel_ids}, user_id={user_id}")
-            return False
-            
-        success = True
-        logger.info(f"شروع به‌روزرسانی کاربران مجاز کانال‌ها: user_id={user_id}, channel_ids={channel_ids}")
-
+    def _valid_channels(self, channel_ids: list) -> list:
+        """حذف شناسه کانال‌هایی که در جدول channels وجود ندارند"""
+        valid_channels = []
         try:
-            # برای هر کانال، لیست کاربران مجاز را به‌روزرسانی کن
-            for channel_id in channel_ids:
-                try:
-                    # دریافت اطلاعات کانال فقط با استفاده از uid
-                    channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
-                    if not channel or len(channel) == 0:
-                        logger.error(f"کانال با uid {channel_id} یافت نشد")
-                        success = False
-                        continue
-
-                    channel = channel[0]
-                    allowed_users = channel.get('allowed_users', []) or []
-                    logger.info(f"کاربران مجاز فعلی کانال {channel_id}: {allowed_users}")
-                    
-                    # اگر کاربر در لیست کاربران مجاز نیست، اضافه کن
-                    if user_id not in allowed_users:
-                        allowed_users.append(user_id)
-                        logger.info(f"افزودن کاربر {user_id} به لیست کاربران مجاز کانال {channel_id}")
-                        result = _make_request('PATCH', f"/rest/v1/channels?uid=eq.{channel_id}", {'allowed_users': allowed_users})
-                        if not result:
-                            logger.error(f"خطا در به‌روزرسانی کاربران مجاز برای کانال {channel_id}")
-                            success = False
-                        else:
-                            logger.info(f"کاربر {user_id} با موفقیت به لیست کاربران مجاز کانال {channel_id} اضافه شد")
-                    else:
-                        logger.info(f"کاربر {user_id} از قبل در لیست کاربران مجاز کانال {channel_id} وجود دارد")
-                except Exception as e:
-                    logger.error(f"خطا در پردازش کانال {channel_id}: {str(e)}")
-                    logger.error(traceback.format_exc())
-                    success = False
-
-            return success
-        except Exception as e:
-            logger.error(f"خطا در به‌روزرسانی کاربران مجاز کانال‌ها: {e}")
-            logger.error(traceback.format_exc())
-            return False
-
-    def _remove_channel_users(self, user_id: str, channel_ids: list):
-        """حذف کاربر از لیست کاربران مجاز کانال‌ها"""
-        if not channel_ids or not isinstance(channel_ids, list) or not user_id:
-            logger.warning(f"لیست کانال‌ها یا شناسه کاربر نامعتبر است: channels={channel_ids}, user_id={user_id}")
-            return False
-            
-        success = True
-        
-        try:
-            # برای هر کانال، کاربر را از لیست کاربران مجاز حذف کن
-            for channel_id in channel_ids:
-                try:
-                    # دریافت اطلاعات کانال فقط با استفاده از uid
-                    channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
-                    if not channel or len(channel) == 0:
-                        logger.error(f"کانال با uid {channel_id} یافت نشد")
-                        success = False
-                        continue
-
-                    # اگر پاسخ یک لیست است، اولین آیتم را استفاده کن
-                    if isinstance(channel, list) and len(channel) > 0:
-                        channel = channel[0]
-                    
-                    allowed_users = channel.get('allowed_users', [])
-                    
-                    # اگر کاربر در لیست کاربران مجاز است، حذف کن
-                    if user_id in allowed_users:
-                        allowed_users.remove(user_id)
-                        result = _make_request('PATCH', f"/rest/v1/channels?uid=eq.{channel_id}", {'allowed_users': allowed_users})
-                        if not result:
-                            logger.error(f"خطا در حذف کاربر از کانال {channel_id}")
-                            success = False
-                except Exception as e:
-                    logger.error(f"خطا در پردازش حذف کاربر از کانال {channel_id}: {str(e)}")
-                    success = False
-
-            return success
+            for channel_id in channel_ids or []:
+                # دریافت اطلاعات کانال فقط با استفاده از uid
+                channel = _make_request('GET', tenancy.scoped(f"/rest/v1/channels?uid=eq.{channel_id}", _tenant(self)))
+                if channel and len(channel) > 0:
+                    valid_channels.append(channel_id)
+                else:
+                    logger.warning(f"کانال با uid {channel_id} یافت نشد و از لیست کانال‌های کاربر حذف شد")
+        except (deadline.DeadlineExceeded, resilience.UpstreamUnavailable):
+            # کانالی که بررسی نشده نباید به عنوان نامعتبر حذف شود
+            raise
         except Exception as e:
-            logger.error(f"خطا در حذف کاربر از لیست کاربران مجاز کانال‌ها: {e}")
-            return False
+            logger.error(f"خطا در بررسی اعتبار کانال‌ها: {e}")
+        return valid_channels
 
     def list(self, request):
         """
         دریافت لیست کاربران از Supabase REST API به جای دسترسی مستقیم به دیتابیس
+        With any of q, role, active, limit or offset the search endpoint answers instead (see _search).
         """
+        if any(name in request.query_params for name in USER_SEARCH_PARAMS):
+            return self._search(request)
         try:
             # استفاده از _make_request برای دریافت کاربران از Supabase REST API
-            response = _make_request('GET', '/rest/v1/users', None)
+            response = _make_request('GET', tenancy.scoped('/rest/v1/users', _tenant(self)), None)
             logger.info(f"دریافت کاربران از Supabase REST API: {response}")
 
             # اگر پاسخ وجود ندارد یا خطا دارد، آرایه خالی برگردان
@@ -596,9 +854,29 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    def _search(self, request):
+        """
+        جستجوی کاربران در سمت سرور (?q=&role=&active=&limit=&offset=)
+        q matches username by prefix, substring or trigram similarity (console_search_users, migration 0019);
+        prefix matches come first. The response is one page: {results, limit, offset, has_more}.
+        """
+        params = _search_term(request)
+        role = request.query_params.get('role')
+        if isinstance(role, str) and role:
+            params["user_role"] = role
+        active = request.query_params.get('active')
+        if isinstance(active, str) and active:
+            if active.lower() not in ('true', 'false'):
+                return Response({"detail": "active باید true یا false باشد"}, status=status.HTTP_400_BAD_REQUEST)
+            params["user_active"] = active.lower()
+        return _rpc_page(request, 'console_search_users', {**params, **tenancy.search_params(_tenant(self))})
+
+    @idempotent('users.create')
     def create(self, request, *args, **kwargs):
         """
-        ایجاد کاربر جدید با استفاده از Supabase Auth و REST API
+        ایجاد کاربر جدید
+        ساخت کاربر در Auth و ثبت ردیف users در مسیر درخواست انجام می‌شود؛
+        به‌روزرسانی کاربران مجاز کانال‌ها از طریق outbox به کارگر پس‌زمینه سپرده می‌شود
         """
         try:
             # آماده‌سازی داده‌ها برای ارسال به API
@@ -616,57 +894,61 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # بررسی اعتبار کانال‌ها
-            valid_channels = []
-            if channels:
-                try:
-                    for channel_id in channels:
-                        # دریافت اطلاعات کانال فقط با استفاده از uid
-                        channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
-                        if channel and len(channel) > 0:
-                            valid_channels.append(channel_id)
-                        else:
-                            logger.warning(f"کانال با uid {channel_id} یافت نشد و از لیست کانال‌های کاربر حذف شد")
-                except Exception as e:
-                    logger.error(f"خطا در بررسی اعتبار کانال‌ها: {e}")
+            valid_channels = self._valid_channels(channels)
             
-            # استفاده از create_user برای ساخت کاربر
+            # گام همگام: ساخت کاربر در Auth (رمز عبور هرگز در outbox ذخیره نمی‌شود)
             logger.info(f"شروع فرآیند ساخت کاربر با نام کاربری {username}")
+            try:
+                auth_user = create_auth_user(
+                    username=username,
+                    password=password,
+                    role=role,
+                    active=active,
+                    allowed_channels=valid_channels
+                )
+            except UniqueViolation:
+                return Response(
+                    {"detail": f"کاربری با نام کاربری '{username}' از قبل وجود دارد"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            user_data = create_user(
-                username=username,
-                password=password,
-                role=role,
-                active=active,
-                allowed_channels=valid_channels
-            )
-            
-            if not user_data:
+            if not auth_user:
                 return Response(
                     {"detail": "خطا در ساخت کاربر در Supabase"},
                     status=status.HTTP_500_INTERNAL_SERVER_ERROR
                 )
-                
-            # به‌روزرسانی کانال‌ها برای کاربر جدید
-            if valid_channels:
-                try:
-                    # استفاده از uid به جای id
-                    user_uid = user_data.get('uid')
-                    logger.info(f"شناسه کاربر برای به‌روزرسانی کانال‌ها: {user_uid}")
-                    if user_uid:
-                        logger.info(f"به‌روزرسانی {len(valid_channels)} کانال با شناسه‌های: {valid_channels}")
-                        result = self._update_channel_users(user_uid, valid_channels)
-                        logger.info(f"نتیجه به‌روزرسانی کانال‌های کاربر: {'موفق' if result else 'ناموفق'}")
-                    else:
-                        logger.error("شناسه کاربر (uid) در داده‌های کاربر یافت نشد")
-                except Exception as e:
-                    logger.error(f"خطا در به‌روزرسانی کانال‌های کاربر: {e}")
-                    logger.error(f"جزئیات خطا: {traceback.format_exc()}")
-                    # این خطا نباید باعث شکست کل عملیات شود
-                
-            return Response(
-                UserSerializer(user_data).data,
-                status=status.HTTP_201_CREATED
+            
+            user_row = {
+                "uid": auth_user["id"],
+                "username": username,
+                "role": role,
+                "active": active,
+                "allowed_channels": valid_channels
+            }
+            tenant = _tenant(self)
+            if tenant is not None:
+                user_row[tenancy.TENANT_COLUMN] = tenant
+            entry = user_lifecycle.record(
+                UserLifecycleOutbox.OPERATION_CREATE,
+                auth_user["id"],
+                {"row": user_row, "channels_added": valid_channels}
+            )
+            inline_done = user_lifecycle.run_inline(entry)
+            if user_lifecycle.rejected(entry):
+                # کاربر Auth بدون ردیف users باقی نماند
+                delete_auth_user(auth_user["id"])
+                return Response(
+                    {"detail": f"کاربری با نام کاربری '{username}' از قبل وجود دارد"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            response_data = UserSerializer({**user_row, "created_at": auth_user.get("created_at")}).data
+            response_data['outbox_id'] = entry.id
+            # اگر ثبت در جدول users ناموفق بود، کارگر outbox آن را دوباره اجرا می‌کند
+            return _created(
+                response_data,
+                f"/api/users/{response_data.get('uid')}/",
+                status.HTTP_201_CREATED if inline_done else status.HTTP_202_ACCEPTED
             )
 
         except Exception as e:
@@ -677,12 +959,29 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
     
+    @action(detail=False, methods=['get'])
+    def changes(self, request):
+        """
+        تغییرات کاربران پس از cursor داده شده (?since=)
+        """
+        return _changes_response('users', request, _tenant(self))
+
+    @action(detail=True, methods=['get', 'post'])
+    def channels(self, request, pk=None):
+        """
+        کانال‌های مجاز یک کاربر به صورت صفحه‌بندی شده (?limit=&offset=)
+        POST {"add": [...], "remove": [...]} changes only the listed channels.
+        """
+        if request.method == 'POST':
+            return _membership_delta(request, MembershipSyncJob.SOURCE_USER, pk, _tenant(self))
+        return _contains_page(request, 'channels', 'allowed_users', pk, _tenant(self))
+
     def retrieve(self, request, pk=None):
         """
         دریافت اطلاعات یک کاربر خاص با استفاده از Supabase REST API
         """
         try:
-            response = _make_request('GET', f"/rest/v1/users?uid=eq.{pk}")
+            response = _make_request('GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{pk}", _tenant(self)))
             
             if not response or len(response) == 0:
                 return Response(
@@ -690,7 +989,7 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
                 
-            return Response(response[0], status=status.HTTP_200_OK)
+            return versioning.tagged(Response(response[0], status=status.HTTP_200_OK))
         except Exception as e:
             logger.error(f"خطا در دریافت کاربر از Supabase: {e}")
             return Response(
@@ -700,142 +999,118 @@ class UserViewSet(viewsets.ModelViewSet):
 
     def update(self, request, pk=None, *args, **kwargs):
         """
-        بروزرسانی یک کاربر با استفاده از Supabase REST API
-        همراه با تضمین همسانی داده‌ها بین auth و جدول users
+        بروزرسانی یک کاربر
+        تغییر رمز عبور و ردیف users در مسیر درخواست انجام می‌شود؛
+        تغییر ایمیل Auth و کاربران مجاز کانال‌ها از طریق outbox اعمال می‌شود
+        With If-Match the users row is only patched at that version (412 otherwise); the user is then only
+        read first when the username, password or allowed_channels change.
         """
         try:
             data = request.data.copy()
-            original_data = data.copy()  # نگهداری داده‌های اصلی برای بازگشت احتمالی
+            try:
+                expected = versioning.expected_version(request)
+            except ValueError:
+                return Response({"detail": "If-Match باید نسخه کاربر باشد"}, status=status.HTTP_400_BAD_REQUEST)
             
             # دریافت اطلاعات کاربر فعلی
-            current_user = _make_request('GET', f"/rest/v1/users?uid=eq.{pk}")
-            if not current_user or len(current_user) == 0:
-                return Response(
-                    {"detail": "User not found"},
-                    status=status.HTTP_404_NOT_FOUND
+            # کاربر به سوپر ادمین دیگری منتقل نمی‌شود و نسخه را فقط تریگر تغییر می‌دهد
+            data.pop(tenancy.TENANT_COLUMN, None)
+            data.pop(versioning.VERSION_COLUMN, None)
+            current_user = {'uid': pk}
+            read_first = expected is None or any(field in data for field in ('username', 'password', 'allowed_channels'))
+            if read_first:
+                current_user = _make_request(
+                    'GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{pk}", _tenant(self)), coalesce=False
                 )
-            current_user = current_user[0]
+                if not current_user or len(current_user) == 0:
+                    return Response(
+                        {"detail": "User not found"},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                current_user = current_user[0]
+                # پیش از تغییر رمز عبور در Auth، تا به‌روزرسانی رد شده نیمه‌کاره اعمال نشود
+                if expected is not None and current_user.get(versioning.VERSION_COLUMN) != expected:
+                    return versioning.precondition_failed(current_user)
             
             # بررسی اعتبار کانال‌ها
+            channels_added, channels_removed = [], []
             if 'allowed_channels' in data:
-                valid_channels = []
-                for channel_id in data['allowed_channels']:
-                    # دریافت اطلاعات کانال فقط با استفاده از uid
-                    channel = _make_request('GET', f"/rest/v1/channels?uid=eq.{channel_id}")
-                    if channel and len(channel) > 0:
-                        valid_channels.append(channel_id)
-                    else:
-                        logger.warning(f"کانال با uid {channel_id} یافت نشد و از لیست کانال‌های کاربر حذف شد")
-
-                # جایگزینی لیست کانال‌ها با کانال‌های معتبر
-                data['allowed_channels'] = valid_channels
+                data['allowed_channels'] = self._valid_channels(data['allowed_channels'])
+                current_channels = current_user.get('allowed_channels', []) or []
+                channels_removed = list(set(current_channels) - set(data['allowed_channels']))
+                channels_added = list(set(data['allowed_channels']) - set(current_channels))
             
-            # تعیین نیاز به به‌روزرسانی اطلاعات auth
-            auth_update_needed = False
-            auth_data = {}
+            # رمز عبور ستون جدول users نیست و در outbox هم ذخیره نمی‌شود
+            password = data.pop('password', None)
+            if password in ('', 'undefined'):
+                password = None
             
+            email = None
             if 'username' in data and data['username'] != current_user.get('username'):
-                auth_update_needed = True
                 # تبدیل نام کاربری به فرمت ایمیل اگر در قالب ایمیل نیست
                 email = data['username']
                 if '@' not in email:
                     email = f"{email}@example.com"
-                auth_data['email'] = email
-            
-            if 'password' in data and data['password']:
-                auth_update_needed = True
-                auth_data['password'] = data['password']
+                data['username'] = data['username'].replace('@example.com', '')
             
-            # آماده‌سازی داده‌های جدول users
-            users_data = data.copy()
-            if 'username' in users_data and '@example.com' in users_data['username']:
-                users_data['username'] = users_data['username'].replace('@example.com', '')
-
-            # فاز 1: به‌روزرسانی اطلاعات در auth
-            auth_success = True
-            auth_response = None # مقداردهی اولیه auth_response
-            if auth_update_needed:
+            if password:
+                auth_data = {'password': password}
+                if email:
+                    auth_data['email'] = email
+                    email = None
                 try:
-                    # به‌روزرسانی اطلاعات کاربر در Auth
-                    auth_response = _make_request('PUT', f"/auth/v1/admin/users?uid=eq.{pk}", auth_data)
-
-                    if not auth_response: # انتقال این بلوک به داخل try
-                        auth_success = False
-                        logger.error(f"خطا در به‌روزرسانی اطلاعات auth کاربر {pk}")
-                except Exception as e: # اصلاح تورفتگی این except و بلوک آن
-                    auth_success = False
-                    logger.error(f"خطا در به‌روزرسانی auth: {e}")
-
-            # فاز 2: به‌روزرسانی اطلاعات در جدول users
-            # اگر auth با موفقیت به‌روزرسانی شد یا نیازی به به‌روزرسانی auth نبود
-            if auth_success or not auth_update_needed:
-                response = _make_request('PATCH', f"/rest/v1/users?uid=eq.{pk}", users_data)
-
-                if not response:
-                    # اگر auth با موفقیت به‌روزرسانی شد اما جدول users به‌روزرسانی نشد،
-                    # بازگشت به حالت قبل در auth
-                    if auth_success and auth_update_needed:
-                        try:
-                            # بازگشت به اطلاعات auth قبلی
-                            rollback_auth_data = {}
-                            if 'username' in original_data and '@' not in original_data['username']:
-                                rollback_auth_data['email'] = f"{current_user.get('username')}@example.com"
-                            
-                            if rollback_auth_data:
-                                _make_request('PUT', f"/auth/v1/admin/users?uid=eq.{pk}", rollback_auth_data)
-                                logger.info(f"اطلاعات auth با موفقیت به حالت قبل بازگشت")
-                        except Exception as rollback_err:
-                            logger.error(f"خطا در بازگشت تغییرات auth: {rollback_err}")
-                    
+                    auth_updated = update_auth_user(pk, auth_data)
+                except UniqueViolation:
                     return Response(
-                        {"detail": "خطا در به‌روزرسانی کاربر در Supabase"},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                        {"detail": f"کاربری با نام کاربری '{data.get('username')}' از قبل وجود دارد"},
+                        status=status.HTTP_400_BAD_REQUEST
                     )
-                
-                # به‌روزرسانی کانال‌های مجاز کاربران در جدول channels
-                if 'allowed_channels' in data:
-                    try:
-                        # حذف کاربر از لیست کاربران مجاز کانال‌هایی که دیگر در لیست کانال‌های کاربر نیستند
-                        removed_channels = list(set(current_user.get('allowed_channels', [])) - set(data['allowed_channels']))
-                        if removed_channels:
-                            self._remove_channel_users(pk, removed_channels)
-
-                        # اضافه کردن کاربر به لیست کاربران مجاز کانال‌های جدید
-                        new_channels = list(set(data['allowed_channels']) - set(current_user.get('allowed_channels', [])))
-                        if new_channels:
-                            self._update_channel_users(pk, new_channels)
-                    except Exception as channel_err:
-                        logger.error(f"خطا در به‌روزرسانی کانال‌های مجاز: {channel_err}")
-                        # ادامه اجرا و بازگشت پاسخ موفق، زیرا کاربر به‌روزرسانی شده است
-                        logger.info("کاربر با موفقیت به‌روزرسانی شد اما در به‌روزرسانی کانال‌ها خطا رخ داد")
-                
-                return Response(response, status=status.HTTP_200_OK)
-            
-            # اگر auth با موفقیت به‌روزرسانی نشد
-            elif 'username' in data:
-                logger.warning("به‌روزرسانی auth ناموفق بود، فقط نام کاربری در جدول users به‌روزرسانی می‌شود")
-                # فقط نام کاربری اصلی (بدون @example.com) را به‌روزرسانی می‌کنیم
-                clean_data = {}
-                clean_data['username'] = data['username'].replace('@example.com', '')
-                
-                response = _make_request('PATCH', f"/rest/v1/users?uid=eq.{pk}", clean_data)
-                
-                if not response:
+                if not auth_updated:
                     return Response(
-                        {"detail": "خطا در به‌روزرسانی نام کاربری در Supabase"},
+                        {"detail": "خطا در به‌روزرسانی کاربر در Supabase Auth"},
                         status=status.HTTP_500_INTERNAL_SERVER_ERROR
                     )
-                
+            
+            entry = user_lifecycle.record(
+                UserLifecycleOutbox.OPERATION_UPDATE,
+                pk,
+                {
+                    "row": data,
+                    "email": email,
+                    "channels_added": channels_added,
+                    "channels_removed": channels_removed,
+                    "version": expected,
+                    "tenant": _tenant(self)
+                }
+            )
+            inline_done = user_lifecycle.run_inline(entry)
+            if user_lifecycle.conflicted(entry):
+                current = _make_request('GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{pk}", _tenant(self)), coalesce=False)
+                return versioning.precondition_failed(current[0] if isinstance(current, list) and current else None)
+            if user_lifecycle.rejected(entry):
                 return Response(
-                    {"detail": "نام کاربری به‌روزرسانی شد اما سایر تغییرات اعمال نشد"},
-                    status=status.HTTP_200_OK
+                    {"detail": f"کاربری با نام کاربری '{data.get('username')}' از قبل وجود دارد"},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # اگر به‌روزرسانی auth ناموفق بود و نام کاربری هم وجود ندارد
-            return Response(
-                {"detail": "خطا در به‌روزرسانی کاربر در Supabase Auth"},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            updated_row = getattr(entry, 'updated_row', None)
+            if not read_first and data and inline_done and updated_row is None:
+                # بدون خواندن اولیه، PATCH شرطی بدون ردیف و بدون تعارض یعنی کاربر وجود ندارد
+                return Response({"detail": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+            
+            # ردیفی که PATCH برگرداند نسخه جدید را دارد
+            response_data = {**current_user, **data, **(updated_row or {}), 'outbox_id': entry.id}
+            if (channels_added or channels_removed) and membership_sync.table_writes_enabled() and expected is None:
+                # تریگر channel_membership آرایه allowed_channels و با آن نسخه کاربر را دوباره تغییر می‌دهد
+                # (با If-Match آرایه در همان PATCH شرطی نوشته شده و نسخه پاسخ درست است)
+                response_data.pop(versioning.VERSION_COLUMN, None)
+            if not inline_done:
+                # گام‌های باقی‌مانده (مثلاً پس از تمام شدن مهلت درخواست) را کارگر outbox اجرا می‌کند
+                response_data['pending_steps'] = user_lifecycle.pending_steps(entry)
+            return versioning.tagged(Response(
+                response_data,
+                status=status.HTTP_200_OK if inline_done else status.HTTP_202_ACCEPTED
+            ))
         except Exception as e:
             logger.error(f"خطا در به‌روزرسانی کاربر در Supabase: {e}")
             return Response(
@@ -845,14 +1120,13 @@ class UserViewSet(viewsets.ModelViewSet):
     
     def destroy(self, request, pk=None):
         """
-        حذف یک کاربر با استفاده از Supabase REST API
-        با استفاده از الگوی تراکنش دو مرحله‌ای برای تضمین همسانی داده‌ها
+        حذف یک کاربر
+        ردیف users در مسیر درخواست حذف می‌شود؛ حذف از کانال‌ها و Auth از طریق outbox انجام می‌شود
         """
         try:
             logger.info(f"شروع فرایند حذف کاربر با شناسه {pk}")
             
-            # مرحله 0: بررسی وجود کاربر
-            user = _make_request('GET', f"/rest/v1/users?uid=eq.{pk}")
+            user = _make_request('GET', tenancy.scoped(f"/rest/v1/users?uid=eq.{pk}", _tenant(self)), coalesce=False)
             if not user or (isinstance(user, list) and len(user) == 0):
                 logger.warning(f"کاربر با شناسه {pk} یافت نشد")
                 return Response(
@@ -860,154 +1134,25 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # اگر پاسخ یک لیست است، اولین آیتم را استفاده کن
             if isinstance(user, list) and len(user) > 0:
                 user = user[0]
             
-            # نگهداری داده‌های اصلی برای بازگشت در صورت خطا
-            original_user = user.copy()
-            
-            # مرحله 1: حذف کاربر از لیست کاربران مجاز تمام کانال‌ها
-            try:
-                # دریافت تمامی کانال‌ها
-                channels = _make_request('GET', f"/rest/v1/channels")
-                
-                if channels and isinstance(channels, list):
-                    for channel in channels:
-                        channel_id = channel.get('uid')
-                        allowed_users = channel.get('allowed_users', [])
-                        
-                        # اگر کاربر در لیست کاربران مجاز کانال وجود دارد، آن را حذف کن
-                        if pk in allowed_users:
-                            allowed_users.remove(pk)
-                            _make_request('PATCH', f"/rest/v1/channels?uid=eq.{channel_id}", {'allowed_users': allowed_users})
-                            logger.info(f"کاربر {pk} از لیست کاربران مجاز کانال {channel_id} حذف شد")
-            except Exception as e:
-                logger.error(f"خطا در حذف کاربر از لیست کاربران مجاز کانال‌ها: {e}")
-                # ادامه اجرا، زیرا این مرحله نباید کل فرآیند را متوقف کند
-            
-            # مرحله 2: حذف کاربر از جدول users
-            users_deleted = False
-            try:
-                logger.info(f"تلاش برای حذف کاربر {pk} از جدول users")
-                users_response = _make_request('DELETE', f"/rest/v1/users?uid=eq.{pk}")
-
-                if users_response is None:
-                    # بررسی آیا کاربر واقعاً حذف شده است
-                    check_user = _make_request('GET', f"/rest/v1/users?uid=eq.{pk}")
-                    if check_user is None or (isinstance(check_user, list) and len(check_user) == 0):
-                        users_deleted = True
-                        logger.info(f"کاربر {pk} با موفقیت از جدول users حذف شد")
-                    else:
-                        logger.error(f"خطا در حذف کاربر {pk} از جدول users - کاربر همچنان وجود دارد")
-                        return Response(
-                            {"detail": "خطا در حذف کاربر از جدول users"},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
-                else:
-                    users_deleted = True
-                    logger.info(f"کاربر {pk} با موفقیت از جدول users حذف شد")
-                
-            except Exception as users_err:
-                logger.error(f"خطا در حذف کاربر {pk} از جدول users: {users_err}")
-                
-            # مرحله 3: حذف کاربر از Supabase Auth (اول Auth حذف می‌کنیم، سپس جدول users)
-            auth_deleted = False
-            try:
-                logger.info(f"تلاش برای حذف کاربر {pk} از Auth")
-                auth_response = _make_request('DELETE', f"/auth/v1/admin/users/{pk}")
-                
-                # بررسی نتیجه حذف در Auth
-                if auth_response is None:
-                    # بررسی دقیق وضعیت حذف در Auth با درخواست مجدد
-                    auth_check = _make_request('GET', f"/auth/v1/admin/users/{pk}")
-                    
-                    if auth_check is None or (isinstance(auth_check, list) and len(auth_check) == 0) or (
-                        isinstance(auth_check, dict) and ('error_code' in auth_check or 'code' in auth_check)
-                    ):
-                        # کاربر در Auth وجود ندارد، عملیات حذف موفق بوده است
-                        logger.info(f"کاربر {pk} در Auth یافت نشد، احتمالاً حذف شده")
-                        auth_deleted = True
-                    else:
-                        logger.error(f"خطا در حذف کاربر {pk} از Auth - کاربر همچنان وجود دارد")
-                        return Response(
-                            {"detail": "خطا در حذف کاربر از Auth"},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
-                else:
-                    auth_deleted = True
-                    logger.info(f"کاربر {pk} با موفقیت از Auth حذف شد")
-            
-            except Exception as auth_err:
-                error_msg = str(auth_err)
-                logger.error(f"خطا در حذف کاربر {pk} از Auth: {error_msg}")
-                
-                # اگر خطا مربوط به 'Database error loading user' یا 'not_found' باشد، احتمالاً کاربر قبلاً از Auth حذف شده است
-                if "Database error loading user" in error_msg or "not_found" in error_msg or "unexpected_failure" in error_msg:
-                    logger.info(f"کاربر {pk} احتمالاً قبلاً از Auth حذف شده، ادامه عملیات...")
-                    auth_deleted = True
-                else:
-                    # برای سایر خطاها، فرآیند را متوقف می‌کنیم
-                    return Response(
-                        {"detail": f"خطا در حذف کاربر از Auth: {error_msg}"},
-                        status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                    )
-            
-            # مرحله 4: حذف کاربر از جدول users
-            users_deleted = False
-            if auth_deleted:
-                try:
-                    logger.info(f"تلاش برای حذف کاربر {pk} از جدول users")
-                    users_response = _make_request('DELETE', f"/rest/v1/users?uid=eq.{pk}")
-
-                    if users_response is None:
-                        # بررسی آیا کاربر واقعاً حذف شده است
-                        check_user = _make_request('GET', f"/rest/v1/users?uid=eq.{pk}")
-                        if check_user is None or (isinstance(check_user, list) and len(check_user) == 0):
-                            users_deleted = True
-                            logger.info(f"کاربر {pk} با موفقیت از جدول users حذف شد")
-                        else:
-                            logger.error(f"خطا در حذف کاربر {pk} از جدول users - کاربر همچنان وجود دارد")
-                            return Response(
-                                {"detail": "خطا در حذف کاربر از جدول users"},
-                                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                            )
-                    else:
-                        users_deleted = True
-                        logger.info(f"کاربر {pk} با موفقیت از جدول users حذف شد")
-                
-                except Exception as users_err:
-                    logger.error(f"خطا در حذف کاربر {pk} از جدول users: {users_err}")
-                    
-                    # اگر از Auth حذف شده اما از جدول users حذف نشده، یک پیام هشدار برگردان
-                    if auth_deleted:
-                        return Response(
-                            {"detail": f"هشدار: کاربر از Auth حذف شد اما از جدول users حذف نشد. خطا: {str(users_err)}"},
-                            status=status.HTTP_200_OK
-                        )
-                    else:
-                        return Response(
-                            {"detail": f"خطا در حذف کاربر: {str(users_err)}"},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                        )
+            # فقط کانال‌های ثبت شده در ردیف کاربر به‌روزرسانی می‌شوند، نه همه کانال‌ها
+            entry = user_lifecycle.record(
+                UserLifecycleOutbox.OPERATION_DELETE,
+                pk,
+                {"channels_removed": user.get('allowed_channels', []) or [], "tenant": _tenant(self)}
+            )
             
-            # مرحله 5: برگرداندن پاسخ نهایی
-            if users_deleted and auth_deleted:
+            if user_lifecycle.run_inline(entry):
                 return Response(
-                    {"detail": f"کاربر {pk} با موفقیت حذف شد"},
+                    {"detail": f"کاربر {pk} با موفقیت حذف شد", "outbox_id": entry.id},
                     status=status.HTTP_200_OK
                 )
-            elif auth_deleted:
-                return Response(
-                    {"detail": f"کاربر از Auth حذف شد اما از جدول users حذف نشد"},
-                    status=status.HTTP_200_OK
-                )
-            else:
-                return Response(
-                    {"detail": "خطای نامشخص در حذف کاربر"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-                
+            return Response(
+                {"detail": f"حذف کاربر {pk} در صف قرار گرفت", "outbox_id": entry.id},
+                status=status.HTTP_202_ACCEPTED
+            )
         except Exception as e:
             logger.error(f"خطا در حذف کاربر از Supabase: {e}")
             logger.error(traceback.format_exc())
@@ -1016,12 +1161,27 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class SuperAdminViewSet(viewsets.ModelViewSet):
+class SuperAdminViewSet(audit.AuditedViewSetMixin, viewsets.ModelViewSet):
+    """
+    حساب‌های سوپر ادمین
+    Platform staff manage every super admin; a super admin can only read its own row.
+    """
+    audit_entity = 'super_admin'
     authentication_classes = [SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    permission_classes = [tenancy.TenantPermission, tenancy.PlatformWritePermission]
     queryset = SuperAdmin.objects.using('supabase').all()
     serializer_class = SuperAdminSerializer
 
+    def get_queryset(self):
+        if self.action == 'list':
+            # فهرست از replica خوانده می‌شود (SupabaseRouter)؛ ویرایش و حذف روی primary می‌مانند
+            queryset = SuperAdmin.objects.all()
+        else:
+            queryset = super().get_queryset()
+        if not tenancy.is_platform(self.request.user):
+            queryset = queryset.filter(id=_tenant(self))
+        return queryset
+
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
         if not data.get('admin_super_user') or not data.get('admin_super_password') or not data.get('user_limit'):
@@ -1038,6 +1198,32 @@ class SuperAdminViewSet(viewsets.ModelViewSet):
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
+class MembershipSyncJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    وضعیت کارهای همگام‌سازی عضویت در صف
+    فیلترهای اختیاری: status و source_uid
+    A super admin only sees jobs of its own channels and users.
+    """
+    authentication_classes = [SessionAuthentication]
+    permission_classes = [tenancy.TenantPermission]
+    queryset = MembershipSyncJob.objects.using('supabase').all()
+    serializer_class = MembershipSyncJobSerializer
+
+    def get_queryset(self):
+        queryset = membership_sync.jobs_of_tenant(super().get_queryset(), _tenant(self)).order_by('-id')
+        job_status = self.request.query_params.get('status')
+        if job_status:
+            queryset = queryset.filter(status=job_status)
+        source_uid = self.request.query_params.get('source_uid')
+        if source_uid:
+            queryset = queryset.filter(source_uid=source_uid)
+        return queryset
+
+    def list(self, request):
+        # فقط جدیدترین کارها برگردانده می‌شوند تا پاسخ با رشد جدول بزرگ نشود
+        queryset = self.get_queryset()[:200]
+        return Response(self.get_serializer(queryset, many=True).data, status=status.HTTP_200_OK)
+
 @csrf_exempt
 @api_view(['POST', 'OPTIONS'])
 @authentication_classes([])
@@ -1111,7 +1297,8 @@ def user_view(request):
     django_user = request.user
 
     try:
-        super_admin = SuperAdmin.objects.using('supabase').get(admin_super_user=django_user.username)
+        # بدون using مشخص، SupabaseRouter خواندن را در صورت امکان به replica می‌فرستد
+        super_admin = SuperAdmin.objects.get(admin_super_user=django_user.username)
         data = {
             'id': super_admin.id,
             'username': super_admin.admin_super_user,
@@ -1133,3 +1320,121 @@ def user_view(request):
         response['Access-Control-Allow-Credentials'] = 'true'
     return response
 
+async def events_view(request):
+    """
+    استریم SSE تغییرات کانال‌ها، کاربران و عضویت‌ها
+    فیلترهای اختیاری: types=channel,user,membership و channel=<uid,...> و user=<uid,...>
+    Only served by the ASGI process (uvicorn admin_panel.asgi); a WSGI worker would be held for the whole stream.
+    A super admin only receives events of its own channels and users.
+    """
+    if 'wsgi.version' in request.META:
+        return JsonResponse({"detail": "این مسیر فقط از سرویس ASGI ارائه می‌شود"}, status=501)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+    try:
+        tenant = await sync_to_async(tenancy.tenant_for)(request)
+    except PermissionDenied:
+        return JsonResponse({"detail": "You do not have permission to perform this action."}, status=403)
+
+    event_filter = events.EventFilter.from_query(request.GET, tenant)
+    response = StreamingHttpResponse(
+        events.stream(event_filter, request.headers.get('Last-Event-ID')),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # جلوگیری از بافر شدن استریم در nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def export_view(request, dataset, fmt):
+    """
+    خروجی کامل users، channels یا memberships برای حسابرسی (/api/export/<dataset>.<csv|jsonl>)
+    The file is streamed page by page from the supabase database (console.export), so memory use
+    does not depend on the table size. A super admin only exports its own rows.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+    try:
+        tenant = tenancy.tenant_for(request)
+    except PermissionDenied:
+        return JsonResponse({"detail": "You do not have permission to perform this action."}, status=403)
+    if dataset not in export.DATASETS or fmt not in export.FORMATS:
+        return JsonResponse({"detail": "خروجی درخواست شده وجود ندارد"}, status=404)
+
+    response = StreamingHttpResponse(export.stream(dataset, fmt, tenant=tenant), content_type=export.CONTENT_TYPES[fmt])
+    filename = f"{dataset}-{datetime.date.today().isoformat()}.{fmt}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@csrf_exempt
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def livekit_token_view(request):
+    """
+    توکن‌های LiveKit برای کانال‌های مجاز کاربر (/api/livekit-token/)
+    The user authenticates with a Supabase access token (Authorization: Bearer) or, like the node
+    service's /api/node/token, with username and password. Optional `channel` limits the response to
+    one channel. Grants and tokens come from console.livekit's cache when possible.
+    """
+    if not livekit.is_configured():
+        logger.error("کلیدهای API LiveKit تنظیم نشده است")
+        return Response({'error': 'خطا در تنظیمات سرور'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth_header.startswith('Bearer '):
+        user_uid = livekit.user_from_access_token(auth_header[len('Bearer '):])
+    else:
+        username = request.data.get('username') or request.data.get('email')
+        password = request.data.get('password')
+        if not username or not password:
+            return Response({'error': 'نام کاربری و رمز عبور الزامی است.'}, status=status.HTTP_400_BAD_REQUEST)
+        user_uid = sign_in_with_password(username, password)
+    if not user_uid:
+        return Response({'error': 'احراز هویت ناموفق بود'}, status=status.HTTP_401_UNAUTHORIZED)
+
+    grants = livekit.grants_for(user_uid)
+    if grants is None:
+        return Response({'error': 'اطلاعات کاربر یافت نشد'}, status=status.HTTP_404_NOT_FOUND)
+    if not grants.active:
+        return Response({'error': 'حساب کاربری شما غیرفعال شده است.'}, status=status.HTTP_403_FORBIDDEN)
+    channel_uid = request.data.get('channel') or request.query_params.get('channel')
+    if channel_uid and channel_uid not in grants.channels:
+        return Response({'error': 'شما به این کانال دسترسی ندارید.'}, status=status.HTTP_403_FORBIDDEN)
+
+    response = Response({
+        'message': 'احراز هویت موفق',
+        'username': grants.username,
+        'userId': str(user_uid),
+        'channels': livekit.issue_tokens(grants, channel_uid or None),
+    }, status=status.HTTP_200_OK)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+@csrf_exempt
+def livekit_webhook_view(request):
+    """
+    دریافت webhook رویدادهای اتاق، شرکت‌کننده و track از LiveKit (/api/livekit-webhook/)
+    The request is only verified and buffered here; console.livekit_webhooks writes the buffer to the
+    livekit_event table in batches, so a burst of events costs no database write per request.
+    """
+    if request.method != 'POST':
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+    if not livekit.is_configured():
+        logger.error("کلیدهای API LiveKit تنظیم نشده است")
+        return JsonResponse({"detail": "خطا در تنظیمات سرور"}, status=500)
+    try:
+        event = livekit_webhooks.verify(request.body, request.headers.get('Authorization', ''))
+    except livekit_webhooks.InvalidWebhook as e:
+        logger.warning(f"webhook نامعتبر LiveKit: {e}")
+        return JsonResponse({"detail": "امضای webhook نامعتبر است"}, status=401)
+
+    row = livekit_webhooks.to_row(event, request.body)
+    if row is not None and not livekit_webhooks.buffer.add(row):
+        logger.warning("بافر رویدادهای LiveKit پر است؛ webhook رد شد تا دوباره ارسال شود")
+        response = JsonResponse({"detail": "بافر رویدادها پر است"}, status=503)
+        response['Retry-After'] = '5'
+        return response
+    return HttpResponse(status=204)
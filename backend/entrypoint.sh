@@ -3,8 +3,18 @@ set -e
 
 # نصب livekit حذف شد
 
+# سرور ASGI برای استریم رویدادها (/api/events/)
+if [ "$1" = "asgi" ]; then
+    exec uvicorn admin_panel.asgi:application --host 0.0.0.0 --port 8011 --timeout-keep-alive 75
+fi
+
+# اجرای دستور مدیریتی دلخواه (مثلاً کارگرهای پس‌زمینه) به جای سرور
+if [ "$#" -gt 0 ]; then
+    exec python manage.py "$@"
+fi
+
 # اجرای مهاجرت‌های دیتابیس
 python manage.py migrate --noinput
 
 # اجرای سرور Django
-exec gunicorn admin_panel.wsgi:application --bind 0.0.0.0:8010 --workers 3
+exec gunicorn admin_panel.wsgi:application --bind 0.0.0.0:8010 --workers 3 --threads ${GUNICORN_THREADS:-4}
@@ -31,6 +31,11 @@ import DeleteIcon from '@mui/icons-material/Delete';
 import EditIcon from '@mui/icons-material/Edit';
 import { apiFetch } from '../utils/api';
 
+// تعداد کانال‌های هر صفحه از جستجوی سمت سرور
+const CHANNELS_PAGE_SIZE = 50;
+// تأخیر ارسال جستجو پس از آخرین تایپ (میلی‌ثانیه)
+const CHANNEL_SEARCH_DEBOUNCE_MS = 300;
+
 /**
  * ChannelManagement
  * Manages channels: fetch list, open dialog for add/edit, transfer users
@@ -43,6 +48,7 @@ function ChannelManagement() {
   const [deletingId, setDeletingId] = useState(null);
   const [deleteError, setDeleteError] = useState('');
   const [channels, setChannels] = useState([]);
+  const [hasMoreChannels, setHasMoreChannels] = useState(false);
   const [loadingChannels, setLoadingChannels] = useState(false);
   const [loadingUsers, setLoadingUsers] = useState(false);
   const [error, setError] = useState('');
@@ -66,26 +72,24 @@ function ChannelManagement() {
   const [deleteConfirmOpen, setDeleteConfirmOpen] = useState(false);
   const [channelToDelete, setChannelToDelete] = useState(null);
 
-  // Table filter
+  // Table rows; search (with Persian normalization) and ordering happen on the server (/api/channels/?q=)
   const filteredChannels = useMemo(() => {
     // محافظت: اطمینان از آرایه بودن channels
     const safeChannels = Array.isArray(channels) ? channels : [];
     
-    return safeChannels
-      .filter(c => {
-        if (!c || typeof c !== 'object') return false;
-        if (!c.name) return false;
-        return c.name.toLowerCase().includes((channelSearchQuery || '').toLowerCase());
-      })
-      .sort((a, b) => a.name.localeCompare(b.name, 'fa')); // مرتب‌سازی بر اساس حروف فارسی
-  }, [channels, channelSearchQuery]);
-
-  // Fetch all channels from backend
-  const fetchChannels = async () => {
+    return safeChannels.filter(c => c && typeof c === 'object' && c.name);
+  }, [channels]);
+
+  // Fetch one page of channels matching the search box from backend
+  const fetchChannels = async (offset = 0) => {
     setLoadingChannels(true);
     setError('');
     try {
-      const data = await apiFetch('/api/channels/');
+      const params = new URLSearchParams({ limit: CHANNELS_PAGE_SIZE, offset });
+      if ((channelSearchQuery || '').trim()) {
+        params.set('q', channelSearchQuery.trim());
+      }
+      const data = await apiFetch(`/api/channels/?${params.toString()}`);
 
       // مدیریت جامع انواع مختلف پاسخ
       let channelsArray = [];
@@ -130,11 +134,15 @@ function ChannelManagement() {
         channelsArray = [];
       }
 
-      setChannels(channelsArray);
+      setChannels((prev) => (offset > 0 ? [...prev, ...channelsArray] : channelsArray));
+      setHasMoreChannels(Boolean(data?.has_more));
     } catch (err) {
       console.error('Error fetching channels:', err);
       setError('خطا در دریافت لیست کانال‌ها. لطفا دوباره تلاش کنید.');
-      setChannels([]);
+      if (offset === 0) {
+        setChannels([]);
+      }
+      setHasMoreChannels(false);
     } finally {
       setLoadingChannels(false);
     }
@@ -165,10 +173,15 @@ function ChannelManagement() {
   };
 
   useEffect(() => {
-    fetchChannels();
     fetchUsers();
   }, []);
 
+  useEffect(() => {
+    const timer = setTimeout(() => fetchChannels(), CHANNEL_SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [channelSearchQuery]);
+
   // Open dialog for creating or editing a channel
   const handleClickOpen = (channel = null) => {
     setSelectedAvailable([]);
@@ -294,7 +307,7 @@ function ChannelManagement() {
     : [];
 
   const renderChannels = () => {
-    if (loadingChannels) {
+    if (loadingChannels && filteredChannels.length === 0) {
       return (
         <TableRow>
           <TableCell colSpan={4} align="center">
@@ -376,6 +389,13 @@ function ChannelManagement() {
             </TableBody>
           </Table>
         </TableContainer>
+        {hasMoreChannels && (
+          <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+            <Button variant="outlined" onClick={() => fetchChannels(channels.length)} disabled={loadingChannels}>
+              نمایش کانال‌های بیشتر
+            </Button>
+          </Box>
+        )}
       </Paper>
       <Dialog open={open} onClose={handleClose} fullWidth maxWidth="sm" sx={{ '& .MuiDialog-paper': { width: 600, maxWidth: '600px' } }}>
         <DialogTitle sx={{ textAlign: 'right' }}>
@@ -4,7 +4,7 @@
  * Supports CRUD operations and dual-list transfer UI with CSRF-protected API calls.
  */
 
-import React, { useState, useEffect, useMemo } from 'react';
+import React, { useState, useEffect } from 'react';
 import {
   Box,
   Button,
@@ -38,6 +38,11 @@ import DeleteIcon from '@mui/icons-material/Delete';
 import EditIcon from '@mui/icons-material/Edit';
 import { apiFetch } from '../utils/api';
 
+// تعداد کاربران هر صفحه از جستجوی سمت سرور
+const USERS_PAGE_SIZE = 50;
+// تأخیر ارسال جستجو پس از آخرین تایپ (میلی‌ثانیه)
+const USER_SEARCH_DEBOUNCE_MS = 300;
+
 /**
  * UserManagement
  * Provides UI and logic for listing, creating, editing, and deleting users.
@@ -47,6 +52,7 @@ function UserManagement() {
   const [deletingId, setDeletingId] = useState(null);
   const [deleteError, setDeleteError] = useState('');
   const [users, setUsers] = useState([]);
+  const [hasMoreUsers, setHasMoreUsers] = useState(false);
   const [loadingUsers, setLoadingUsers] = useState(false);
   const [loadingChannels, setLoadingChannels] = useState(false);
   const [error, setError] = useState('');
@@ -59,11 +65,8 @@ function UserManagement() {
 
   const [userSearchQuery, setUserSearchQuery] = useState('');
 
-  const filteredUsers = useMemo(() => {
-    return (users || [])
-      .filter((u) => u.username.toLowerCase().includes(userSearchQuery.toLowerCase()))
-      .sort((a, b) => a.username.localeCompare(b.username, 'fa')); // مرتب‌سازی بر اساس حروف فارسی
-  }, [users, userSearchQuery]);
+  // جستجو و مرتب‌سازی در سرور انجام می‌شود (/api/users/?q=)
+  const filteredUsers = users || [];
 
   // Toggle selection of channels not assigned to user
   const handleSelectAvailable = (id) => {
@@ -120,21 +123,35 @@ function UserManagement() {
   const [userToDelete, setUserToDelete] = useState(null);
 
   useEffect(() => {
-    fetchUsers();
     fetchChannels();
   }, []);
 
-  // Fetch all users from backend
-  const fetchUsers = async () => {
+  useEffect(() => {
+    const timer = setTimeout(() => fetchUsers(), USER_SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [userSearchQuery]);
+
+  // Fetch one page of users matching the search box from backend
+  const fetchUsers = async (offset = 0) => {
     setLoadingUsers(true);
     setError('');
     try {
-      const data = await apiFetch('/api/users/');
-      setUsers(Array.isArray(data) ? data : []);
+      const params = new URLSearchParams({ limit: USERS_PAGE_SIZE, offset });
+      if (userSearchQuery.trim()) {
+        params.set('q', userSearchQuery.trim());
+      }
+      const data = await apiFetch(`/api/users/?${params.toString()}`);
+      const page = Array.isArray(data?.results) ? data.results : [];
+      setUsers((prev) => (offset > 0 ? [...prev, ...page] : page));
+      setHasMoreUsers(Boolean(data?.has_more));
     } catch (err) {
       console.error('خطا در دریافت کاربران:', err);
       setError('خطا در دریافت لیست کاربران. لطفا دوباره تلاش کنید.');
-      setUsers([]);
+      if (offset === 0) {
+        setUsers([]);
+      }
+      setHasMoreUsers(false);
     } finally {
       setLoadingUsers(false);
     }
@@ -389,7 +406,7 @@ function UserManagement() {
               </TableRow>
             </TableHead>
             <TableBody>
-              {loadingUsers ? (
+              {loadingUsers && filteredUsers.length === 0 ? (
                 <TableRow>
                   <TableCell colSpan={4} align="center">در حال بارگذاری کاربران...</TableCell>
                 </TableRow>
@@ -417,6 +434,13 @@ function UserManagement() {
             </TableBody>
           </Table>
         </TableContainer>
+        {hasMoreUsers && (
+          <Box sx={{ display: 'flex', justifyContent: 'center', mt: 2 }}>
+            <Button variant="outlined" onClick={() => fetchUsers(users.length)} disabled={loadingUsers}>
+              نمایش کاربران بیشتر
+            </Button>
+          </Box>
+        )}
       </Paper>
       <Dialog open={open} onClose={handleClose} maxWidth="sm" fullWidth sx={{ '& .MuiDialog-paper': { width: 600, maxWidth: '600px' } }}>
         <DialogTitle sx={{ textAlign: 'right' }}>{editMode ? 'ویرایش کاربر' : 'افزودن کاربر جدید'}</DialogTitle>